@@ -389,21 +389,52 @@ export default function GroupDetailPage() {
 
         setStatsLoading(true);
         const statsRef = doc(db, "groupStats", groupId);
-
-        const unsubscribe = onSnapshot(statsRef, (docSnap) => {
-            if (docSnap.exists()) {
-                setGroupStats({ ...docSnap.data() } as GroupStats);
+        const playersRef = collection(db, "groupStats", groupId, "players");
+
+        // Player stats live in groupStats/{groupId}/players/{playerId}; the
+        // summary doc only carries playerStats for stats written before that.
+        let summary: DocumentData | null | undefined;
+        let playerStats: GroupStats['playerStats'] | undefined;
+
+        const publishStats = () => {
+            if (summary === undefined || playerStats === undefined) return;
+            if (summary) {
+                setGroupStats({
+                    ...summary,
+                    playerStats: Object.keys(playerStats).length > 0
+                        ? playerStats
+                        : summary.playerStats || {},
+                } as GroupStats);
             } else {
                 setGroupStats(null);
             }
             setStatsLoading(false);
-        }, (err) => {
+        };
+
+        const handleStatsError = (err: Error) => {
             console.error("Error fetching group statistics:", err);
             setStatsLoading(false);
             toast.error("Error fetching statistics", { description: err.message });
-        });
+        };
 
-        return () => unsubscribe();
+        const unsubscribeSummary = onSnapshot(statsRef, (docSnap) => {
+            summary = docSnap.exists() ? docSnap.data() : null;
+            publishStats();
+        }, handleStatsError);
+
+        const unsubscribePlayers = onSnapshot(playersRef, (snapshot: QuerySnapshot<DocumentData>) => {
+            const players: GroupStats['playerStats'] = {};
+            snapshot.forEach((playerDoc) => {
+                players[playerDoc.id] = playerDoc.data() as PlayerStats;
+            });
+            playerStats = players;
+            publishStats();
+        }, handleStatsError);
+
+        return () => {
+            unsubscribeSummary();
+            unsubscribePlayers();
+        };
     }, [groupId, group, error, groupLoading]);
 
     if (authLoading || groupLoading) {
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The Cloud Functions modules import each other by their top-level names, the
+# way they are deployed; make them importable when run from the repo root.
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "functions")
+if FUNCTIONS_DIR not in sys.path:
+    sys.path.insert(0, FUNCTIONS_DIR)
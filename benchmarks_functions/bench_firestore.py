@@ -0,0 +1,82 @@
+"""The in-memory Firestore with a synthetic `matches` collection.
+
+Matches are generated page by page from a SyntheticGroup instead of being
+stored, so a replay over a million matches streams the way it does against
+Firestore without holding the group in memory. Every other document lives in
+the regular in-memory store, which also records the encoded size of each write.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from memory_firestore import (
+    MemoryDocumentSnapshot,
+    MemoryFirestore,
+    MemoryQuery,
+    MemoryTransaction,
+    Path,
+)
+from stats_players import get_payload_size
+
+from benchmarks_functions.synthetic import SyntheticGroup
+
+
+class GeneratedSnapshot(MemoryDocumentSnapshot):
+    """A snapshot of a freshly generated match, which nothing else shares."""
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return self._data
+
+
+class BenchFirestore(MemoryFirestore):
+    def __init__(self, group: SyntheticGroup) -> None:
+        super().__init__()
+        self.group = group
+        self.bytes_written: Dict[Path, int] = {}
+        self.document("groups", group.group_id).set(group.group_data)
+        self.reset_stats()
+        self.bytes_written.clear()
+
+    def _record_write(self, path: Path, method: str, data: Any) -> None:
+        if method != "delete":
+            self.bytes_written[path] = get_payload_size(data)
+
+    def _run_query(
+        self, query: MemoryQuery, transaction: Optional[MemoryTransaction]
+    ) -> List[MemoryDocumentSnapshot]:
+        if query._parent or query._collection_id != "matches":
+            return super()._run_query(query, transaction)
+
+        snapshots = [
+            GeneratedSnapshot(
+                self.collection("matches").document(match_id),
+                query._project(match_data),
+            )
+            for match_id, match_data in self._match_page(query)
+        ]
+        with self._lock:
+            self.reads += max(len(snapshots), 1)
+            self.operations["query"] += 1
+        return snapshots
+
+    def _match_page(self, query: MemoryQuery) -> List[Tuple[str, Dict[str, Any]]]:
+        group = self.group
+        filters = [
+            (condition.field_path, condition.op_string, condition.value)
+            for condition in query._filters
+        ]
+        if filters != [("groupId", "==", group.group_id)] or query._orders != [
+            (("playedAt",), "ASCENDING")
+        ]:
+            raise NotImplementedError("Only the stats replay query is supported")
+
+        start = 0
+        if query._start is not None:
+            cursor, _inclusive = query._start
+            if isinstance(cursor, MemoryDocumentSnapshot):
+                start = int(cursor.id[1:]) + 1
+            else:
+                start = group.index_after(cursor["playedAt"])
+        end = len(group)
+        if query._limit is not None:
+            end = min(end, start + query._limit)
+        return [group.match(index) for index in range(start, end)]
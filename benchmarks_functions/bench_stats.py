@@ -0,0 +1,267 @@
+"""Benchmark the group stats engine on synthetic groups.
+
+Run from the repository root:
+
+    python -m benchmarks_functions.bench_stats --sizes 100,10000,1000000
+
+For each group size this reports recompute throughput and per-match latency,
+the cost of process_match and calculate_derived_stats on their own, the size
+of the stats documents written (and of the single document the old layout
+would have needed), and peak memory. `--json` writes the results so a later
+run can be compared with `--baseline`, which exits non-zero on a throughput
+regression beyond `--tolerance`.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+import match_stats
+import stats_columnar
+from match_stats import (
+    calculate_derived_stats,
+    create_stats_state,
+    fold_match_into_state,
+    recalculate_group_stats,
+)
+from stats_players import PLAYERS_COLLECTION, get_payload_size
+
+from benchmarks_functions.bench_firestore import BenchFirestore
+from benchmarks_functions.synthetic import SyntheticGroup
+
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000]
+# Matches timed through process_match alone; enough for a stable per-match
+# figure without holding a large group in memory.
+MAX_PROCESS_SAMPLE = 20_000
+DERIVED_STATS_ROUNDS = 200
+FIRESTORE_DOC_LIMIT = 1_048_576
+
+
+def configure_engine(engine: str, workers: int) -> None:
+    match_stats.STATS_ENGINE = engine
+    match_stats.STATS_PARALLEL_WORKERS = workers
+    stats_columnar.STATS_PARALLEL_WORKERS = workers
+
+
+def time_source(group: SyntheticGroup) -> float:
+    """Seconds spent generating the matches, which the recompute also pays."""
+    started = time.perf_counter()
+    for _match in group:
+        pass
+    return time.perf_counter() - started
+
+
+def time_recompute(group: SyntheticGroup) -> Dict[str, Any]:
+    db = BenchFirestore(group)
+    started = time.perf_counter()
+    if not recalculate_group_stats(db, group.group_id):
+        raise RuntimeError(f"Recompute failed for {len(group)} matches")
+    elapsed = time.perf_counter() - started
+    return {"db": db, "seconds": elapsed}
+
+
+def time_process_match(group: SyntheticGroup) -> float:
+    """Mean microseconds per match folded through process_match."""
+    sample = [
+        group.match(index) for index in range(min(len(group), MAX_PROCESS_SAMPLE))
+    ]
+    state = create_stats_state(group.group_data)
+    started = time.perf_counter()
+    for match_id, match_data in sample:
+        fold_match_into_state(state, match_id, match_data)
+    return (time.perf_counter() - started) / len(sample) * 1e6
+
+
+def time_derived_stats(db: BenchFirestore, group: SyntheticGroup) -> float:
+    """Mean microseconds per calculate_derived_stats call on the final stats."""
+    summary, player_stats = get_stats_docs(db, group)
+    rounds = [copy.deepcopy(player_stats) for _ in range(DERIVED_STATS_ROUNDS)]
+    started = time.perf_counter()
+    for player_stats in rounds:
+        calculate_derived_stats(player_stats, summary["teamColorStats"])
+    return (time.perf_counter() - started) / DERIVED_STATS_ROUNDS * 1e6
+
+
+def get_stats_docs(
+    db: BenchFirestore, group: SyntheticGroup
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """The stored summary doc and the player docs by player id."""
+    documents = db.dump()
+    stats_path = f"groupStats/{group.group_id}"
+    players_path = f"{stats_path}/{PLAYERS_COLLECTION}/"
+    return documents[stats_path], {
+        path[len(players_path) :]: data
+        for path, data in documents.items()
+        if path.startswith(players_path)
+    }
+
+
+def measure_payloads(db: BenchFirestore, group: SyntheticGroup) -> Dict[str, int]:
+    operations = {"reads": db.reads, "writes": db.writes + db.deletes}
+    summary, player_docs = get_stats_docs(db, group)
+    player_sizes = [get_payload_size(data) for data in player_docs.values()]
+    legacy_size = get_payload_size({**summary, "playerStats": player_docs})
+    return {
+        "summary_bytes": get_payload_size(summary),
+        "player_docs": len(player_docs),
+        "player_bytes": sum(player_sizes),
+        "largest_player_bytes": max(player_sizes, default=0),
+        "single_doc_bytes": legacy_size,
+        "written_bytes": sum(db.bytes_written.values()),
+        **operations,
+    }
+
+
+def measure_peak_memory(group: SyntheticGroup) -> int:
+    tracemalloc.start()
+    try:
+        recalculate_group_stats(BenchFirestore(group), group.group_id)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run_benchmark(
+    size: int, players: int, repeat: int = 1, seed: int = 0, memory: bool = True
+) -> Dict[str, Any]:
+    members = max(1, players * 3 // 5)
+    group = SyntheticGroup(
+        size, member_count=members, guest_count=players - members, seed=seed
+    )
+
+    source_seconds = time_source(group)
+    runs = [time_recompute(group) for _ in range(repeat)]
+    best = min(runs, key=lambda run: run["seconds"])
+    db = best["db"]
+    seconds = best["seconds"]
+
+    result = {
+        "matches": size,
+        "players": players,
+        "recompute_seconds": round(seconds, 4),
+        "source_seconds": round(source_seconds, 4),
+        "matches_per_second": round(size / seconds, 1),
+        "us_per_match": round(seconds / size * 1e6, 2),
+        # Without the cost of generating the synthetic matches
+        "engine_us_per_match": round(max(seconds - source_seconds, 0) / size * 1e6, 2),
+        "process_match_us": round(time_process_match(group), 2),
+        **measure_payloads(db, group),
+        "derived_stats_us": round(time_derived_stats(db, group), 2),
+    }
+    if memory:
+        result["peak_memory_bytes"] = measure_peak_memory(group)
+    return result
+
+
+def compare_with_baseline(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Describe every size whose throughput fell more than `tolerance` below."""
+    previous = {entry["matches"]: entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["matches"])
+        if before is None:
+            continue
+        floor = before["matches_per_second"] * (1 - tolerance)
+        if result["matches_per_second"] < floor:
+            regressions.append(
+                f"{result['matches']} matches: {result['matches_per_second']} "
+                f"matches/s, baseline {before['matches_per_second']}"
+            )
+    return regressions
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    columns = [
+        ("matches", "matches"),
+        ("matches_per_second", "matches/s"),
+        ("us_per_match", "us/match"),
+        ("engine_us_per_match", "engine us"),
+        ("process_match_us", "process us"),
+        ("derived_stats_us", "derived us"),
+        ("summary_bytes", "summary B"),
+        ("largest_player_bytes", "player B"),
+        ("single_doc_bytes", "1-doc B"),
+        ("peak_memory_bytes", "peak mem B"),
+    ]
+    rows = [[label for _key, label in columns]]
+    for result in results:
+        rows.append([str(result.get(key, "-")) for key, _label in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    lines = [
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths, strict=True))
+        for row in rows
+    ]
+
+    for result in results:
+        if result["single_doc_bytes"] > FIRESTORE_DOC_LIMIT:
+            lines.append(
+                f"{result['matches']} matches: a single stats doc would exceed "
+                "Firestore's 1 MiB limit"
+            )
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma-separated match counts (default: %(default)s)",
+    )
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--engine", choices=["python", "columnar"], default="python")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    configure_engine(args.engine, args.workers)
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        results.append(
+            run_benchmark(
+                size,
+                args.players,
+                repeat=args.repeat,
+                seed=args.seed,
+                memory=not args.no_memory,
+            )
+        )
+        results[-1]["engine"] = args.engine
+    print(format_results(results))
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(
+                results, json.load(baseline_file), args.tolerance
+            )
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""Deterministic synthetic foosball groups for benchmarking the stats engine.
+
+Matches are generated on demand from (seed, index), so a group of a million
+matches never has to be held in memory and can be paged like Firestore would.
+"""
+
+import bisect
+import itertools
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+TEAM_COLORS = ("#ff0000", "#0000ff")
+# Matches played on days without any activity are rare but real (holidays,
+# office closures); weekends see a fraction of weekday traffic.
+WEEKEND_ACTIVITY = 0.15
+IDLE_DAY_PROBABILITY = 0.05
+
+
+class SyntheticGroup:
+    """A group with a Zipf-skewed roster and a realistic playedAt spread.
+
+    - Participation follows a Zipf law: a few regulars play most matches.
+    - `two_v_two_share` of matches are 2v2, the rest 1v1.
+    - `dict_players_share` of teams store `players` as the legacy index-keyed
+      map instead of a list.
+    - `former_players` are not in the roster any more but still appear in old
+      matches, which the stats engine has to skip.
+    - Matches land at noon on their day, like the frontend stores them, with
+      createdAt ordering same-day matches; busy days come in bursts.
+    """
+
+    def __init__(
+        self,
+        match_count: int,
+        member_count: int = 12,
+        guest_count: int = 8,
+        former_players: int = 2,
+        seed: int = 0,
+        zipf_exponent: float = 1.1,
+        two_v_two_share: float = 0.6,
+        dict_players_share: float = 0.3,
+        draw_share: float = 0.05,
+        matches_per_day: float = 8.0,
+        start: datetime = datetime(2023, 1, 2, tzinfo=timezone.utc),
+        group_id: str = "bench-group",
+    ) -> None:
+        self.match_count = match_count
+        self.seed = seed
+        self.group_id = group_id
+        self.two_v_two_share = two_v_two_share
+        self.dict_players_share = dict_players_share
+        self.draw_share = draw_share
+        self.start = start.replace(hour=12, minute=0, second=0, microsecond=0)
+
+        rng = random.Random(seed)
+        members = [f"member_{i:03d}" for i in range(member_count)]
+        guests = [f"g{i:03d}" for i in range(guest_count)]
+        former = [f"former_{i:03d}" for i in range(former_players)]
+
+        self.group_data = {
+            "name": "Benchmark group",
+            "adminUid": members[0],
+            "members": {
+                member_id: {
+                    "name": f"Member {i}",
+                    "role": "admin" if i == 0 else rng.choice(["editor", "viewer"]),
+                }
+                for i, member_id in enumerate(members)
+            },
+            "guests": [
+                {"id": guest_id, "name": f"Guest {i}"}
+                for i, guest_id in enumerate(guests)
+            ],
+            "teamColors": {"teamOne": TEAM_COLORS[0], "teamTwo": TEAM_COLORS[1]},
+        }
+
+        players = members + [f"guest_{guest_id}" for guest_id in guests] + former
+        rng.shuffle(players)
+        self.players = [
+            {"uid": player_id, "displayName": player_id.replace("_", " ").title()}
+            for player_id in players
+        ]
+        weights = [1 / (rank + 1) ** zipf_exponent for rank in range(len(players))]
+        self.cumulative_weights = list(itertools.accumulate(weights))
+
+        self.day_ends = self._spread_over_days(rng, match_count, matches_per_day)
+
+    @staticmethod
+    def _spread_over_days(
+        rng: random.Random, match_count: int, matches_per_day: float
+    ) -> List[int]:
+        """Cumulative match counts per day: weekday-heavy, bursty, with gaps."""
+        day_count = max(1, math.ceil(match_count / matches_per_day))
+        activity = []
+        for day in range(day_count):
+            if rng.random() < IDLE_DAY_PROBABILITY:
+                activity.append(0.0)
+                continue
+            weekday_factor = WEEKEND_ACTIVITY if day % 7 >= 5 else 1.0
+            activity.append(weekday_factor * rng.lognormvariate(0, 0.6))
+
+        total = sum(activity) or 1.0
+        day_ends = []
+        assigned = 0.0
+        for weight in activity:
+            assigned += weight * match_count / total
+            day_ends.append(min(match_count, round(assigned)))
+        day_ends[-1] = match_count
+        return day_ends
+
+    def __len__(self) -> int:
+        return self.match_count
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for index in range(self.match_count):
+            yield self.match(index)
+
+    def match_id(self, index: int) -> str:
+        return f"m{index:08d}"
+
+    def played_at(self, index: int) -> datetime:
+        day = bisect.bisect_right(self.day_ends, index)
+        return self.start + timedelta(days=day)
+
+    def index_after(self, played_at: datetime) -> int:
+        """Index of the first match played strictly after `played_at`."""
+        day = (played_at - self.start) // timedelta(days=1)
+        if day < 0:
+            return 0
+        if day >= len(self.day_ends):
+            return self.match_count
+        return self.day_ends[day]
+
+    def pick_players(self, rng: random.Random, count: int) -> List[Dict[str, Any]]:
+        picked: Dict[int, None] = {}
+        while len(picked) < count:
+            (position,) = rng.choices(
+                range(len(self.players)), cum_weights=self.cumulative_weights
+            )
+            picked[position] = None
+        return [self.players[position] for position in picked]
+
+    def make_team(
+        self, rng: random.Random, color: str, score: int, players: List[Dict]
+    ) -> Dict[str, Any]:
+        if rng.random() < self.dict_players_share:
+            players = {str(i): player for i, player in enumerate(players)}
+        return {"color": color, "score": score, "players": players}
+
+    def match(self, index: int) -> Tuple[str, Dict[str, Any]]:
+        rng = random.Random(self.seed * 1_000_003 + index)
+        is_two_v_two = rng.random() < self.two_v_two_share
+        team_size = 2 if is_two_v_two else 1
+        players = self.pick_players(rng, team_size * 2)
+
+        if rng.random() < self.draw_share:
+            score1 = score2 = rng.randint(0, 9)
+        else:
+            score1, score2 = 10, rng.randint(0, 9)
+            if rng.random() < 0.5:
+                score1, score2 = score2, score1
+        winner = "draw"
+        if score1 != score2:
+            winner = "team1" if score1 > score2 else "team2"
+
+        played_at = self.played_at(index)
+        created_at = played_at + timedelta(
+            seconds=rng.randint(-4 * 3600, 8 * 3600), microseconds=index % 1_000_000
+        )
+        return self.match_id(index), {
+            "groupId": self.group_id,
+            "gameType": "2v2" if is_two_v_two else "1v1",
+            "team1": self.make_team(rng, TEAM_COLORS[0], score1, players[:team_size]),
+            "team2": self.make_team(rng, TEAM_COLORS[1], score2, players[team_size:]),
+            "winner": winner,
+            "playedAt": played_at,
+            "createdAt": created_at,
+            "createdBy": self.group_data["adminUid"],
+        }
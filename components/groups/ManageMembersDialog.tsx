@@ -231,7 +231,7 @@ export default function ManageMembersDialog({
       setSelectedGuest('');
       setSelectedMember('');
       
-      toast.success('Guest successfully migrated to member');
+      toast.success('Guest migration started; stats will update once it finishes');
     } catch (error) {
       console.error('Error migrating guest to member:', error);
       toast.error('Failed to migrate guest');
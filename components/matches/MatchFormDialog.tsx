@@ -477,8 +477,12 @@ export default function MatchFormDialog({
                 winner: winner || 'draw',
                 createdBy: user.uid,
             };
+            // Lets the backend find a player's matches without scanning the group
+            const participantUids = Array.from(new Set(
+                [...matchDocData.team1.players, ...matchDocData.team2.players].map(player => player.uid)
+            )).sort();
 
-            const cleanedMatchData = cleanObject(matchDocData);
+            const cleanedMatchData = cleanObject({ ...matchDocData, participantUids });
 
             if (editingMatch) {
                 const matchRef = doc(db, "matches", editingMatch.id);
@@ -0,0 +1,55 @@
+from typing import List
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.bulk_writer import (
+    BulkRetry,
+    BulkWriteFailure,
+    BulkWriter,
+    BulkWriterOptions,
+)
+from instrumentation import phase
+
+# BulkWriter starts at 500 ops/s and ramps up to its maximum, which defaults
+# to 500 as well
+DEFAULT_MAX_OPS_PER_SECOND = 2000
+# Attempts per write, with exponential backoff between them
+DEFAULT_MAX_ATTEMPTS = 8
+
+
+def create_bulk_writer(
+    db: firestore.Client,
+    failures: List[BulkWriteFailure],
+    max_ops_per_second: int = DEFAULT_MAX_OPS_PER_SECOND,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> BulkWriter:
+    """A bulk writer that sends batches concurrently and retries failed writes.
+
+    Writes that still fail after `max_attempts` are added to `failures`.
+    """
+
+    def on_write_error(failure: BulkWriteFailure, _bulk_writer: BulkWriter) -> bool:
+        if failure.attempts < max_attempts:
+            return True
+        failures.append(failure)
+        return False
+
+    bulk_writer = db.bulk_writer(
+        options=BulkWriterOptions(
+            max_ops_per_second=max_ops_per_second,
+            retry=BulkRetry.exponential,
+        )
+    )
+    bulk_writer.on_write_error(on_write_error)
+    return bulk_writer
+
+
+def flush_bulk_writer(
+    bulk_writer: BulkWriter, failures: List[BulkWriteFailure], description: str
+) -> None:
+    """Wait for every queued write, failing if any of them gave up."""
+    with phase("write"):
+        bulk_writer.flush()
+    if failures:
+        raise RuntimeError(
+            f"Failed to write {len(failures)} {description}: {failures[0].message}"
+        )
@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from instrumentation import count_deletes, count_query, count_reads, count_writes
+
+CLEANUP_JOBS_COLLECTION = "cleanupJobs"
+# How long an invocation owns a cleanup job; longer than the function timeout,
+# so a job only changes hands once its owner has stopped.
+CLEANUP_LEASE_SECONDS = 120
+MAX_JOBS_PER_RUN = 10
+
+
+def is_claimable(job_data: Dict[str, Any], now: datetime) -> bool:
+    lease_until = job_data.get("leaseUntil")
+    return lease_until is None or lease_until <= now
+
+
+def claim_cleanup_job(
+    db: firestore.Client, group_id: str, create: bool = True
+) -> Optional[Dict[str, Any]]:
+    """Lease a group's cleanup job, creating it on the first call.
+
+    Returns the job with its progress (`matchesDeleted`, `lastMatchId`), or
+    None when another invocation holds the lease.
+    """
+    job_ref = db.collection(CLEANUP_JOBS_COLLECTION).document(group_id)
+    return _claim_job(
+        db.transaction(), job_ref, group_id, datetime.now(timezone.utc), create
+    )
+
+
+@firestore.transactional
+def _claim_job(
+    transaction: firestore.Transaction,
+    job_ref: firestore.DocumentReference,
+    group_id: str,
+    now: datetime,
+    create: bool,
+) -> Optional[Dict[str, Any]]:
+    job_doc = job_ref.get(transaction=transaction)
+    count_reads()
+    if job_doc.exists:
+        job_data = job_doc.to_dict()
+        if not is_claimable(job_data, now):
+            return None
+    elif create:
+        job_data = {
+            "groupId": group_id,
+            "matchesDeleted": 0,
+            "lastMatchId": None,
+            "runs": 0,
+            "createdAt": now,
+        }
+    else:
+        return None
+
+    job_data["leaseUntil"] = now + timedelta(seconds=CLEANUP_LEASE_SECONDS)
+    job_data["runs"] = job_data.get("runs", 0) + 1
+    transaction.set(job_ref, job_data)
+    count_writes()
+    return job_data
+
+
+def claim_cleanup_jobs(
+    db: firestore.Client, limit: int = MAX_JOBS_PER_RUN
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Lease up to `limit` unfinished cleanup jobs nobody is working on."""
+    now = datetime.now(timezone.utc)
+    query = (
+        db.collection(CLEANUP_JOBS_COLLECTION)
+        .where(filter=FieldFilter("leaseUntil", "<=", now))
+        .limit(limit)
+    )
+
+    claimed = []
+    for job_doc in count_query(query.stream()):
+        job_data = _claim_job(
+            db.transaction(), job_doc.reference, job_doc.id, now, False
+        )
+        if job_data is not None:
+            claimed.append((job_doc.id, job_data))
+
+    return claimed
+
+
+def save_cleanup_progress(
+    db: firestore.Client, group_id: str, deleted: int, last_match_id: str
+) -> None:
+    """Record a page of deleted matches and extend the lease."""
+    job_ref = db.collection(CLEANUP_JOBS_COLLECTION).document(group_id)
+    job_ref.update(
+        {
+            "matchesDeleted": firestore.Increment(deleted),
+            "lastMatchId": last_match_id,
+            "leaseUntil": datetime.now(timezone.utc)
+            + timedelta(seconds=CLEANUP_LEASE_SECONDS),
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    count_writes()
+
+
+def release_cleanup_job(db: firestore.Client, group_id: str) -> None:
+    """Give up the lease so the next scheduled run continues the job."""
+    job_ref = db.collection(CLEANUP_JOBS_COLLECTION).document(group_id)
+    job_ref.update({"leaseUntil": datetime.now(timezone.utc)})
+    count_writes()
+    logging.info(f"Released cleanup job for group {group_id}")
+
+
+def finish_cleanup_job(db: firestore.Client, group_id: str) -> None:
+    db.collection(CLEANUP_JOBS_COLLECTION).document(group_id).delete()
+    count_deletes()
@@ -0,0 +1,42 @@
+import os
+from typing import Optional
+
+from firebase_admin import firestore
+
+# "memory" runs every function against an in-memory Firestore, for load tests
+# on a machine without the emulator.
+FIRESTORE_BACKEND = os.environ.get("FIRESTORE_BACKEND", "firestore")
+
+_db: Optional[firestore.Client] = None
+# The Firebase Admin client, created by the first invocation on an instance
+# and reused by the ones after it.
+_client: Optional[firestore.Client] = None
+
+
+def get_db() -> firestore.Client:
+    """The Firestore client every function reads and writes through.
+
+    Defaults to the Firebase Admin client; `set_db` swaps in another
+    implementation such as `memory_firestore.MemoryFirestore`.
+    """
+    global _db, _client
+    if _db is None and FIRESTORE_BACKEND == "memory":
+        from memory_firestore import MemoryFirestore
+
+        _db = MemoryFirestore()
+    if _db is not None:
+        return _db
+    if _client is None:
+        _client = firestore.client()
+    return _client
+
+
+def set_db(db: Optional[firestore.Client]) -> None:
+    """Route `get_db` to `db`, or back to the Firebase Admin client with None.
+
+    Either way the reused Admin client is dropped, so the next call creates
+    a fresh one.
+    """
+    global _db, _client
+    _db = db
+    _client = None
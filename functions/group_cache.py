@@ -0,0 +1,154 @@
+"""Warm-instance cache of group metadata.
+
+Function instances serve many invocations, so a group read by one
+invocation serves the next ones on the same instance for up to
+GROUP_CACHE_TTL_SECONDS. An instance only sees the writes it made itself;
+changes made elsewhere show once its entry expires, as triggers run on
+instances of their own. Anything that must not act on a stale roster, such
+as a stats recompute, reads the group itself, and a request turned away on
+cached metadata is checked again on a fresh read.
+
+Each lookup adds `groupCache` (hit or miss) and the instance's hit rate to
+the invocation record.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from firebase_admin import firestore
+from instrumentation import annotate, count_reads, phase
+
+GROUP_CACHE_TTL_SECONDS = float(os.environ.get("GROUP_CACHE_TTL_SECONDS", "30"))
+GROUP_CACHE_MAX_ENTRIES = int(os.environ.get("GROUP_CACHE_MAX_ENTRIES", "500"))
+# The group fields callers look at; the rest of the document is not kept
+GROUP_METADATA_FIELDS = (
+    "name",
+    "adminUid",
+    "inviteCode",
+    "members",
+    "guests",
+    "teamColors",
+)
+
+
+class GroupCache:
+    """A TTL + LRU map of group ID to metadata, safe to share between threads."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = GROUP_CACHE_TTL_SECONDS,
+        max_entries: int = GROUP_CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group_id: str) -> Optional[Dict[str, Any]]:
+        """A copy of the cached metadata, or None (counted as a miss)."""
+        with self._lock:
+            entry = self._entries.get(group_id)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[group_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(group_id)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, group_id: str, group_data: Dict[str, Any]) -> None:
+        metadata = {
+            field: copy.deepcopy(group_data[field])
+            for field in GROUP_METADATA_FIELDS
+            if field in group_data
+        }
+        with self._lock:
+            self._entries[group_id] = (self.clock() + self.ttl_seconds, metadata)
+            self._entries.move_to_end(group_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, group_id: str) -> None:
+        with self._lock:
+            self._entries.pop(group_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+
+_cache = GroupCache()
+
+
+def get_group_metadata(db: firestore.Client, group_id: str) -> Optional[Dict[str, Any]]:
+    """The group's GROUP_METADATA_FIELDS, or None if it does not exist."""
+    metadata = get_cached_group(group_id)
+    if metadata is not None:
+        return metadata
+    return load_group_metadata(db, group_id)
+
+
+def get_cached_group(group_id: str) -> Optional[Dict[str, Any]]:
+    """The cached metadata, without a read on a miss."""
+    metadata = _cache.get(group_id)
+    annotate(
+        groupCache="miss" if metadata is None else "hit",
+        groupCacheHitRate=round(_cache.hit_rate(), 3),
+    )
+    return metadata
+
+
+def load_group_metadata(
+    db: firestore.Client, group_id: str
+) -> Optional[Dict[str, Any]]:
+    """Read the group and cache its metadata."""
+    with phase("fetch"):
+        group_doc = db.collection("groups").document(group_id).get()
+        count_reads()
+    if not group_doc.exists:
+        _cache.invalidate(group_id)
+        return None
+
+    group_data = group_doc.to_dict()
+    _cache.put(group_id, group_data)
+    return {
+        field: group_data[field]
+        for field in GROUP_METADATA_FIELDS
+        if field in group_data
+    }
+
+
+def observe_group_write(group_id: str, group_data: Optional[Dict[str, Any]]) -> None:
+    """Refresh the entry with the group as this instance just wrote it; None
+    when it deleted the group."""
+    if group_data is None:
+        _cache.invalidate(group_id)
+    else:
+        _cache.put(group_id, group_data)
+
+
+def invalidate_group(group_id: str) -> None:
+    """Drop the entry after this instance changed the group."""
+    _cache.invalidate(group_id)
+
+
+def reset_group_cache() -> None:
+    _cache.clear()
@@ -0,0 +1,41 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from firebase_admin import firestore
+from instrumentation import count_reads, count_writes
+
+DELETED_GROUPS_COLLECTION = "deletedGroups"
+# Match triggers for a deleted group can arrive well after its cleanup
+# finished, so tombstones outlive it. `expireAt` is meant for a Firestore TTL
+# policy on the collection; group IDs are never reused.
+TOMBSTONE_TTL_DAYS = 7
+
+
+def mark_group_deleted(db: firestore.Client, group_id: str) -> None:
+    """Record that a group is gone before its matches and stats are removed.
+
+    Written before any match is deleted, so every match trigger fired by the
+    cleanup sees it and skips the stats work for the group.
+    """
+    now = datetime.now(timezone.utc)
+    tombstone_ref = db.collection(DELETED_GROUPS_COLLECTION).document(group_id)
+    tombstone_ref.set(
+        {
+            "deletedAt": now,
+            "expireAt": now + timedelta(days=TOMBSTONE_TTL_DAYS),
+        }
+    )
+    count_writes()
+    logging.info(f"Marked group {group_id} as deleted")
+
+
+def is_group_deleted(
+    db: firestore.Client,
+    group_id: str,
+    transaction: Optional[firestore.Transaction] = None,
+) -> bool:
+    tombstone_ref = db.collection(DELETED_GROUPS_COLLECTION).document(group_id)
+    tombstone_doc = tombstone_ref.get(transaction=transaction)
+    count_reads()
+    return tombstone_doc.exists
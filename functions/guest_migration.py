@@ -1,9 +1,60 @@
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from bulk_writes import create_bulk_writer, flush_bulk_writer
+from data_access import get_db
 from firebase_admin import firestore
-from firebase_functions import https_fn
+from firebase_functions import firestore_fn, https_fn
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.bulk_writer import BulkWriteFailure, BulkWriter
+from group_cache import get_cached_group, invalidate_group, load_group_metadata
+from instrumentation import (
+    annotate,
+    count_query,
+    count_reads,
+    count_writes,
+    instrumented,
+    phase,
+)
+from match_participants import (
+    PARTICIPANT_UIDS_FIELD,
+    PARTICIPANTS_INDEXED_FIELD,
+    get_participant_uids,
+    participant_uids_outdated,
+    query_player_matches,
+)
+from match_utils import get_group_roster
+from migration_jobs import (
+    MIGRATION_JOB_FIELD,
+    MIGRATION_JOBS_COLLECTION,
+    claim_migration_job,
+    create_migration_job,
+    fail_migration_job,
+    finish_migration_job,
+    get_job_migrations,
+    save_migration_progress,
+)
+from rate_limiter import RateLimitExceeded, acquire
+from rate_limiting import MIGRATION_LIMIT
+from stats_queue import FULL_REPLAY, mark_group_dirty
+from stats_roster import relabel_players
+
+# A group has at most 30 guests
+MAX_GUESTS_PER_MIGRATION = 30
+# array-contains-any takes up to 30 values, and each guest has two uids
+MAX_INDEXED_GUESTS = 15
+# Matches rewritten between two progress updates of a migration job
+MIGRATION_PROGRESS_INTERVAL = 500
+# A job for the largest groups still finishes in one invocation
+MIGRATION_TIMEOUT_SECONDS = 540
 
 
+@instrumented("migrate_guest_to_member")
 def migrate_guest_to_member(data, auth):
+    """Check a guest to member migration and queue it as a job.
+
+    Returns the job ID at once; the job doc tracks the migration's progress.
+    """
     try:
         if not auth or not auth.uid:
             raise ValueError("Authentication required")
@@ -18,126 +69,454 @@ def migrate_guest_to_member(data, auth):
         group_id = data["groupId"]
         guest_id = data["guestId"]
         member_id = data["memberId"]
-        guest_uid_prefix = f"guest_{guest_id}"
+        annotate(uid=requesting_user_id, groupId=group_id)
 
-        db = firestore.client()
+        db = get_db()
+        with phase("write"):
+            acquire(db, MIGRATION_LIMIT, requesting_user_id)
 
-        group_ref = db.collection("groups").document(group_id)
-        group_doc = group_ref.get()
+        migrations = load_migrations(
+            db, group_id, requesting_user_id, {guest_id: member_id}
+        )
+        guest_name, _member_id, member_name = migrations[guest_id]
 
-        if not group_doc.exists:
-            raise ValueError(f"Group with ID {group_id} does not exist")
+        with phase("write"):
+            job_id = create_migration_job(db, group_id, requesting_user_id, migrations)
+        annotate(jobId=job_id)
 
-        group_data = group_doc.to_dict()
+        return {
+            "success": True,
+            "jobId": job_id,
+            "message": f"Started migrating guest '{guest_name}' to member '{member_name}'.",  # noqa: E501
+        }
 
-        if group_data.get("adminUid") != requesting_user_id:
-            members = group_data.get("members", {})
-            if (
-                requesting_user_id not in members
-                or members[requesting_user_id].get("role") != "admin"
-            ):
-                raise ValueError("Only group admins can migrate guest data")
+    except ValueError as e:
+        raise https_fn.HttpsError(  # noqa: B904
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=str(e)
+        )
+    except RateLimitExceeded as e:
+        raise https_fn.HttpsError(  # noqa: B904
+            code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED, message=str(e)
+        )
+    except Exception as e:
+        print(f"Error in migrate_guest_to_member: {str(e)}")
+        raise https_fn.HttpsError(  # noqa: B904
+            code=https_fn.FunctionsErrorCode.INTERNAL,
+            message="Internal server error during migration",
+        )
 
-        guests = group_data.get("guests", [])
-        guest_exists = False
-        guest_name = ""
 
-        for guest in guests:
-            if isinstance(guest, dict) and guest.get("id") == guest_id:
-                guest_exists = True
-                guest_name = guest.get("name", "")
-                break
+@instrumented("migrate_guests_to_members")
+def migrate_guests_to_members(data, auth):
+    """Queue a migration of several guests, done with a single pass over the
+    matches.
 
-        if not guest_exists:
-            raise ValueError(
-                f"Guest with ID {guest_id} does not exist in group {group_id}"
-            )
+    Expects `groupId` and `migrations`, a list of {guestId, memberId}.
+    """
+    try:
+        if not auth or not auth.uid:
+            raise ValueError("Authentication required")
 
-        members = group_data.get("members", {})
-        if member_id not in members:
-            raise ValueError(
-                f"Member with ID {member_id} does not exist in group {group_id}"
-            )
+        requesting_user_id = auth.uid
 
-        member_name = members[member_id].get("name", "")
-        if not member_name:
-            member_name = guest_name
+        required_fields = ["groupId", "migrations"]
+        for field in required_fields:
+            if field not in data:
+                raise ValueError(f"Missing required field: {field}")
+
+        group_id = data["groupId"]
+        mapping = parse_migrations(data["migrations"])
+        annotate(uid=requesting_user_id, groupId=group_id, guestCount=len(mapping))
+
+        db = get_db()
+        with phase("write"):
+            acquire(db, MIGRATION_LIMIT, requesting_user_id)
 
-        batch = db.batch()
-
-        matches_ref = db.collection("matches")
-        matches_query = matches_ref.where(filter=FieldFilter("groupId", "==", group_id))
-        matches_stream = matches_query.stream()
-
-        updated_matches_count = 0
-
-        for match in matches_stream:
-            match_data = match.to_dict()
-            match_updates = {}
-            match_modified_overall = False
-
-            for team_key in ["team1", "team2"]:
-                if team_key in match_data and "players" in match_data[team_key]:
-                    players_data = match_data[team_key]["players"]
-                    updated_players_list = []
-                    team_modified = False
-
-                    player_iterator = []
-                    if isinstance(players_data, list):
-                        player_iterator = players_data
-                    elif isinstance(players_data, dict):
-                        player_iterator = [
-                            players_data[k]
-                            for k in sorted(players_data.keys())
-                            if isinstance(players_data[k], dict)
-                        ]
-                    else:
-                        continue
-
-                    for player in player_iterator:
-                        if isinstance(player, dict):
-                            player_uid = player.get("uid", "")
-                            if player_uid == guest_id or player_uid == guest_uid_prefix:
-                                updated_player = player.copy()
-                                updated_player["uid"] = member_id
-                                updated_player["displayName"] = member_name
-                                updated_players_list.append(updated_player)
-                                team_modified = True
-                            else:
-                                updated_players_list.append(player)
-                        else:
-                            updated_players_list.append(player)
-
-                    if team_modified:
-                        match_updates[f"{team_key}.players"] = updated_players_list
-                        match_modified_overall = True
-
-            if match_updates:
-                batch.update(match.reference, match_updates)
-                if match_modified_overall:
-                    updated_matches_count += 1
-
-        updated_guests = [
-            guest
-            for guest in guests
-            if not (isinstance(guest, dict) and guest.get("id") == guest_id)
-        ]
-        batch.update(group_ref, {"guests": updated_guests})
-
-        batch.commit()
+        migrations = load_migrations(db, group_id, requesting_user_id, mapping)
+
+        with phase("write"):
+            job_id = create_migration_job(db, group_id, requesting_user_id, migrations)
+        annotate(jobId=job_id)
 
         return {
             "success": True,
-            "message": f"Successfully migrated guest '{guest_name}' to member '{member_name}'. Updated {updated_matches_count} matches.",  # noqa: E501
+            "jobId": job_id,
+            "message": f"Started migrating {len(migrations)} guests.",
         }
 
     except ValueError as e:
         raise https_fn.HttpsError(  # noqa: B904
             code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=str(e)
         )
+    except RateLimitExceeded as e:
+        raise https_fn.HttpsError(  # noqa: B904
+            code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED, message=str(e)
+        )
     except Exception as e:
-        print(f"Error in migrate_guest_to_member: {str(e)}")
+        print(f"Error in migrate_guests_to_members: {str(e)}")
         raise https_fn.HttpsError(  # noqa: B904
             code=https_fn.FunctionsErrorCode.INTERNAL,
             message="Internal server error during migration",
         )
+
+
+@firestore_fn.on_document_created(
+    document=f"{MIGRATION_JOBS_COLLECTION}/{{jobId}}",
+    timeout_sec=MIGRATION_TIMEOUT_SECONDS,
+)
+@instrumented("process_migration_job")
+def process_migration_job(event: firestore_fn.Event) -> None:
+    """Runs a migration job queued by one of the migration callables."""
+    db = get_db()
+    job_id = event.params["jobId"]
+    annotate(jobId=job_id)
+
+    # Events can be delivered more than once; only the first one runs the job.
+    with phase("write"):
+        job_data = claim_migration_job(db, job_id)
+    if job_data is None:
+        logging.info(f"Migration job {job_id} was already started")
+        return
+
+    try:
+        run_migration_job(db, job_id, job_data)
+    except Exception as e:
+        logging.error(f"Error in migration job {job_id}: {str(e)}")
+        with phase("write"):
+            fail_migration_job(db, job_id, str(e))
+
+
+def run_migration_job(
+    db: firestore.Client, job_id: str, job_data: Dict[str, Any]
+) -> int:
+    """Migrate the job's guests, saving progress on the job doc.
+
+    Returns how many matches changed.
+    """
+    group_id = job_data["groupId"]
+    annotate(groupId=group_id)
+
+    group_ref = db.collection("groups").document(group_id)
+    with phase("fetch"):
+        group_doc = group_ref.get()
+        count_reads()
+    if not group_doc.exists:
+        raise ValueError(f"Group with ID {group_id} does not exist")
+    group_data = group_doc.to_dict()
+    if not is_group_admin(group_data, job_data.get("requestedBy")):
+        raise ValueError("Only group admins can migrate guest data")
+
+    def save_progress(updated_matches_count: int) -> None:
+        with phase("write"):
+            save_migration_progress(db, job_id, updated_matches_count)
+
+    updated_matches_count, stats_relabelled = migrate_guests(
+        db,
+        group_id,
+        group_ref,
+        group_data,
+        get_job_migrations(job_data),
+        job_id,
+        progress=save_progress,
+    )
+    invalidate_group(group_id)
+    with phase("write"):
+        finish_migration_job(db, job_id, updated_matches_count, stats_relabelled)
+    logging.info(
+        f"Migration job {job_id} for group {group_id} updated "
+        f"{updated_matches_count} matches"
+    )
+    return updated_matches_count
+
+
+def parse_migrations(migrations: Any) -> Dict[str, str]:
+    """Turn a list of {guestId, memberId} into a guest -> member mapping."""
+    if not isinstance(migrations, list) or not migrations:
+        raise ValueError("migrations must be a non-empty list")
+    if len(migrations) > MAX_GUESTS_PER_MIGRATION:
+        raise ValueError(
+            f"At most {MAX_GUESTS_PER_MIGRATION} guests can be migrated at once"
+        )
+
+    mapping = {}
+    for migration in migrations:
+        if (
+            not isinstance(migration, dict)
+            or "guestId" not in migration
+            or "memberId" not in migration
+        ):
+            raise ValueError("Each migration needs a guestId and a memberId")
+        if migration["guestId"] in mapping:
+            raise ValueError(f"Guest {migration['guestId']} is migrated twice")
+        mapping[migration["guestId"]] = migration["memberId"]
+
+    if len(set(mapping.values())) != len(mapping):
+        raise ValueError("Each member can only replace one guest")
+    return mapping
+
+
+def load_migrations(
+    db: firestore.Client,
+    group_id: str,
+    requesting_user_id: str,
+    mapping: Dict[str, str],
+) -> Dict[str, Tuple[str, str, str]]:
+    """Check the requester's admin rights and the migrations against the
+    group, from the warm-instance cache if possible; the job checks the rights
+    again on a fresh read."""
+    group_data = get_cached_group(group_id)
+    if group_data is not None:
+        try:
+            return check_migrations(group_id, group_data, requesting_user_id, mapping)
+        except ValueError:
+            # Cached metadata can predate a new admin, member or guest; only
+            # what a fresh read shows turns the request away.
+            pass
+    return check_migrations(
+        group_id, load_group_metadata(db, group_id), requesting_user_id, mapping
+    )
+
+
+def check_migrations(
+    group_id: str,
+    group_data: Optional[Dict[str, Any]],
+    requesting_user_id: str,
+    mapping: Dict[str, str],
+) -> Dict[str, Tuple[str, str, str]]:
+    if group_data is None:
+        raise ValueError(f"Group with ID {group_id} does not exist")
+
+    if not is_group_admin(group_data, requesting_user_id):
+        raise ValueError("Only group admins can migrate guest data")
+
+    return resolve_migrations(group_id, group_data, mapping)
+
+
+def is_group_admin(group_data: Dict[str, Any], user_id: str) -> bool:
+    if group_data.get("adminUid") == user_id:
+        return True
+    members = group_data.get("members", {})
+    return user_id in members and members[user_id].get("role") == "admin"
+
+
+def resolve_migrations(
+    group_id: str, group_data: Dict[str, Any], mapping: Dict[str, str]
+) -> Dict[str, Tuple[str, str, str]]:
+    """Check every guest and member; returns guest_id -> (guest name, member
+    id, member name)."""
+    guest_names = {}
+    for guest in group_data.get("guests", []):
+        if isinstance(guest, dict) and "id" in guest:
+            guest_names.setdefault(guest["id"], guest.get("name", ""))
+
+    members = group_data.get("members", {})
+    migrations = {}
+    for guest_id, member_id in mapping.items():
+        if guest_id not in guest_names:
+            raise ValueError(
+                f"Guest with ID {guest_id} does not exist in group {group_id}"
+            )
+        if member_id not in members:
+            raise ValueError(
+                f"Member with ID {member_id} does not exist in group {group_id}"
+            )
+
+        guest_name = guest_names[guest_id]
+        member_name = members[member_id].get("name", "")
+        if not member_name:
+            member_name = guest_name
+        migrations[guest_id] = (guest_name, member_id, member_name)
+
+    return migrations
+
+
+def migrate_guests(
+    db: firestore.Client,
+    group_id: str,
+    group_ref: firestore.DocumentReference,
+    group_data: Dict[str, Any],
+    migrations: Dict[str, Tuple[str, str, str]],
+    job_id: str,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Tuple[int, bool]:
+    """Rewrite the guests' matches, then remove the guests from the group.
+
+    Every rewritten match is tagged with `job_id`, so the match triggers leave
+    the stats alone; the guests' stats are instead handed to the members at
+    the end, or recomputed once when that is not exact. `progress` is called
+    with the number of matches changed so far, after every
+    MIGRATION_PROGRESS_INTERVAL of them are written. Returns how many matches
+    changed and whether the stats were relabelled.
+    """
+    replacements = {}
+    for guest_id, (_guest_name, member_id, member_name) in migrations.items():
+        replacements[guest_id] = (member_id, member_name)
+        replacements[f"guest_{guest_id}"] = (member_id, member_name)
+
+    # Until a group's matches all carry participantUids, scan them all and
+    # fill in the field on the way; afterwards only the guests' are read.
+    indexed = bool(group_data.get(PARTICIPANTS_INDEXED_FIELD))
+    if indexed and len(migrations) <= MAX_INDEXED_GUESTS:
+        matches_query = query_player_matches(db, group_id, sorted(replacements))
+    else:
+        matches_query = db.collection("matches").where(
+            filter=FieldFilter("groupId", "==", group_id)
+        )
+
+    failures: List[BulkWriteFailure] = []
+    bulk_writer = create_bulk_writer(db, failures)
+
+    def flush_and_report(updated_matches_count: int) -> None:
+        flush_bulk_writer(bulk_writer, failures, "match updates")
+        if progress is not None:
+            progress(updated_matches_count)
+
+    replaced_uids: Set[str] = set()
+    try:
+        updated_matches_count = rewrite_matches(
+            count_query(matches_query.stream()),
+            bulk_writer,
+            replacements,
+            backfill=not indexed,
+            job_id=job_id,
+            replaced_uids=replaced_uids,
+            progress=flush_and_report,
+        )
+        flush_bulk_writer(bulk_writer, failures, "match updates")
+    finally:
+        bulk_writer.close()
+
+    # The guests only leave the group once every match has been rewritten,
+    # so a failed migration can simply be run again.
+    updated_guests = [
+        guest
+        for guest in group_data.get("guests", [])
+        if not (isinstance(guest, dict) and guest.get("id") in migrations)
+    ]
+    group_updates = {
+        "guests": updated_guests,
+        PARTICIPANTS_INDEXED_FIELD: True,
+        MIGRATION_JOB_FIELD: job_id,
+    }
+
+    # Stats only count guests under their "guest_" ID. Matches that named a
+    # guest by its bare ID were not counted and now are, so they need a replay.
+    roster = get_group_roster(group_data)
+    relabels = {
+        f"guest_{guest_id}": (member_id, roster.get(member_id, (member_name,))[0])
+        for guest_id, (_guest_name, member_id, member_name) in migrations.items()
+    }
+    stats_relabelled = replaced_uids <= set(relabels) and relabel_players(
+        db, group_id, group_ref, group_updates, relabels
+    )
+    if stats_relabelled:
+        return updated_matches_count, True
+
+    with phase("write"):
+        group_ref.update(group_updates)
+        count_writes()
+
+    # One recompute folds in every rewritten match. The migration itself is
+    # done by now, so a failure here must not fail it.
+    try:
+        mark_group_dirty(db, group_id, FULL_REPLAY)
+    except Exception as e:
+        logging.error(f"Error queueing stats recompute for group {group_id}: {e}")
+
+    return updated_matches_count, False
+
+
+def rewrite_match_players(
+    match_data: Dict[str, Any], replacements: Dict[str, Tuple[str, str]]
+) -> Dict[str, Any]:
+    """Field updates that swap players in a match, or {} if none of them played.
+
+    `replacements` maps a player uid to the (uid, displayName) replacing it.
+    """
+    match_updates = {}
+    updated_match_data = dict(match_data)
+
+    for team_key in ["team1", "team2"]:
+        if team_key in match_data and "players" in match_data[team_key]:
+            players_data = match_data[team_key]["players"]
+            updated_players_list = []
+            team_modified = False
+
+            player_iterator = []
+            if isinstance(players_data, list):
+                player_iterator = players_data
+            elif isinstance(players_data, dict):
+                player_iterator = [
+                    players_data[k]
+                    for k in sorted(players_data.keys())
+                    if isinstance(players_data[k], dict)
+                ]
+            else:
+                continue
+
+            for player in player_iterator:
+                if isinstance(player, dict) and player.get("uid", "") in replacements:
+                    uid, display_name = replacements[player["uid"]]
+                    updated_player = player.copy()
+                    updated_player["uid"] = uid
+                    updated_player["displayName"] = display_name
+                    updated_players_list.append(updated_player)
+                    team_modified = True
+                else:
+                    updated_players_list.append(player)
+
+            if team_modified:
+                match_updates[f"{team_key}.players"] = updated_players_list
+                updated_match_data[team_key] = {
+                    **match_data[team_key],
+                    "players": updated_players_list,
+                }
+
+    if match_updates:
+        match_updates[PARTICIPANT_UIDS_FIELD] = get_participant_uids(updated_match_data)
+    return match_updates
+
+
+def rewrite_matches(
+    matches: Iterable[firestore.DocumentSnapshot],
+    bulk_writer: BulkWriter,
+    replacements: Dict[str, Tuple[str, str]],
+    backfill: bool = False,
+    job_id: Optional[str] = None,
+    replaced_uids: Optional[Set[str]] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Queue the player swaps for every match; returns how many matches change.
+
+    With `backfill`, matches that do not change but lack participantUids get
+    the field as well. Changed matches are tagged with `job_id`, and the uids
+    they swap are added to `replaced_uids`. `progress` is called with the
+    count so far after every MIGRATION_PROGRESS_INTERVAL changed matches.
+    """
+    updated_matches_count = 0
+    for match in matches:
+        match_data = match.to_dict()
+        match_updates = rewrite_match_players(match_data, replacements)
+        if match_updates:
+            if job_id is not None:
+                match_updates[MIGRATION_JOB_FIELD] = job_id
+            if replaced_uids is not None:
+                replaced_uids.update(
+                    uid
+                    for uid in get_participant_uids(match_data)
+                    if uid in replacements
+                )
+            bulk_writer.update(match.reference, match_updates)
+            count_writes()
+            updated_matches_count += 1
+            if progress is not None and (
+                updated_matches_count % MIGRATION_PROGRESS_INTERVAL == 0
+            ):
+                progress(updated_matches_count)
+        elif backfill and participant_uids_outdated(match_data):
+            bulk_writer.update(
+                match.reference,
+                {PARTICIPANT_UIDS_FIELD: get_participant_uids(match_data)},
+            )
+            count_writes()
+    return updated_matches_count
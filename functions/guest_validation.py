@@ -1,19 +1,22 @@
 import logging
 import re
 
-from firebase_admin import firestore
+from data_access import get_db
 from firebase_functions import firestore_fn
+from instrumentation import annotate, count_writes, instrumented, phase
 
 MAX_GUEST_NAME_LENGTH = 20
 GUEST_NAME_PATTERN = r"^[a-zA-Z0-9 ]+$"
 
 
 @firestore_fn.on_document_written(document="groups/{groupId}")
+@instrumented("validate_guest_names")
 def validate_guest_names(event: firestore_fn.Event) -> None:
     """
     Validates guest names when a group is created or updated.
     Ensures all guest names follow the required format.
     """
+    annotate(groupId=event.params["groupId"])
     if not event.data.after or not event.data.after.exists:
         return
 
@@ -51,10 +54,12 @@ def validate_guest_names(event: firestore_fn.Event) -> None:
 
     if needs_cleaning:
         try:
-            db = firestore.client()
+            db = get_db()
             group_ref = db.collection("groups").document(event.params["groupId"])
 
-            group_ref.update({"guests": valid_guests})
+            with phase("write"):
+                group_ref.update({"guests": valid_guests})
+                count_writes()
 
             logging.info(f"Sanitized guest names for group {event.params['groupId']}")
         except Exception as e:
@@ -0,0 +1,168 @@
+"""Per-invocation phase timing and Firestore operation accounting.
+
+A trigger or callable wrapped with `instrumented` gets an invocation record
+that `phase` spans and the `count_*` helpers add to. When it returns, the
+record is written as a single structured log entry, whose fields
+(`invocation`, `durationMs`, `phasesMs.fetch`, `reads`, `writes`, ...) can
+back log-based metrics. Outside an instrumented invocation every helper is a
+no-op.
+"""
+
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+from firebase_functions import logger
+
+T = TypeVar("T")
+
+# Time spent outside any phase span
+OTHER_PHASE = "other"
+
+
+class Invocation:
+    """Counters and exclusive phase timings of one function invocation."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.labels: Dict[str, Any] = {}
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.phases: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self._stack: List[str] = [OTHER_PHASE]
+        self._phase_started = self.started
+
+    def switch_phase(self, name: Optional[str]) -> None:
+        """Charge the time so far to the current phase, then enter `name`.
+
+        Phases nest exclusively: entering one pauses the enclosing phase,
+        and `None` returns to it.
+        """
+        self._charge()
+        if name is None:
+            self._stack.pop()
+        else:
+            self._stack.append(name)
+
+    def _charge(self) -> None:
+        now = time.perf_counter()
+        current = self._stack[-1]
+        self.phases[current] = self.phases.get(current, 0.0) + now - self._phase_started
+        self._phase_started = now
+
+    def to_record(self, status: str) -> Dict[str, Any]:
+        self._charge()
+        return {
+            "invocation": self.name,
+            "status": status,
+            "durationMs": round((time.perf_counter() - self.started) * 1000, 3),
+            "phasesMs": {
+                name: round(seconds * 1000, 3)
+                for name, seconds in sorted(self.phases.items())
+                if seconds > 0
+            },
+            "reads": self.reads,
+            "writes": self.writes,
+            "deletes": self.deletes,
+            **self.labels,
+        }
+
+
+_invocation: contextvars.ContextVar[Optional[Invocation]] = contextvars.ContextVar(
+    "invocation", default=None
+)
+# The record of the invocation that finished last in this context, for
+# wrappers outside the instrumented function (see profiling).
+_last_record: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "last_invocation_record", default=None
+)
+
+
+def current_invocation() -> Optional[Invocation]:
+    return _invocation.get()
+
+
+def last_invocation_record() -> Optional[Dict[str, Any]]:
+    return _last_record.get()
+
+
+def instrumented(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Record and log one invocation record per call of the wrapped function."""
+
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            invocation = Invocation(name)
+            token = _invocation.set(invocation)
+            status = "error"
+            try:
+                result = func(*args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                _invocation.reset(token)
+                record = invocation.to_record(status)
+                _last_record.set(record)
+                logger.info(f"Invocation {name} finished", **record)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Charge the time spent in the block to the phase `name`."""
+    invocation = _invocation.get()
+    if invocation is None:
+        yield
+        return
+
+    invocation.switch_phase(name)
+    try:
+        yield
+    finally:
+        invocation.switch_phase(None)
+
+
+def annotate(**labels: Any) -> None:
+    """Attach fields such as the group ID to the invocation record."""
+    invocation = _invocation.get()
+    if invocation is not None:
+        invocation.labels.update(labels)
+
+
+def count_reads(count: int = 1) -> None:
+    invocation = _invocation.get()
+    if invocation is not None:
+        invocation.reads += count
+
+
+def count_writes(count: int = 1) -> None:
+    invocation = _invocation.get()
+    if invocation is not None:
+        invocation.writes += count
+
+
+def count_deletes(count: int = 1) -> None:
+    invocation = _invocation.get()
+    if invocation is not None:
+        invocation.deletes += count
+
+
+def count_query(docs: Iterable[T]) -> Iterator[T]:
+    """Count the documents of a query as they stream.
+
+    A query that returns nothing is still billed as one read.
+    """
+    returned = 0
+    for doc in docs:
+        returned += 1
+        count_reads()
+        yield doc
+    if not returned:
+        count_reads()
@@ -0,0 +1,219 @@
+"""The inviteCodes/{code} index, which maps every invite code to its group.
+
+Joins look codes up with a single document read, and the index gives each
+code to one group only. Groups are created and their codes rotated by the
+client, so `on_group_invite_code_written` keeps the index in sync: a group
+whose new code is already taken gets a fresh one. Groups created before the
+index existed are added by running this module once:
+
+    cd functions && python invite_codes.py
+"""
+
+import logging
+import os
+import secrets
+from typing import Any, Iterable, Optional
+
+from data_access import get_db
+from firebase_admin import firestore
+from firebase_functions import firestore_fn
+from instrumentation import (
+    annotate,
+    count_deletes,
+    count_query,
+    count_reads,
+    count_writes,
+    instrumented,
+    phase,
+)
+
+INVITE_CODES_COLLECTION = "inviteCodes"
+# Same alphabet as the client, without the easily confused 0/O and 1/I
+INVITE_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+INVITE_CODE_LENGTH = 8
+# Until every group is indexed, a code missing from the index is looked up
+# with a query over the groups (and then indexed). Turn off after a backfill.
+INVITE_CODE_QUERY_FALLBACK = os.environ.get("INVITE_CODE_QUERY_FALLBACK", "1") == "1"
+BACKFILL_PAGE_SIZE = 500
+
+
+def generate_invite_code() -> str:
+    return "".join(
+        secrets.choice(INVITE_CODE_ALPHABET) for _ in range(INVITE_CODE_LENGTH)
+    )
+
+
+def lookup_invite_code(db: firestore.Client, invite_code: str) -> Optional[str]:
+    """The ID of the group with the invite code, or None."""
+    index_doc = db.collection(INVITE_CODES_COLLECTION).document(invite_code).get()
+    count_reads()
+    if index_doc.exists:
+        return index_doc.to_dict().get("groupId")
+
+    if not INVITE_CODE_QUERY_FALLBACK:
+        return None
+
+    query = (
+        db.collection("groups")
+        .where(filter=firestore.FieldFilter("inviteCode", "==", invite_code))
+        .limit(1)
+    )
+    for group_doc in count_query(query.stream()):
+        sync_invite_code(db, group_doc.id)
+        return group_doc.id
+    return None
+
+
+@firestore_fn.on_document_written(document="groups/{groupId}")
+@instrumented("on_group_invite_code_written")
+def on_group_invite_code_written(event: firestore_fn.Event) -> None:
+    """Index a group's invite code when it is created, rotated or deleted."""
+    group_id = event.params["groupId"]
+    code_before = _get_invite_code(event.data.before)
+    code_after = _get_invite_code(event.data.after)
+    if code_before == code_after:
+        return
+
+    annotate(groupId=group_id)
+    try:
+        with phase("write"):
+            sync_invite_code(get_db(), group_id, [code_before, code_after])
+    except Exception as e:
+        logging.error(f"Error indexing invite code for group {group_id}: {e}")
+
+
+def _get_invite_code(snapshot: Any) -> Optional[str]:
+    if not snapshot or not snapshot.exists:
+        return None
+    return snapshot.to_dict().get("inviteCode") or None
+
+
+def sync_invite_code(
+    db: firestore.Client, group_id: str, previous_codes: Iterable[Optional[str]] = ()
+) -> Optional[str]:
+    """Point the index at the group's current code, and drop `previous_codes`.
+
+    Reads the group in the transaction, so triggers that arrive out of order
+    still leave the index matching the group. Returns the code now indexed.
+    """
+    group_ref = db.collection("groups").document(group_id)
+    stale_codes = sorted({code for code in previous_codes if code})
+    invite_code = _sync_invite_code(db.transaction(), db, group_ref, stale_codes)
+    logging.info(f"Indexed invite code {invite_code} for group {group_id}")
+    return invite_code
+
+
+@firestore.transactional
+def _sync_invite_code(
+    transaction: firestore.Transaction,
+    db: firestore.Client,
+    group_ref: firestore.DocumentReference,
+    stale_codes: Iterable[str],
+) -> Optional[str]:
+    codes_ref = db.collection(INVITE_CODES_COLLECTION)
+    group_doc = group_ref.get(transaction=transaction)
+    count_reads()
+    invite_code = _get_invite_code(group_doc)
+
+    stale_entries = []
+    for code in stale_codes:
+        if code == invite_code:
+            continue
+        entry_doc = codes_ref.document(code).get(transaction=transaction)
+        count_reads()
+        if entry_doc.exists and entry_doc.to_dict().get("groupId") == group_ref.id:
+            stale_entries.append(entry_doc.reference)
+
+    group_updates = None
+    new_code = None
+    if invite_code is not None:
+        owner_id = _get_code_owner(transaction, db, invite_code, group_ref.id)
+        if owner_id is None:
+            new_code = invite_code
+        elif owner_id != group_ref.id:
+            # Another group has the code, so this one gets a fresh code instead.
+            logging.warning(
+                f"Invite code {invite_code} of group {group_ref.id} is taken"
+            )
+            invite_code = new_code = generate_invite_code()
+            if _get_code_owner(transaction, db, new_code, group_ref.id) is not None:
+                raise ValueError(f"Generated invite code {new_code} is taken")
+            group_updates = {"inviteCode": new_code}
+
+    for entry_ref in stale_entries:
+        transaction.delete(entry_ref)
+        count_deletes()
+    if new_code is not None:
+        transaction.set(
+            codes_ref.document(new_code),
+            {"groupId": group_ref.id, "createdAt": firestore.SERVER_TIMESTAMP},
+        )
+        count_writes()
+    if group_updates is not None:
+        transaction.update(group_ref, group_updates)
+        count_writes()
+    return invite_code
+
+
+def _get_code_owner(
+    transaction: firestore.Transaction,
+    db: firestore.Client,
+    invite_code: str,
+    group_id: str,
+) -> Optional[str]:
+    """The group the index gives the code to, or None if nobody has it.
+
+    Entries of groups that moved on to another code (or were deleted) before
+    their trigger ran are stale and do not count.
+    """
+    entry_doc = (
+        db.collection(INVITE_CODES_COLLECTION)
+        .document(invite_code)
+        .get(transaction=transaction)
+    )
+    count_reads()
+    if not entry_doc.exists:
+        return None
+
+    owner_id = entry_doc.to_dict().get("groupId")
+    if owner_id == group_id:
+        return owner_id
+
+    owner_doc = db.collection("groups").document(owner_id).get(transaction=transaction)
+    count_reads()
+    return owner_id if _get_invite_code(owner_doc) == invite_code else None
+
+
+def backfill_invite_codes(db: firestore.Client, page_size: Optional[int] = None) -> int:
+    """Index the codes of every group; returns how many groups were synced."""
+    page_size = page_size or BACKFILL_PAGE_SIZE
+    query = (
+        db.collection("groups")
+        .select(["inviteCode"])
+        .order_by("__name__")
+        .limit(page_size)
+    )
+
+    synced = 0
+    cursor = None
+    while True:
+        page_query = (
+            query.start_after({"__name__": cursor}) if cursor is not None else query
+        )
+        page = list(count_query(page_query.stream()))
+        for group_doc in page:
+            if _get_invite_code(group_doc) is not None:
+                sync_invite_code(db, group_doc.id)
+                synced += 1
+
+        if len(page) < page_size:
+            return synced
+        cursor = page[-1].id
+
+
+if __name__ == "__main__":
+    from firebase_admin import initialize_app
+
+    logging.basicConfig(level=logging.INFO)
+    initialize_app()
+    print(f"Indexed invite codes of {backfill_invite_codes(get_db())} groups")
@@ -1,10 +1,22 @@
 import re
 
-from firebase_admin import firestore
+from data_access import get_db
 from firebase_functions import https_fn
-from google.cloud.firestore_v1.base_query import FieldFilter
-
-
+from group_cache import get_cached_group, load_group_metadata, observe_group_write
+from instrumentation import annotate, count_writes, instrumented, phase
+from invite_codes import lookup_invite_code
+from join_throttle import (
+    JoinThrottled,
+    check_join_allowed,
+    is_known_invalid_code,
+    record_failed_lookup,
+    record_successful_lookup,
+)
+from rate_limiter import RateLimitExceeded, acquire
+from rate_limiting import JOIN_GROUP_LIMIT
+
+
+@instrumented("join_group_with_code")
 def join_group_with_code(data, auth):
     try:
         if not auth or not auth.uid:
@@ -22,21 +34,40 @@ def join_group_with_code(data, auth):
             raise ValueError("Invite code must contain only letters and numbers")
 
         user_id = auth.uid
+        annotate(uid=user_id)
         user_name = auth.token.get("name", "User")
 
-        db = firestore.client()
-
-        groups_ref = db.collection("groups")
-        query = groups_ref.where(filter=FieldFilter("inviteCode", "==", invite_code))
-        results = query.stream()
+        # Guesses are turned away before they cost a Firestore read
+        check_join_allowed(user_id)
+        if is_known_invalid_code(invite_code):
+            record_failed_lookup(user_id, invite_code)
+            raise ValueError("Invalid invite code. No matching group found.")
 
-        group_docs = list(results)
-        if not group_docs:
+        db = get_db()
+        with phase("write"):
+            acquire(db, JOIN_GROUP_LIMIT, user_id)
+
+        with phase("fetch"):
+            group_id = lookup_invite_code(db, invite_code)
+        group_data = None
+        if group_id is not None:
+            group_data = get_cached_group(group_id)
+            # Cached metadata can predate a code rotation or the user leaving;
+            # only what a fresh read shows turns them away or skips the write.
+            if (
+                group_data is None
+                or group_data.get("inviteCode") != invite_code
+                or user_id in group_data.get("members", {})
+            ):
+                group_data = load_group_metadata(db, group_id)
+
+        # The index can briefly lag behind a rotated code or deleted group
+        if group_data is None or group_data.get("inviteCode") != invite_code:
+            record_failed_lookup(user_id, invite_code)
             raise ValueError("Invalid invite code. No matching group found.")
+        record_successful_lookup(user_id)
 
-        group_doc = group_docs[0]
-        group_id = group_doc.id
-        group_data = group_doc.to_dict()
+        annotate(groupId=group_id)
 
         members = group_data.get("members", {})
         if user_id in members:
@@ -48,8 +79,14 @@ def join_group_with_code(data, auth):
                 "alreadyMember": True,
             }
 
+        new_member = {"name": user_name, "role": "viewer"}
         group_ref = db.collection("groups").document(group_id)
-        group_ref.update({f"members.{user_id}": {"name": user_name, "role": "viewer"}})
+        with phase("write"):
+            group_ref.update({f"members.{user_id}": new_member})
+            count_writes()
+        observe_group_write(
+            group_id, {**group_data, "members": {**members, user_id: new_member}}
+        )
 
         return {
             "success": True,
@@ -63,6 +100,10 @@ def join_group_with_code(data, auth):
         raise https_fn.HttpsError(  # noqa: B904
             code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=str(e)
         )
+    except (RateLimitExceeded, JoinThrottled) as e:
+        raise https_fn.HttpsError(  # noqa: B904
+            code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED, message=str(e)
+        )
     except Exception as e:
         print(f"Error in join_group_with_code: {str(e)}")
         raise https_fn.HttpsError(  # noqa: B904
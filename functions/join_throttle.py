@@ -0,0 +1,192 @@
+"""Warm-instance throttling of invite code guesses.
+
+Invite codes are the only thing keeping a group private, so every failed
+lookup counts against the user who made it and against the instance as a
+whole. After a few failures each further one doubles how long the user (or,
+during a wider attack, everyone on the instance) has to wait before the next
+lookup. Codes that recently failed are remembered for
+INVALID_CODE_TTL_SECONDS and rejected again without a Firestore read.
+Nothing tells an instance that a group started using one of them (group
+triggers run on other instances), so the TTL is kept short: a code that
+failed while its index entry lagged behind a rotation is accepted again
+shortly after.
+
+All of this is checked in memory before a join touches Firestore. Across
+instances, a user's joins are still bounded by the join rate limit.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from instrumentation import annotate
+
+# Failed lookups a user gets before backing off, and the wait after the next
+USER_FREE_FAILURES = 3
+USER_BACKOFF_SECONDS = 2.0
+USER_MAX_BACKOFF_SECONDS = 900.0
+# Failed lookups of all users of an instance before everyone backs off
+GLOBAL_FREE_FAILURES = 50
+GLOBAL_BACKOFF_SECONDS = 1.0
+GLOBAL_MAX_BACKOFF_SECONDS = 60.0
+# Failures are forgotten once there was none for this long
+FAILURE_RESET_SECONDS = 900.0
+INVALID_CODE_TTL_SECONDS = 30.0
+MAX_ENTRIES = 10000
+
+
+class JoinThrottled(Exception):
+    def __init__(self, retry_after_seconds: float) -> None:
+        self.retry_after_seconds = retry_after_seconds
+        super().__init__(
+            "Too many invalid invite codes, try again in "
+            f"{max(1, round(retry_after_seconds))} seconds"
+        )
+
+
+class FailureBackoff:
+    """Failure counts per key, with an exponential backoff once a key has
+    more than `free_failures`. Safe to share between threads."""
+
+    def __init__(
+        self,
+        free_failures: int,
+        backoff_seconds: float,
+        max_backoff_seconds: float,
+        reset_seconds: float = FAILURE_RESET_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.free_failures = free_failures
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.reset_seconds = reset_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        # key -> (failures, time of the last failure)
+        self._failures: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str, now: float) -> Tuple[int, float]:
+        entry = self._failures.get(key)
+        if entry is not None and now - entry[1] >= self.reset_seconds:
+            del self._failures[key]
+            entry = None
+        return entry or (0, now)
+
+    def _backoff(self, failures: int) -> float:
+        excess = failures - self.free_failures
+        if excess <= 0:
+            return 0.0
+        # Capped before the power, so it cannot overflow
+        exponent = min(excess - 1, 32)
+        return min(self.backoff_seconds * 2**exponent, self.max_backoff_seconds)
+
+    def retry_after(self, key: str) -> Optional[float]:
+        """Seconds the key still has to wait, or None if it may try now."""
+        with self._lock:
+            now = self.clock()
+            failures, last_failure = self._get(key, now)
+            wait = last_failure + self._backoff(failures) - now
+            return wait if wait > 0 else None
+
+    def record_failure(self, key: str) -> None:
+        with self._lock:
+            now = self.clock()
+            failures, _last_failure = self._get(key, now)
+            self._failures[key] = (failures + 1, now)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._failures.clear()
+
+
+class InvalidCodeCache:
+    """A TTL + LRU set of invite codes that did not match a group."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = INVALID_CODE_TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._expiries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, invite_code: str) -> bool:
+        with self._lock:
+            expiry = self._expiries.get(invite_code)
+            if expiry is None:
+                return False
+            if expiry <= self.clock():
+                del self._expiries[invite_code]
+                return False
+            return True
+
+    def add(self, invite_code: str) -> None:
+        with self._lock:
+            self._expiries[invite_code] = self.clock() + self.ttl_seconds
+            self._expiries.move_to_end(invite_code)
+            while len(self._expiries) > self.max_entries:
+                self._expiries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expiries.clear()
+
+
+GLOBAL_KEY = "*"
+
+_user_failures = FailureBackoff(
+    USER_FREE_FAILURES, USER_BACKOFF_SECONDS, USER_MAX_BACKOFF_SECONDS
+)
+_global_failures = FailureBackoff(
+    GLOBAL_FREE_FAILURES, GLOBAL_BACKOFF_SECONDS, GLOBAL_MAX_BACKOFF_SECONDS
+)
+_invalid_codes = InvalidCodeCache()
+
+
+def check_join_allowed(user_id: str) -> None:
+    """Raise JoinThrottled while the user or the instance is backing off."""
+    for scope, failures, key in (
+        ("user", _user_failures, user_id),
+        ("global", _global_failures, GLOBAL_KEY),
+    ):
+        retry_after = failures.retry_after(key)
+        if retry_after is not None:
+            annotate(joinThrottled=scope)
+            raise JoinThrottled(retry_after)
+
+
+def is_known_invalid_code(invite_code: str) -> bool:
+    if invite_code not in _invalid_codes:
+        return False
+    annotate(joinThrottled="invalidCode")
+    return True
+
+
+def record_failed_lookup(user_id: str, invite_code: str) -> None:
+    _invalid_codes.add(invite_code)
+    _user_failures.record_failure(user_id)
+    _global_failures.record_failure(GLOBAL_KEY)
+
+
+def record_successful_lookup(user_id: str) -> None:
+    _user_failures.reset(user_id)
+
+
+def reset_join_throttle() -> None:
+    _user_failures.clear()
+    _global_failures.clear()
+    _invalid_codes.clear()
@@ -1,19 +1,44 @@
 from firebase_admin import initialize_app
 from firebase_functions import https_fn
-from guest_migration import migrate_guest_to_member
-from guest_validation import validate_guest_names  # noqa: F401
+from guest_migration import (
+    migrate_guest_to_member,
+    migrate_guests_to_members,
+    process_migration_job,
+)
+from guest_validation import validate_guest_names
+from invite_codes import on_group_invite_code_written
 from join_group import join_group_with_code
-from match_cleanup import on_group_deleted_cleanup_matches  # noqa: F401
-from match_stats import on_group_update, on_match_update  # noqa: F401
+from match_cleanup import on_group_deleted_cleanup_matches, process_cleanup_jobs
+from match_stats import (
+    on_group_update,
+    on_match_update,
+    process_stats_queue,
+)
+from profiling import profiled
 from rate_limiting import (
-    on_group_created,  # noqa: F401
-    on_group_deleted,  # noqa: F401, F811
-    on_match_created,  # noqa: F401
+    on_group_created,
+    on_group_deleted,
+    on_match_created,
 )
 
 initialize_app()
 
+# Deployed functions are exported under their own names; profiled() only
+# wraps the ones PROFILE_FUNCTIONS selects and returns the rest unchanged.
+validate_guest_names = profiled(validate_guest_names)
+on_group_deleted_cleanup_matches = profiled(on_group_deleted_cleanup_matches)
+process_cleanup_jobs = profiled(process_cleanup_jobs)
+process_migration_job = profiled(process_migration_job)
+on_group_update = profiled(on_group_update)
+on_group_invite_code_written = profiled(on_group_invite_code_written)
+on_match_update = profiled(on_match_update)
+process_stats_queue = profiled(process_stats_queue)
+on_group_created = profiled(on_group_created)
+on_group_deleted = profiled(on_group_deleted)
+on_match_created = profiled(on_match_created)
 
+
+@profiled
 @https_fn.on_call(enforce_app_check=True)
 def migrate_guest_to_member_fn(req: https_fn.CallableRequest):
     """
@@ -23,6 +48,17 @@ def migrate_guest_to_member_fn(req: https_fn.CallableRequest):
     return migrate_guest_to_member(req.data, req.auth)
 
 
+@profiled
+@https_fn.on_call(enforce_app_check=True)
+def migrate_guests_to_members_fn(req: https_fn.CallableRequest):
+    """
+    Migrates several guests of a group to registered members in one pass.
+    Expects the group ID and a list of guest/member ID pairs in req.data.
+    """
+    return migrate_guests_to_members(req.data, req.auth)
+
+
+@profiled
 @https_fn.on_call(enforce_app_check=True)
 def join_group_fn(req: https_fn.CallableRequest):
     """
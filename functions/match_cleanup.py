@@ -1,58 +1,213 @@
 import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import firebase_admin
+from bulk_writes import create_bulk_writer, flush_bulk_writer
+from cleanup_jobs import (
+    claim_cleanup_job,
+    claim_cleanup_jobs,
+    finish_cleanup_job,
+    release_cleanup_job,
+    save_cleanup_progress,
+)
+from data_access import get_db
 from firebase_admin import credentials, firestore  # noqa: F401
-from firebase_functions import firestore_fn
+from firebase_functions import firestore_fn, scheduler_fn
+from google.cloud.firestore_v1.bulk_writer import BulkWriteFailure, BulkWriter
+from group_tombstones import mark_group_deleted
+from instrumentation import (
+    annotate,
+    count_deletes,
+    count_query,
+    instrumented,
+    phase,
+)
+from stats_queue import STATS_QUEUE_COLLECTION
+
+# Matches fetched (as keys only) and deleted per round trip; at most two pages
+# are held in memory whatever the size of the group.
+CLEANUP_PAGE_SIZE = 500
+# The bulk writer starts at 500 deletes/s and ramps up to this, sending
+# batches concurrently.
+CLEANUP_MAX_OPS_PER_SECOND = int(os.environ.get("CLEANUP_MAX_OPS_PER_SECOND", "2000"))
+# Attempts per delete, with exponential backoff between them
+CLEANUP_MAX_ATTEMPTS = 8
+# Time an invocation spends on cleanups before it saves its progress and
+# leaves the rest to the next scheduled run; well within the 60s timeout.
+CLEANUP_TIME_BUDGET_SECONDS = float(os.environ.get("CLEANUP_TIME_BUDGET_SECONDS", "40"))
 
 
 @firestore_fn.on_document_deleted(document="groups/{groupId}")
+@instrumented("on_group_deleted_cleanup_matches")
 def on_group_deleted_cleanup_matches(event: firestore_fn.Event) -> None:
     if not firebase_admin._apps:
         firebase_admin.initialize_app()
 
-    db = firestore.client()
+    db = get_db()
+    deadline = time.monotonic() + CLEANUP_TIME_BUDGET_SECONDS
 
     group_id = event.params["groupId"]
+    annotate(groupId=group_id)
     logging.info(f"Group deleted, starting cleanup for groupId: {group_id}")
 
-    matches_query = db.collection("matches").where(
-        filter=firestore.FieldFilter("groupId", "==", group_id)
-    )
+    try:
+        with phase("write"):
+            mark_group_deleted(db, group_id)
+            job = claim_cleanup_job(db, group_id)
+        if job is None:
+            logging.info(f"Cleanup for groupId: {group_id} is already running.")
+            return
+
+        run_cleanup_job(db, group_id, job, deadline)
+
+    except Exception as e:
+        logging.error(f"Error during cleanup for groupId: {group_id}: {e}")
+        raise
 
+
+@scheduler_fn.on_schedule(schedule="every 1 minutes", max_instances=1)
+@instrumented("process_cleanup_jobs")
+def process_cleanup_jobs(event: scheduler_fn.ScheduledEvent) -> None:
+    """Continues group cleanups that ran out of time or failed."""
+    db = get_db()
+    deadline = time.monotonic() + CLEANUP_TIME_BUDGET_SECONDS
+
+    with phase("write"):
+        jobs = claim_cleanup_jobs(db)
+    annotate(jobCount=len(jobs))
+    for group_id, job in jobs:
+        if time.monotonic() >= deadline:
+            release_cleanup_job(db, group_id)
+            continue
+
+        try:
+            run_cleanup_job(db, group_id, job, deadline)
+        except Exception as e:
+            logging.error(f"Error during cleanup for groupId: {group_id}: {e}")
+
+
+def run_cleanup_job(
+    db: firestore.Client, group_id: str, job: Dict[str, Any], deadline: float
+) -> bool:
+    """Continue a group's cleanup from its saved cursor.
+
+    Progress is saved after every page, and the job is released once
+    `deadline` passes. After the last match, the stats and queue entry are
+    swept and the job is removed. Returns whether the cleanup finished.
+    """
+    matches_deleted = job.get("matchesDeleted", 0)
+    finished = True
     try:
-        docs = list(matches_query.stream())
+        pages = delete_group_matches(db, group_id, start_after=job.get("lastMatchId"))
+        try:
+            for deleted, last_match_id in pages:
+                matches_deleted += deleted
+                with phase("write"):
+                    save_cleanup_progress(db, group_id, deleted, last_match_id)
+                if time.monotonic() >= deadline:
+                    finished = False
+                    break
+        finally:
+            pages.close()
 
-        if not docs:
+        if not finished:
+            release_cleanup_job(db, group_id)
             logging.info(
-                f"No matches found for groupId: {group_id}. Nothing to delete."
+                f"Paused cleanup for groupId: {group_id} after deleting "
+                f"{matches_deleted} matches."
             )
-        else:
-            logging.info(
-                f"Found {len(docs)} matches to delete for groupId: {group_id}."
+            return False
+
+        sweep_group_data(db, group_id)
+        with phase("write"):
+            finish_cleanup_job(db, group_id)
+        logging.info(
+            f"Finished cleanup for groupId: {group_id}, "
+            f"deleted {matches_deleted} matches."
+        )
+        return True
+
+    except Exception:
+        release_cleanup_job(db, group_id)
+        raise
+
+
+def sweep_group_data(db: firestore.Client, group_id: str) -> None:
+    """Delete the group's stats with their player and checkpoint docs."""
+    stats_ref = db.collection("groupStats").document(group_id)
+    with phase("write"):
+        deleted = db.recursive_delete(stats_ref)
+        count_deletes(deleted)
+        db.collection(STATS_QUEUE_COLLECTION).document(group_id).delete()
+        count_deletes()
+    logging.info(f"Deleted {deleted} stats documents for groupId: {group_id}.")
+
+
+def delete_group_matches(
+    db: firestore.Client,
+    group_id: str,
+    page_size: Optional[int] = None,
+    start_after: Optional[str] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Delete a group's matches, yielding (deleted, last_match_id) per page.
+
+    Pages through the matches in document ID order with key-only queries,
+    after the match `start_after` when resuming. Each page is queued on the
+    bulk writer while the next one is fetched, and flushed after it, so
+    fetching and deleting overlap. A page is only yielded once it is deleted.
+    """
+    page_size = page_size or CLEANUP_PAGE_SIZE
+    query = (
+        db.collection("matches")
+        .where(filter=firestore.FieldFilter("groupId", "==", group_id))
+        .select([])
+        .order_by("__name__")
+        .limit(page_size)
+    )
+
+    failures: List[BulkWriteFailure] = []
+    bulk_writer = create_bulk_writer(
+        db,
+        failures,
+        max_ops_per_second=CLEANUP_MAX_OPS_PER_SECOND,
+        max_attempts=CLEANUP_MAX_ATTEMPTS,
+    )
+    pending: Optional[Tuple[int, str]] = None
+    cursor = start_after
+    try:
+        while True:
+            page_query = (
+                query.start_after({"__name__": cursor}) if cursor is not None else query
             )
+            with phase("fetch"):
+                page = list(count_query(page_query.stream()))
 
-            batch_size = 500
-            for i in range(0, len(docs), batch_size):
-                batch = db.batch()
-                batch_docs = docs[i : i + batch_size]
+            if pending is not None:
+                _flush_deletes(bulk_writer, failures, pending[0])
+                yield pending
+                pending = None
 
-                for doc in batch_docs:
-                    batch.delete(doc.reference)
+            if page:
+                with phase("write"):
+                    for match_doc in page:
+                        bulk_writer.delete(match_doc.reference)
+                pending = (len(page), page[-1].id)
 
-                batch.commit()
-                logging.info(
-                    f"Successfully deleted batch of {len(batch_docs)} matches for groupId: {group_id}."  # noqa: E501
-                )
+            if len(page) < page_size:
+                break
+            cursor = page[-1].id
 
-        stats_ref = db.collection("groupStats").document(group_id)
-        stats_doc = stats_ref.get()
+        if pending is not None:
+            _flush_deletes(bulk_writer, failures, pending[0])
+            yield pending
+    finally:
+        bulk_writer.close()
 
-        if stats_doc.exists:
-            stats_ref.delete()
-            logging.info(f"Successfully deleted stats for groupId: {group_id}.")
-        else:
-            logging.info(f"No stats found for groupId: {group_id}. Nothing to delete.")
 
-    except Exception as e:
-        logging.error(f"Error during cleanup for groupId: {group_id}: {e}")
-        raise
+def _flush_deletes(
+    bulk_writer: BulkWriter, failures: List[BulkWriteFailure], queued: int
+) -> None:
+    flush_bulk_writer(bulk_writer, failures, "match deletes")
+    count_deletes(queued)
@@ -0,0 +1,158 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from bulk_writes import create_bulk_writer, flush_bulk_writer
+from data_access import get_db
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import And, FieldFilter
+from google.cloud.firestore_v1.bulk_writer import BulkWriteFailure
+from instrumentation import count_query, count_writes
+from match_utils import extract_players_from_team
+
+# Sorted, de-duplicated uids of everyone who played in a match, kept in sync by
+# the client on write and by on_match_update, so that a player's matches can be
+# found with an array-contains query instead of a scan of the whole group.
+PARTICIPANT_UIDS_FIELD = "participantUids"
+# Set on a group once all of its matches carry participantUids. Groups whose
+# matches predate the field are indexed by running this module once:
+#
+#     cd functions && python match_participants.py
+PARTICIPANTS_INDEXED_FIELD = "participantUidsIndexed"
+BACKFILL_PAGE_SIZE = 500
+
+
+def get_participant_uids(match_data: Dict[str, Any]) -> List[str]:
+    uids = set()
+    for team_key in ("team1", "team2"):
+        team_data = match_data.get(team_key)
+        if not isinstance(team_data, dict):
+            continue
+        for player in extract_players_from_team(team_data):
+            if isinstance(player, dict) and player.get("uid"):
+                uids.add(player["uid"])
+    return sorted(uids)
+
+
+def participant_uids_outdated(match_data: Dict[str, Any]) -> bool:
+    return match_data.get(PARTICIPANT_UIDS_FIELD) != get_participant_uids(match_data)
+
+
+def sync_participant_uids(
+    match_ref: firestore.DocumentReference, match_data: Dict[str, Any]
+) -> bool:
+    """Repair a match whose participantUids do not match its teams.
+
+    The write fires the match trigger again, which then finds the field in
+    sync and every stats field unchanged.
+    """
+    if not participant_uids_outdated(match_data):
+        return False
+
+    match_ref.update({PARTICIPANT_UIDS_FIELD: get_participant_uids(match_data)})
+    count_writes()
+    logging.info(f"Updated participant uids of match {match_ref.id}")
+    return True
+
+
+def query_player_matches(
+    db: firestore.Client, group_id: str, uids: List[str]
+) -> firestore.Query:
+    """The group's matches that any of `uids` played in (up to 30 uids)."""
+    return db.collection("matches").where(
+        filter=And(
+            [
+                FieldFilter("groupId", "==", group_id),
+                FieldFilter(PARTICIPANT_UIDS_FIELD, "array_contains_any", uids),
+            ]
+        )
+    )
+
+
+def backfill_participant_uids(
+    db: firestore.Client, page_size: Optional[int] = None
+) -> int:
+    """Fill in participantUids for the matches of every group not yet
+    indexed, then mark the group indexed; returns how many groups were."""
+    page_size = page_size or BACKFILL_PAGE_SIZE
+    query = (
+        db.collection("groups")
+        .select([PARTICIPANTS_INDEXED_FIELD])
+        .order_by("__name__")
+        .limit(page_size)
+    )
+
+    indexed = 0
+    cursor = None
+    while True:
+        page_query = (
+            query.start_after({"__name__": cursor}) if cursor is not None else query
+        )
+        page = list(count_query(page_query.stream()))
+        for group_doc in page:
+            if not group_doc.to_dict().get(PARTICIPANTS_INDEXED_FIELD):
+                backfill_group_participant_uids(db, group_doc.id, page_size)
+                indexed += 1
+
+        if len(page) < page_size:
+            return indexed
+        cursor = page[-1].id
+
+
+def backfill_group_participant_uids(
+    db: firestore.Client, group_id: str, page_size: int = BACKFILL_PAGE_SIZE
+) -> int:
+    """Fill in participantUids for the group's matches and mark the group
+    indexed; returns how many matches were updated.
+
+    Matches written meanwhile are kept in sync by on_match_update, so the
+    group can be marked once every existing match was written.
+    """
+    query = (
+        db.collection("matches")
+        .where(filter=FieldFilter("groupId", "==", group_id))
+        .select(["team1", "team2", PARTICIPANT_UIDS_FIELD])
+        .order_by("__name__")
+        .limit(page_size)
+    )
+
+    failures: List[BulkWriteFailure] = []
+    bulk_writer = create_bulk_writer(db, failures)
+    updated = 0
+    cursor = None
+    try:
+        while True:
+            page_query = (
+                query.start_after({"__name__": cursor}) if cursor is not None else query
+            )
+            page = list(count_query(page_query.stream()))
+            for match in page:
+                match_data = match.to_dict()
+                if participant_uids_outdated(match_data):
+                    bulk_writer.update(
+                        match.reference,
+                        {PARTICIPANT_UIDS_FIELD: get_participant_uids(match_data)},
+                    )
+                    count_writes()
+                    updated += 1
+
+            if len(page) < page_size:
+                break
+            cursor = page[-1].id
+        flush_bulk_writer(bulk_writer, failures, "participant uids")
+    finally:
+        bulk_writer.close()
+
+    db.collection("groups").document(group_id).update(
+        {PARTICIPANTS_INDEXED_FIELD: True}
+    )
+    count_writes()
+    logging.info(f"Indexed participants of group {group_id}: {updated} matches")
+    return updated
+
+
+if __name__ == "__main__":
+    from firebase_admin import initialize_app
+
+    logging.basicConfig(level=logging.INFO)
+    initialize_app()
+    print(f"Indexed match participants of {backfill_participant_uids(get_db())} groups")
@@ -1,15 +1,78 @@
+import copy
 import logging
 from collections import defaultdict
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+from data_access import get_db
 from firebase_admin import firestore
-from firebase_functions import firestore_fn
+from firebase_functions import firestore_fn, scheduler_fn
+from group_tombstones import is_group_deleted
+from instrumentation import (
+    annotate,
+    count_query,
+    count_reads,
+    instrumented,
+    phase,
+)
+from match_participants import sync_participant_uids
+from match_utils import (
+    create_player_stats_object,
+    create_team_color_stats_object,
+    extract_players_from_team,
+    get_date_string_from_timestamp,
+    get_group_roster,
+    get_match_sort_key,
+    get_timestamp_seconds,
+)
+from migration_jobs import written_by_migration
+from player_records import PartnerRecord, PlayerRecord, PlayerTable
+from stats_aggregate import STATS_PARALLEL_WORKERS, fold_runs_in_parallel
+from stats_checkpoints import (
+    CHECKPOINTS_COLLECTION,
+    STATS_CHECKPOINT_INTERVAL,
+    checkpoint_to_state,
+    get_checkpoints_from,
+    get_roster_signature,
+    load_checkpoint,
+    save_checkpoint,
+)
+from stats_columnar import STATS_ENGINE, fold_runs_columnar
+from stats_players import (
+    PLAYER_HASHES_FIELD,
+    apply_stats_writes,
+    load_player_stats,
+    plan_stats_writes,
+    write_stats,
+)
+from stats_queue import (
+    FULL_REPLAY,
+    STATS_QUEUE_SCHEDULE,
+    claim_dirty_groups,
+    is_group_dirty,
+    mark_group_dirty,
+    release_group,
+)
+from stats_roster import apply_roster_change
+
+# Match fields that feed into group statistics; writes touching none of them
+# (e.g. updatedAt bumps) leave the stats unchanged.
+MATCH_STATS_FIELDS = (
+    "groupId",
+    "gameType",
+    "winner",
+    "team1",
+    "team2",
+    "playedAt",
+    "createdAt",
+)
+MATCH_STATS_PROJECTION = list(MATCH_STATS_FIELDS)
+STATS_PAGE_SIZE = 500
 
 
 @firestore_fn.on_document_written(document="matches/{matchId}")
+@instrumented("on_match_update")
 def on_match_update(event: firestore_fn.Event) -> None:
-    db = firestore.client()
+    db = get_db()
 
     match_data_before = None
     match_data_after = None
@@ -38,13 +101,45 @@ def on_match_update(event: firestore_fn.Event) -> None:
         )
         return
 
-    recalculate_group_stats(db, group_id)
+    if match_data_after is not None:
+        try:
+            sync_participant_uids(event.data.after.reference, match_data_after)
+        except Exception as e:
+            logging.error(
+                f"Error updating participant uids for matchId: "
+                f"{event.params.get('matchId')}: {str(e)}"
+            )
+
+    if match_data_before and match_data_after:
+        if match_stats_fields_equal(match_data_before, match_data_after):
+            return
+
+    # A migration job moves the stats of the players it swaps in one go once
+    # it is done, rather than once per rewritten match.
+    if written_by_migration(match_data_before, match_data_after):
+        return
+
+    match_id = event.params.get("matchId")
+    annotate(groupId=group_id, matchId=match_id)
+
+    # Deleting a group deletes its matches one by one; none of those deletions
+    # should touch the stats the cleanup is removing.
+    if match_data_after is None and is_group_deleted(db, group_id):
+        logging.info(f"Skipping stats for match {match_id} of deleted group {group_id}")
+        return
+
+    if apply_match_delta(db, group_id, match_id, match_data_before, match_data_after):
+        return
+
+    mark_group_dirty(db, group_id, get_replay_from(match_data_before, match_data_after))
 
 
 @firestore_fn.on_document_written(document="groups/{groupId}")
+@instrumented("on_group_update")
 def on_group_update(event: firestore_fn.Event) -> None:
-    db = firestore.client()
+    db = get_db()
     group_id = event.params.get("groupId")
+    annotate(groupId=group_id)
 
     if event.data.after and event.data.after.exists:
         group_data_before = (
@@ -54,6 +149,10 @@ def on_group_update(event: firestore_fn.Event) -> None:
         )
         group_data_after = event.data.after.to_dict()
 
+        # The migration job already moved the stats with this update
+        if written_by_migration(group_data_before, group_data_after):
+            return
+
         members_changed = False
         guests_changed = False
 
@@ -68,162 +167,525 @@ def on_group_update(event: firestore_fn.Event) -> None:
                 guests_changed = True
 
         if members_changed or guests_changed:
-            recalculate_group_stats(db, group_id)
+            if not apply_roster_change(
+                db, group_id, group_data_before, group_data_after
+            ):
+                mark_group_dirty(db, group_id, FULL_REPLAY)
+
+
+@scheduler_fn.on_schedule(schedule=STATS_QUEUE_SCHEDULE, max_instances=1)
+@instrumented("process_stats_queue")
+def process_stats_queue(event: scheduler_fn.ScheduledEvent) -> None:
+    """Recomputes every group that match or group triggers marked dirty."""
+    db = get_db()
+
+    claimed = claim_dirty_groups(db)
+    annotate(groupCount=len(claimed))
+    for group_id, version, replay_from in claimed:
+        succeeded = recalculate_group_stats(db, group_id, replay_from)
+        release_group(db, group_id, version, succeeded)
+
+
+def match_stats_fields_equal(
+    match_data_before: Dict[str, Any], match_data_after: Dict[str, Any]
+) -> bool:
+    """Whether a match write left every field the statistics depend on untouched."""
+    return all(
+        match_data_before.get(field) == match_data_after.get(field)
+        for field in MATCH_STATS_FIELDS
+    )
+
+
+def apply_match_delta(
+    db: firestore.Client,
+    group_id: str,
+    match_id: str,
+    match_data_before: Optional[Dict[str, Any]],
+    match_data_after: Optional[Dict[str, Any]],
+) -> bool:
+    """Fold a single match write into the stored stats without replaying the group.
 
+    Returns False when the write cannot be applied incrementally and the caller
+    has to fall back to a full recalculation.
+    """
+    # Deletions change streak order and always need a replay
+    if match_data_after is None:
+        return False
+
+    if match_data_before and match_data_after:
+        if match_data_before.get("groupId") != match_data_after.get("groupId"):
+            return False
 
-def recalculate_group_stats(db: firestore.Client, group_id: str) -> None:
     try:
-        group_ref = db.collection("groups").document(group_id)
-        group_doc = group_ref.get()
+        transaction = db.transaction()
+        # Reads and the fold inside charge their own phases; what is left is
+        # the commit.
+        with phase("write"):
+            applied = _apply_match_delta_in_transaction(
+                transaction,
+                db,
+                group_id,
+                match_id,
+                match_data_before,
+                match_data_after,
+            )
+        if applied:
+            logging.info(f"Applied match {match_id} to stats for group {group_id}")
+        return applied
+    except Exception as e:
+        logging.error(
+            f"Error applying match {match_id} to stats for group {group_id}: {str(e)}"
+        )
+        return False
+
+
+@firestore.transactional
+def _apply_match_delta_in_transaction(
+    transaction: firestore.Transaction,
+    db: firestore.Client,
+    group_id: str,
+    match_id: str,
+    match_data_before: Optional[Dict[str, Any]],
+    match_data_after: Optional[Dict[str, Any]],
+) -> bool:
+    # A queued recompute will overwrite the stats anyway; adding to them now
+    # could race with the replay that is about to run.
+    with phase("fetch"):
+        if is_group_dirty(db, group_id, transaction=transaction):
+            return False
+
+        stats_ref = db.collection("groupStats").document(group_id)
+        stats_doc = stats_ref.get(transaction=transaction)
+        count_reads()
+        if not stats_doc.exists:
+            return False
+
+        previous_summary = stats_doc.to_dict()
+        stats = copy.deepcopy(previous_summary)
+        player_hashes = stats.pop(PLAYER_HASHES_FIELD, None)
+        if player_hashes is None:
+            # Stored before player stats moved to their own docs.
+            return False
+
+        match_players = set()
+        for match_data in (match_data_before, match_data_after):
+            if match_data:
+                match_players.update(get_player_results(match_data))
+        stats["playerStats"] = load_player_stats(
+            db,
+            stats_ref,
+            sorted(match_players.intersection(player_hashes)),
+            transaction=transaction,
+        )
+
+        # An edit changes what the checkpoints taken since the match hold, and
+        # a replay resumes after every match played at a checkpoint's time, so
+        # a match appended at that same time would be skipped.
+        stale_checkpoints = get_checkpoints_from(
+            stats_ref.collection(CHECKPOINTS_COLLECTION),
+            get_replay_from(match_data_before, match_data_after),
+            transaction=transaction,
+        )
+
+    with phase("compute"):
+        if not apply_match_delta_to_stats(
+            stats, match_id, match_data_before, match_data_after
+        ):
+            return False
+
+        stats["lastUpdated"] = firestore.SERVER_TIMESTAMP
+        writes = plan_stats_writes(stats_ref, stats, previous_summary, partial=True)
+        writes.extend(
+            (checkpoint_ref, "delete", None) for checkpoint_ref in stale_checkpoints
+        )
+
+    apply_stats_writes(transaction, writes)
+    return True
+
+
+def apply_match_delta_to_stats(
+    stats: Dict[str, Any],
+    match_id: str,
+    match_data_before: Optional[Dict[str, Any]],
+    match_data_after: Optional[Dict[str, Any]],
+) -> bool:
+    """Apply a match write to a stats document in place.
+
+    New matches played after everything already counted are appended, streaks
+    included. Edits that keep the date and every player's result only move the
+    order-independent numbers. Anything else (deletes, back-dated inserts, result
+    or date changes) would change streak order and returns False.
+    """
+    if "matchesPerDay" not in stats or "replayWatermark" not in stats:
+        return False
+
+    player_stats = stats.setdefault("playerStats", {})
+    team_color_stats = stats.setdefault("teamColorStats", {})
+
+    if match_data_after is None:
+        return False
+
+    if match_data_before is None:
+        sort_key = get_match_sort_key(match_data_after, match_id)
+        watermark = watermark_from_dict(stats["replayWatermark"])
+        if sort_key is None:
+            return False
+        if watermark is None and stats.get("totalMatches", 0) > 0:
+            return False
+        if watermark is not None and sort_key <= watermark:
+            return False
+
+        player_table = PlayerTable.from_dicts(player_stats)
+        process_match(match_data_after, player_table, team_color_stats, stats)
+        player_stats = stats["playerStats"] = player_table.to_dicts()
+
+        match_date = get_date_string_from_timestamp(match_data_after["playedAt"])
+        if match_date:
+            matches_per_day = stats["matchesPerDay"]
+            matches_per_day[match_date] = matches_per_day.get(match_date, 0) + 1
+
+        stats["replayWatermark"] = watermark_to_dict(sort_key)
+    else:
+        if get_match_sort_key(match_data_before, match_id) != get_match_sort_key(
+            match_data_after, match_id
+        ):
+            return False
+        if get_player_results(match_data_before) != get_player_results(
+            match_data_after
+        ):
+            return False
+        if get_team_colors(match_data_before) != get_team_colors(match_data_after):
+            return False
+
+        apply_match_contribution(
+            match_data_before, player_stats, team_color_stats, stats, -1
+        )
+        apply_match_contribution(
+            match_data_after, player_stats, team_color_stats, stats, 1
+        )
+
+    stats["mostMatchesInOneDay"] = find_most_active_day(stats["matchesPerDay"])
+    sync_partner_names(player_stats)
+    calculate_derived_stats(player_stats, team_color_stats)
+    return True
+
+
+def get_replay_from(
+    match_data_before: Optional[Dict[str, Any]],
+    match_data_after: Optional[Dict[str, Any]],
+) -> float:
+    """Earliest playedAt, in seconds, that a match write could have affected."""
+    replay_from = None
+    for match_data in (match_data_before, match_data_after):
+        if not match_data:
+            continue
+        played_at = get_timestamp_seconds(match_data.get("playedAt"))
+        if played_at is None:
+            return FULL_REPLAY
+        if replay_from is None or played_at < replay_from:
+            replay_from = played_at
+    return FULL_REPLAY if replay_from is None else replay_from
+
+
+def get_player_results(match_data: Dict[str, Any]) -> Dict[str, str]:
+    winner = match_data.get("winner", "draw")
+    results = {}
+    for team_key in ("team1", "team2"):
+        for player in extract_players_from_team(match_data.get(team_key, {})):
+            player_id = player.get("uid", "")
+            if not player_id:
+                continue
+            if winner not in ("team1", "team2"):
+                results[player_id] = "draw"
+            else:
+                results[player_id] = "win" if winner == team_key else "loss"
+    return results
+
+
+def get_team_colors(match_data: Dict[str, Any]) -> Tuple[str, str]:
+    return (
+        match_data.get("team1", {}).get("color", "#000000"),
+        match_data.get("team2", {}).get("color", "#ffffff"),
+    )
+
+
+def recalculate_group_stats(
+    db: firestore.Client, group_id: str, replay_from: float = FULL_REPLAY
+) -> bool:
+    """Rebuild a group's stats document.
+
+    `replay_from` is the earliest playedAt (in seconds) that changed since the
+    stats were last computed; the replay resumes from the newest checkpoint
+    before it instead of from the group's first match.
+    """
+    try:
+        with phase("fetch"):
+            group_ref = db.collection("groups").document(group_id)
+            group_doc = group_ref.get()
+            count_reads()
 
         if not group_doc.exists:
             logging.warning(
                 f"Group with ID {group_id} not found, cannot calculate stats"
             )
-            return
+            return True
 
         group_data = group_doc.to_dict()
 
-        matches_ref = db.collection("matches")
-        matches_query = matches_ref.where(
-            filter=firestore.FieldFilter("groupId", "==", group_id)
-        )
-        matches = list(matches_query.stream())
+        stats_ref = db.collection("groupStats").document(group_id)
+        checkpoints_ref = stats_ref.collection(CHECKPOINTS_COLLECTION)
+
+        state = create_stats_state(group_data)
+        roster = get_roster_signature(state)
+        resume_after = None
+
+        with phase("fetch"):
+            checkpoint = load_checkpoint(db, checkpoints_ref, roster, replay_from)
+        if checkpoint:
+            state = checkpoint_to_state(checkpoint, state)
+            resume_after = {"playedAt": checkpoint["playedAt"]}
+            logging.info(
+                f"Resuming stats replay for group {group_id} after "
+                f"{state['general_stats']['totalMatches']} checkpointed matches"
+            )
 
-        if not matches:
+        if STATS_ENGINE == "columnar":
+            fold_runs = fold_runs_columnar
+        elif STATS_PARALLEL_WORKERS > 1:
+            fold_runs = fold_runs_in_parallel
+        else:
+            fold_runs = fold_runs_sequentially
+
+        last_checkpoint_count = state["general_stats"]["totalMatches"]
+        runs = stream_group_match_runs(db, group_id, resume_after=resume_after)
+        folded_runs = fold_runs(state, runs)
+        # Page fetches and checkpoint writes inside charge their own phases
+        with phase("compute"):
+            for state, played_at in folded_runs:
+                match_count = state["general_stats"]["totalMatches"]
+                if match_count - last_checkpoint_count >= STATS_CHECKPOINT_INTERVAL:
+                    save_checkpoint(checkpoints_ref, state, roster, played_at)
+                    last_checkpoint_count = match_count
+
+        # The group may have been deleted while the replay ran; writing now
+        # would recreate the stats its cleanup removes.
+        if is_group_deleted(db, group_id):
+            logging.info(f"Group {group_id} was deleted, not writing its stats")
+            return True
+
+        if state["general_stats"]["totalMatches"] == 0:
             logging.info(f"No matches found for group {group_id}")
             create_empty_stats(db, group_id, group_data)
-            return
+            return True
 
-        player_stats: Dict[str, Dict[str, Any]] = {}
-        team_color_stats: Dict[str, Dict[str, Any]] = {}
-        general_stats = {
-            "totalMatches": 0,
-            "matchesByGameType": {"1v1": 0, "2v2": 0},
-            "longestWinStreak": {"player": "", "count": 0, "playerName": ""},
-            "mostMatchesInOneDay": {"date": None, "count": 0},
-        }
+        with phase("compute"):
+            stats_doc = build_stats_doc(group_id, state)
+        write_stats(db, group_id, stats_doc)
 
-        initialize_player_stats(player_stats, group_data)
+        logging.info(f"Successfully updated stats for group {group_id}")
+        return True
 
-        if "teamColors" in group_data:
-            team_color_stats[group_data["teamColors"].get("teamOne", "#000000")] = (
-                create_team_color_stats_object()
-            )
-            team_color_stats[group_data["teamColors"].get("teamTwo", "#ffffff")] = (
-                create_team_color_stats_object()
-            )
+    except Exception as e:
+        logging.error(f"Error calculating stats for group {group_id}: {str(e)}")
+        return False
+
+
+def stream_group_matches(
+    db: firestore.Client, group_id: str, page_size: Optional[int] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (match_id, match_data) for a group's matches in chronological order."""
+    for _played_at, run in stream_group_match_runs(db, group_id, page_size):
+        yield from run
+
+
+def stream_group_match_runs(
+    db: firestore.Client,
+    group_id: str,
+    page_size: Optional[int] = None,
+    resume_after: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[Any, List[Tuple[str, Dict[str, Any]]]]]:
+    """Yield (playedAt, matches) runs of a group's matches in chronological order.
+
+    Pages through `groupId == X ORDER BY playedAt` with a cursor and only the
+    fields the stats need, so at most one page is held in memory. Matches that
+    share a playedAt form one run, released in createdAt order. `resume_after`
+    is a `{"playedAt": ...}` cursor that skips every run up to and including it.
+    """
+    page_size = page_size or STATS_PAGE_SIZE
+    query = (
+        db.collection("matches")
+        .where(filter=firestore.FieldFilter("groupId", "==", group_id))
+        .order_by("playedAt")
+        .select(MATCH_STATS_PROJECTION)
+        .limit(page_size)
+    )
 
-        # Track matches per day to find most active day
-        matches_per_day = defaultdict(int)
+    run: List[Tuple[Tuple[float, float, str], Dict[str, Any]]] = []
+    cursor = resume_after
+
+    while True:
+        page_query = query.start_after(cursor) if cursor is not None else query
+        with phase("fetch"):
+            page = list(count_query(page_query.stream()))
 
-        for match_doc in matches:
+        for match_doc in page:
             match_data = match_doc.to_dict()
-            match_data["id"] = match_doc.id
-
-            # Track matches per day
-            if "playedAt" in match_data:
-                match_date = get_date_string_from_timestamp(match_data["playedAt"])
-                if match_date:
-                    matches_per_day[match_date] += 1
-
-            process_match(match_data, player_stats, team_color_stats, general_stats)
-
-        # Find the day with most matches
-        if matches_per_day:
-            most_active_day = max(matches_per_day.items(), key=lambda x: x[1])
-            general_stats["mostMatchesInOneDay"] = {
-                "date": most_active_day[0],  # Date string
-                "count": most_active_day[1],  # Number of matches
-            }
+            # A null playedAt sorts before every timestamp in Firestore
+            sort_key = get_match_sort_key(match_data, match_doc.id) or (
+                float("-inf"),
+                0.0,
+                match_doc.id,
+            )
+            if run and sort_key[0] != run[0][0][0]:
+                yield _release_run(run)
+                run = []
+            run.append((sort_key, match_data))
 
-        calculate_derived_stats(player_stats, team_color_stats)
+        if len(page) < page_size:
+            break
+        cursor = page[-1]
 
-        stats_doc = {
-            "groupId": group_id,
-            "lastUpdated": firestore.SERVER_TIMESTAMP,
-            "playerStats": player_stats,
-            "teamColorStats": team_color_stats,
-            **general_stats,
-        }
+    if run:
+        yield _release_run(run)
 
-        stats_ref = db.collection("groupStats").document(group_id)
-        stats_ref.set(stats_doc)
 
-        logging.info(f"Successfully updated stats for group {group_id}")
+def _release_run(
+    run: List[Tuple[Tuple[float, float, str], Dict[str, Any]]],
+) -> Tuple[Any, List[Tuple[str, Dict[str, Any]]]]:
+    run.sort(key=lambda entry: entry[0])
+    played_at = run[0][1].get("playedAt")
+    return played_at, [(sort_key[2], match_data) for sort_key, match_data in run]
 
-    except Exception as e:
-        logging.error(f"Error calculating stats for group {group_id}: {str(e)}")
 
+def create_stats_state(group_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Create the running aggregate that a replay folds matches into."""
+    player_stats: Dict[str, Dict[str, Any]] = {}
+    team_color_stats: Dict[str, Dict[str, Any]] = {}
 
-def get_date_string_from_timestamp(timestamp: Any) -> Optional[str]:
-    """Convert a Firestore timestamp to a date string (YYYY-MM-DD format)."""
-    try:
-        if hasattr(timestamp, "toDate"):
-            date_obj = timestamp.toDate()
-            return date_obj.strftime("%Y-%m-%d")
-        elif isinstance(timestamp, dict) and "seconds" in timestamp:
-            date_obj = datetime.fromtimestamp(timestamp["seconds"])
-            return date_obj.strftime("%Y-%m-%d")
-        return None
-    except Exception as e:
-        logging.error(f"Error converting timestamp to date: {e}")
-        return None
+    initialize_player_stats(player_stats, group_data)
+
+    if "teamColors" in group_data:
+        team_color_stats[group_data["teamColors"].get("teamOne", "#000000")] = (
+            create_team_color_stats_object()
+        )
+        team_color_stats[group_data["teamColors"].get("teamTwo", "#ffffff")] = (
+            create_team_color_stats_object()
+        )
+
+    return {
+        "player_stats": PlayerTable.from_dicts(player_stats),
+        "team_color_stats": team_color_stats,
+        "general_stats": {
+            "totalMatches": 0,
+            "matchesByGameType": {"1v1": 0, "2v2": 0},
+            "longestWinStreak": {"player": "", "count": 0, "playerName": ""},
+            "mostMatchesInOneDay": {"date": None, "count": 0},
+        },
+        # Track matches per day to find most active day
+        "matches_per_day": defaultdict(int),
+        "watermark": None,
+    }
 
 
-def initialize_player_stats(
-    player_stats: Dict[str, Dict[str, Any]], group_data: Dict[str, Any]
+def fold_match_into_state(
+    state: Dict[str, Any], match_id: str, match_data: Dict[str, Any]
 ) -> None:
-    if "members" in group_data:
-        for member_id, member_data in group_data["members"].items():
-            player_stats[member_id] = create_player_stats_object(
-                display_name=member_data.get("name", "Unknown"), is_guest=False
-            )
+    if "playedAt" in match_data:
+        match_date = get_date_string_from_timestamp(match_data["playedAt"])
+        if match_date:
+            state["matches_per_day"][match_date] += 1
+
+    process_match(
+        match_data,
+        state["player_stats"],
+        state["team_color_stats"],
+        state["general_stats"],
+    )
+
+    sort_key = get_match_sort_key(match_data, match_id)
+    if sort_key and (state["watermark"] is None or sort_key > state["watermark"]):
+        state["watermark"] = sort_key
 
-    if "guests" in group_data and isinstance(group_data["guests"], list):
-        for guest in group_data["guests"]:
-            if isinstance(guest, dict) and "id" in guest and "name" in guest:
-                guest_id = f"guest_{guest['id']}"
-                player_stats[guest_id] = create_player_stats_object(
-                    display_name=guest.get("name", "Unknown Guest"), is_guest=True
-                )
 
+def fold_runs_sequentially(
+    state: Dict[str, Any],
+    runs: Iterable[Tuple[Any, List[Tuple[str, Dict[str, Any]]]]],
+) -> Iterator[Tuple[Dict[str, Any], Any]]:
+    """Fold playedAt runs into `state`, yielding (state, playedAt) after each."""
+    for played_at, run in runs:
+        for match_id, match_data in run:
+            fold_match_into_state(state, match_id, match_data)
+        yield state, played_at
+
+
+def build_stats_doc(group_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    general_stats = state["general_stats"]
+    general_stats["mostMatchesInOneDay"] = find_most_active_day(
+        state["matches_per_day"]
+    )
+
+    # Names follow the current roster, also for results resumed from checkpoints.
+    holder = state["player_stats"].get(general_stats["longestWinStreak"]["player"])
+    if holder is not None:
+        general_stats["longestWinStreak"]["playerName"] = holder.display_name
+
+    player_stats = state["player_stats"].to_dicts()
+    sync_partner_names(player_stats)
+    calculate_derived_stats(player_stats, state["team_color_stats"])
 
-def create_player_stats_object(display_name: str, is_guest: bool) -> Dict[str, Any]:
     return {
-        "displayName": display_name,
-        "isGuest": is_guest,
-        "totalMatches": 0,
-        "wins": 0,
-        "draws": 0,
-        "losses": 0,
-        "winRate": 0.0,
-        "rating": 1000,
-        "streak": 0,
-        "currentStreak": 0,
-        "longestWinStreak": 0,
-        "longestLossStreak": 0,
-        "teamPartners": {},
-        "lastPlayed": None,
-        "goalsScored": 0,
-        "goalsConceded": 0,
-        "averageGoalsScored": 0.0,
-        "averageGoalsConceded": 0.0,
+        "groupId": group_id,
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+        "playerStats": player_stats,
+        "teamColorStats": state["team_color_stats"],
+        "matchesPerDay": dict(state["matches_per_day"]),
+        "replayWatermark": watermark_to_dict(state["watermark"]),
+        **general_stats,
     }
 
 
-def create_team_color_stats_object() -> Dict[str, Any]:
+def find_most_active_day(matches_per_day: Dict[str, int]) -> Dict[str, Any]:
+    """Return the day with the most matches, preferring the earliest date on ties."""
+    most_active_day = {"date": None, "count": 0}
+    for date, count in sorted(matches_per_day.items()):
+        if count > most_active_day["count"]:
+            most_active_day = {"date": date, "count": count}
+    return most_active_day
+
+
+def watermark_to_dict(
+    watermark: Optional[Tuple[float, float, str]],
+) -> Optional[Dict[str, Any]]:
+    if watermark is None:
+        return None
     return {
-        "totalMatches": 0,
-        "wins": 0,
-        "draws": 0,
-        "losses": 0,
-        "winRate": 0.0,
-        "goalsScored": 0,
-        "goalsConceded": 0,
+        "playedAt": watermark[0],
+        "createdAt": watermark[1],
+        "matchId": watermark[2],
     }
 
 
+def watermark_from_dict(
+    watermark: Optional[Dict[str, Any]],
+) -> Optional[Tuple[float, float, str]]:
+    if not watermark:
+        return None
+    return (
+        watermark.get("playedAt", 0.0),
+        watermark.get("createdAt", 0.0),
+        watermark.get("matchId", ""),
+    )
+
+
+def initialize_player_stats(
+    player_stats: Dict[str, Dict[str, Any]], group_data: Dict[str, Any]
+) -> None:
+    for player_id, (display_name, is_guest) in get_group_roster(group_data).items():
+        player_stats[player_id] = create_player_stats_object(
+            display_name=display_name, is_guest=is_guest
+        )
+
+
 def create_empty_stats(
     db: firestore.Client, group_id: str, group_data: Dict[str, Any]
 ) -> None:
@@ -249,16 +711,17 @@ def create_empty_stats(
         "matchesByGameType": {"1v1": 0, "2v2": 0},
         "longestWinStreak": {"player": "", "count": 0, "playerName": ""},
         "mostMatchesInOneDay": {"date": None, "count": 0},
+        "matchesPerDay": {},
+        "replayWatermark": None,
     }
 
-    stats_ref = db.collection("groupStats").document(group_id)
-    stats_ref.set(stats_doc)
+    write_stats(db, group_id, stats_doc)
     logging.info(f"Created empty stats document for group {group_id}")
 
 
 def process_match(
     match_data: Dict[str, Any],
-    player_stats: Dict[str, Dict[str, Any]],
+    player_stats: PlayerTable,
     team_color_stats: Dict[str, Dict[str, Any]],
     general_stats: Dict[str, Any],
 ) -> None:
@@ -298,23 +761,6 @@ def process_match(
     )
 
 
-def extract_players_from_team(team_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-    players = []
-    if "players" in team_data:
-        players_data = team_data["players"]
-
-        if isinstance(players_data, list):
-            players = players_data
-        elif isinstance(players_data, dict):
-            players = [
-                players_data[k]
-                for k in sorted(players_data.keys())
-                if isinstance(players_data[k], dict)
-            ]
-
-    return players
-
-
 def update_team_color_stats(
     team_color_stats: Dict[str, Dict[str, Any]],
     team1_color: str,
@@ -354,7 +800,7 @@ def get_match_timestamp(match_data: Dict[str, Any]) -> Optional[Any]:
 
 
 def update_player_stats(
-    player_stats: Dict[str, Dict[str, Any]],
+    player_stats: PlayerTable,
     team1_players: List[Dict[str, Any]],
     team2_players: List[Dict[str, Any]],
     team1_score: int,
@@ -364,106 +810,82 @@ def update_player_stats(
     general_stats: Dict[str, Any],
     game_type: str,
 ) -> None:
-    for player in team1_players:
-        player_id = player.get("uid", "")
-        if not player_id or player_id not in player_stats:
-            continue
-
-        player_stats[player_id]["totalMatches"] += 1
-        player_stats[player_id]["goalsScored"] += team1_score
-        player_stats[player_id]["goalsConceded"] += team2_score
-        player_stats[player_id]["lastPlayed"] = timestamp
-
-        if winner == "team1":
-            player_stats[player_id]["wins"] += 1
-            update_player_streak(
-                player_stats[player_id], "win", general_stats, player_id
-            )
-        elif winner == "team2":
-            player_stats[player_id]["losses"] += 1
-            update_player_streak(
-                player_stats[player_id], "loss", general_stats, player_id
-            )
-        else:
-            player_stats[player_id]["draws"] += 1
-            update_player_streak(
-                player_stats[player_id], "draw", general_stats, player_id
-            )
-
-        if game_type == "2v2" and len(team1_players) > 1:
-            update_team_partnerships(
-                player_stats, player_id, team1_players, winner == "team1"
-            )
-
-    for player in team2_players:
-        player_id = player.get("uid", "")
-        if not player_id or player_id not in player_stats:
-            continue
-
-        player_stats[player_id]["totalMatches"] += 1
-        player_stats[player_id]["goalsScored"] += team2_score
-        player_stats[player_id]["goalsConceded"] += team1_score
-        player_stats[player_id]["lastPlayed"] = timestamp
-
-        if winner == "team2":
-            player_stats[player_id]["wins"] += 1
-            update_player_streak(
-                player_stats[player_id], "win", general_stats, player_id
-            )
-        elif winner == "team1":
-            player_stats[player_id]["losses"] += 1
-            update_player_streak(
-                player_stats[player_id], "loss", general_stats, player_id
-            )
-        else:
-            player_stats[player_id]["draws"] += 1
-            update_player_streak(
-                player_stats[player_id], "draw", general_stats, player_id
-            )
-
-        if game_type == "2v2" and len(team2_players) > 1:
-            update_team_partnerships(
-                player_stats, player_id, team2_players, winner == "team2"
-            )
+    if winner == "team1":
+        team1_result, team2_result = "win", "loss"
+    elif winner == "team2":
+        team1_result, team2_result = "loss", "win"
+    else:
+        team1_result = team2_result = "draw"
+
+    for team_players, result, scored, conceded in (
+        (team1_players, team1_result, team1_score, team2_score),
+        (team2_players, team2_result, team2_score, team1_score),
+    ):
+        is_partnership = game_type == "2v2" and len(team_players) > 1
+        for player in team_players:
+            player_id = player.get("uid", "")
+            player_stat = player_stats.get(player_id) if player_id else None
+            if player_stat is None:
+                continue
+
+            player_stat.total_matches += 1
+            player_stat.goals_scored += scored
+            player_stat.goals_conceded += conceded
+            player_stat.last_played = timestamp
+
+            if result == "win":
+                player_stat.wins += 1
+            elif result == "loss":
+                player_stat.losses += 1
+            else:
+                player_stat.draws += 1
+            update_player_streak(player_stat, result, general_stats, player_id)
+
+            if is_partnership:
+                update_team_partnerships(
+                    player_stats, player_stat, player_id, team_players, result == "win"
+                )
 
 
 def update_player_streak(
-    player_stat: Dict[str, Any],
+    player_stat: PlayerRecord,
     result: str,
     general_stats: Dict[str, Any],
     player_id: str,
 ) -> None:
     if result == "draw":
-        player_stat["currentStreak"] = 0
+        player_stat.current_streak = 0
         return
 
     if result == "win":
-        if player_stat["currentStreak"] < 0:
-            player_stat["currentStreak"] = 1
+        if player_stat.current_streak < 0:
+            player_stat.current_streak = 1
         else:
-            player_stat["currentStreak"] += 1
+            player_stat.current_streak += 1
 
-        if player_stat["currentStreak"] > player_stat["longestWinStreak"]:
-            player_stat["longestWinStreak"] = player_stat["currentStreak"]
+        if player_stat.current_streak > player_stat.longest_win_streak:
+            player_stat.longest_win_streak = player_stat.current_streak
 
-        if player_stat["currentStreak"] > general_stats["longestWinStreak"]["count"]:
-            general_stats["longestWinStreak"]["count"] = player_stat["currentStreak"]
-            general_stats["longestWinStreak"]["player"] = player_id
-            general_stats["longestWinStreak"]["playerName"] = player_stat["displayName"]
+        longest_win_streak = general_stats["longestWinStreak"]
+        if player_stat.current_streak > longest_win_streak["count"]:
+            longest_win_streak["count"] = player_stat.current_streak
+            longest_win_streak["player"] = player_id
+            longest_win_streak["playerName"] = player_stat.display_name
 
     elif result == "loss":
-        if player_stat["currentStreak"] > 0:
-            player_stat["currentStreak"] = -1
+        if player_stat.current_streak > 0:
+            player_stat.current_streak = -1
         else:
-            player_stat["currentStreak"] -= 1
+            player_stat.current_streak -= 1
 
-        loss_streak_magnitude = abs(player_stat["currentStreak"])
-        if loss_streak_magnitude > player_stat["longestLossStreak"]:
-            player_stat["longestLossStreak"] = loss_streak_magnitude
+        loss_streak_magnitude = -player_stat.current_streak
+        if loss_streak_magnitude > player_stat.longest_loss_streak:
+            player_stat.longest_loss_streak = loss_streak_magnitude
 
 
 def update_team_partnerships(
-    player_stats: Dict[str, Dict[str, Any]],
+    player_stats: PlayerTable,
+    player_stat: PlayerRecord,
     player_id: str,
     team_players: List[Dict[str, Any]],
     is_win: bool,
@@ -471,20 +893,119 @@ def update_team_partnerships(
     for teammate in team_players:
         teammate_id = teammate.get("uid", "")
         if teammate_id and teammate_id != player_id:
-            if "teamPartners" not in player_stats[player_id]:
-                player_stats[player_id]["teamPartners"] = {}
-
-            if teammate_id not in player_stats[player_id]["teamPartners"]:
-                player_stats[player_id]["teamPartners"][teammate_id] = {
-                    "displayName": teammate.get("displayName", "Unknown"),
-                    "matches": 0,
-                    "wins": 0,
-                    "winRate": 0.0,
-                }
-
-            player_stats[player_id]["teamPartners"][teammate_id]["matches"] += 1
+            teammate_index = player_stats.intern(teammate_id)
+            partner = player_stat.team_partners.get(teammate_index)
+            if partner is None:
+                partner = PartnerRecord(teammate.get("displayName", "Unknown"))
+                player_stat.team_partners[teammate_index] = partner
+
+            partner.matches += 1
             if is_win:
-                player_stats[player_id]["teamPartners"][teammate_id]["wins"] += 1
+                partner.wins += 1
+
+
+def apply_match_contribution(
+    match_data: Dict[str, Any],
+    player_stats: Dict[str, Dict[str, Any]],
+    team_color_stats: Dict[str, Dict[str, Any]],
+    general_stats: Dict[str, Any],
+    sign: int,
+) -> None:
+    """Add (sign=1) or remove (sign=-1) the order-independent part of a match.
+
+    Streaks and lastPlayed depend on the order of matches and are left untouched.
+    """
+    general_stats["totalMatches"] += sign
+
+    game_type = match_data.get("gameType", "1v1")
+    general_stats["matchesByGameType"][game_type] = (
+        general_stats["matchesByGameType"].get(game_type, 0) + sign
+    )
+
+    winner = match_data.get("winner", "draw")
+    team1_data = match_data.get("team1", {})
+    team2_data = match_data.get("team2", {})
+    team1_score = team1_data.get("score", 0)
+    team2_score = team2_data.get("score", 0)
+    team1_color, team2_color = get_team_colors(match_data)
+
+    sides = (
+        ("team1", team1_data, team1_color, team1_score, team2_score),
+        ("team2", team2_data, team2_color, team2_score, team1_score),
+    )
+    for team_key, team_data, color, scored, conceded in sides:
+        if winner not in ("team1", "team2"):
+            result = "draws"
+        else:
+            result = "wins" if winner == team_key else "losses"
+
+        if color not in team_color_stats:
+            team_color_stats[color] = create_team_color_stats_object()
+        team_color_stats[color]["totalMatches"] += sign
+        team_color_stats[color]["goalsScored"] += sign * scored
+        team_color_stats[color]["goalsConceded"] += sign * conceded
+        team_color_stats[color][result] += sign
+
+        team_players = extract_players_from_team(team_data)
+        for player in team_players:
+            player_id = player.get("uid", "")
+            if not player_id or player_id not in player_stats:
+                continue
+
+            player_stats[player_id]["totalMatches"] += sign
+            player_stats[player_id]["goalsScored"] += sign * scored
+            player_stats[player_id]["goalsConceded"] += sign * conceded
+            player_stats[player_id][result] += sign
+
+            if game_type == "2v2" and len(team_players) > 1:
+                adjust_team_partnerships(
+                    player_stats[player_id],
+                    player_id,
+                    team_players,
+                    result == "wins",
+                    sign,
+                )
+
+
+def adjust_team_partnerships(
+    player_stat: Dict[str, Any],
+    player_id: str,
+    team_players: List[Dict[str, Any]],
+    is_win: bool,
+    sign: int,
+) -> None:
+    partners = player_stat.setdefault("teamPartners", {})
+    for teammate in team_players:
+        teammate_id = teammate.get("uid", "")
+        if not teammate_id or teammate_id == player_id:
+            continue
+
+        if teammate_id not in partners:
+            partners[teammate_id] = {
+                "displayName": teammate.get("displayName", "Unknown"),
+                "matches": 0,
+                "wins": 0,
+                "winRate": 0.0,
+            }
+
+        partners[teammate_id]["matches"] += sign
+        if is_win:
+            partners[teammate_id]["wins"] += sign
+
+        if partners[teammate_id]["matches"] <= 0:
+            del partners[teammate_id]
+
+
+def sync_partner_names(player_stats: Dict[str, Dict[str, Any]]) -> None:
+    """Show partners that are in the group under their current display name.
+
+    Partners who are not (or no longer) in the group keep the name recorded
+    in the match they were first seen in.
+    """
+    for stats in player_stats.values():
+        for partner_id, partner_stats in stats.get("teamPartners", {}).items():
+            if partner_id in player_stats:
+                partner_stats["displayName"] = player_stats[partner_id]["displayName"]
 
 
 def calculate_derived_stats(
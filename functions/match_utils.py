@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def get_timestamp_seconds(timestamp: Any) -> Optional[float]:
+    """Convert a Firestore timestamp to seconds since the epoch."""
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if hasattr(timestamp, "toDate"):
+        return timestamp.toDate().timestamp()
+    if isinstance(timestamp, dict) and "seconds" in timestamp:
+        return timestamp["seconds"] + timestamp.get("nanoseconds", 0) / 1e9
+    return None
+
+
+def get_match_sort_key(
+    match_data: Dict[str, Any], match_id: str
+) -> Optional[Tuple[float, float, str]]:
+    """Chronological position of a match: playedAt, then createdAt, then id.
+
+    The match form pins playedAt to noon of the chosen day, so createdAt is what
+    orders matches logged on the same day.
+    """
+    played_at = get_timestamp_seconds(match_data.get("playedAt"))
+    if played_at is None:
+        return None
+    created_at = get_timestamp_seconds(match_data.get("createdAt")) or 0.0
+    return (played_at, created_at, match_id or "")
+
+
+def get_date_string_from_timestamp(timestamp: Any) -> Optional[str]:
+    """Convert a Firestore timestamp to a date string (YYYY-MM-DD format)."""
+    try:
+        if isinstance(timestamp, datetime):
+            return timestamp.strftime("%Y-%m-%d")
+        elif hasattr(timestamp, "toDate"):
+            date_obj = timestamp.toDate()
+            return date_obj.strftime("%Y-%m-%d")
+        elif isinstance(timestamp, dict) and "seconds" in timestamp:
+            date_obj = datetime.fromtimestamp(timestamp["seconds"])
+            return date_obj.strftime("%Y-%m-%d")
+        return None
+    except Exception as e:
+        logging.error(f"Error converting timestamp to date: {e}")
+        return None
+
+
+def create_player_stats_object(display_name: str, is_guest: bool) -> Dict[str, Any]:
+    return {
+        "displayName": display_name,
+        "isGuest": is_guest,
+        "totalMatches": 0,
+        "wins": 0,
+        "draws": 0,
+        "losses": 0,
+        "winRate": 0.0,
+        "rating": 1000,
+        "streak": 0,
+        "currentStreak": 0,
+        "longestWinStreak": 0,
+        "longestLossStreak": 0,
+        "teamPartners": {},
+        "lastPlayed": None,
+        "goalsScored": 0,
+        "goalsConceded": 0,
+        "averageGoalsScored": 0.0,
+        "averageGoalsConceded": 0.0,
+    }
+
+
+def create_team_color_stats_object() -> Dict[str, Any]:
+    return {
+        "totalMatches": 0,
+        "wins": 0,
+        "draws": 0,
+        "losses": 0,
+        "winRate": 0.0,
+        "goalsScored": 0,
+        "goalsConceded": 0,
+    }
+
+
+def extract_players_from_team(team_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    players = []
+    if "players" in team_data:
+        players_data = team_data["players"]
+
+        if isinstance(players_data, list):
+            players = players_data
+        elif isinstance(players_data, dict):
+            players = [
+                players_data[k]
+                for k in sorted(players_data.keys())
+                if isinstance(players_data[k], dict)
+            ]
+
+    return players
+
+
+def get_group_roster(group_data: Dict[str, Any]) -> Dict[str, Tuple[str, bool]]:
+    """Players that get stats in a group: id -> (displayName, isGuest)."""
+    roster = {}
+    if "members" in group_data:
+        for member_id, member_data in group_data["members"].items():
+            roster[member_id] = (member_data.get("name", "Unknown"), False)
+
+    if "guests" in group_data and isinstance(group_data["guests"], list):
+        for guest in group_data["guests"]:
+            if isinstance(guest, dict) and "id" in guest and "name" in guest:
+                guest_id = f"guest_{guest['id']}"
+                roster[guest_id] = (guest.get("name", "Unknown Guest"), True)
+
+    return roster
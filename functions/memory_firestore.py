@@ -0,0 +1,953 @@
+"""A deterministic in-memory stand-in for the Firestore client.
+
+It implements the part of the google-cloud-firestore API the functions use:
+documents and collections, queries with FieldFilter/And/Or, order_by, cursors
+and projections, batches, bulk writers and transactions (which work with the
+real `firestore.transactional` decorator, including retries on contention),
+plus the Increment/Minimum/Maximum/ArrayUnion/ArrayRemove transforms and the
+SERVER_TIMESTAMP/DELETE_FIELD sentinels. Reads, writes and deletes are counted
+the way Firestore bills them, so a load test can report operations per call.
+
+Documents are deep-copied on the way in and out, results are ordered exactly
+(ties broken by document path), and auto IDs come from a seeded generator, so
+the same calls always produce the same state.
+"""
+
+import copy
+import itertools
+import random
+import string
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from firebase_admin import firestore
+from google.api_core import exceptions
+from google.cloud.firestore_v1.base_query import BaseCompositeFilter, FieldFilter
+from google.cloud.firestore_v1.bulk_writer import (
+    BulkWriteFailure,
+    BulkWriter,
+    BulkWriterCreateOperation,
+    BulkWriterDeleteOperation,
+    BulkWriterOperation,
+    BulkWriterSetOperation,
+    BulkWriterUpdateOperation,
+)
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.cloud.firestore_v1.transforms import (
+    ArrayRemove,
+    ArrayUnion,
+    Increment,
+    Maximum,
+    Minimum,
+)
+from google.cloud.firestore_v1.types import StructuredQuery
+
+Path = Tuple[str, ...]
+
+AUTO_ID_ALPHABET = string.ascii_letters + string.digits
+AUTO_ID_LENGTH = 20
+DOCUMENT_ID = "__name__"
+MAX_TRANSACTION_ATTEMPTS = 5
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _type_rank(value: Any) -> int:
+    """Firestore's cross-type ordering: null < bool < number < timestamp < ..."""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, MemoryDocumentReference):
+        return 6
+    if isinstance(value, (list, tuple)):
+        return 8
+    return 9
+
+
+def sort_key(value: Any) -> Tuple:
+    rank = _type_rank(value)
+    if rank == 3 and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if rank == 6:
+        value = value._path
+    elif rank == 8:
+        value = tuple(sort_key(item) for item in value)
+    elif rank == 9:
+        value = tuple((key, sort_key(item)) for key, item in sorted(value.items()))
+    return rank, value
+
+
+def _get_field(data: Dict[str, Any], path: Path) -> Tuple[bool, Any]:
+    value: Any = data
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _field_path(field: str) -> Path:
+    """The segments of a dotted field path, with backtick quoting removed."""
+    return FieldPath.from_string(field).parts
+
+
+def _normalize(value: Any) -> Any:
+    """Store values the way Firestore returns them: timestamps are UTC-aware."""
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+class MemoryDocumentSnapshot:
+    def __init__(
+        self,
+        reference: "MemoryDocumentReference",
+        data: Optional[Dict[str, Any]],
+        create_time: Optional[datetime] = None,
+        update_time: Optional[datetime] = None,
+    ) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str) -> Any:
+        found, value = _get_field(self._data or {}, _field_path(field_path))
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocumentReference:
+    def __init__(self, client: "MemoryFirestore", path: Path) -> None:
+        self._client = client
+        self._path = path
+        self.id = path[-1]
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, MemoryDocumentReference) and other._path == self._path
+
+    def __hash__(self) -> int:
+        return hash(self._path)
+
+    def __repr__(self) -> str:
+        return f"MemoryDocumentReference({self.path!r})"
+
+    @property
+    def path(self) -> str:
+        return "/".join(self._path)
+
+    @property
+    def parent(self) -> "MemoryCollectionReference":
+        return MemoryCollectionReference(self._client, self._path[:-1])
+
+    def collection(self, collection_id: str) -> "MemoryCollectionReference":
+        return MemoryCollectionReference(self._client, self._path + (collection_id,))
+
+    def collections(self) -> Iterator["MemoryCollectionReference"]:
+        for collection_id in self._client._subcollection_ids(self._path):
+            yield self.collection(collection_id)
+
+    def get(
+        self,
+        field_paths: Optional[Iterable[str]] = None,
+        transaction: Optional["MemoryTransaction"] = None,
+    ) -> MemoryDocumentSnapshot:
+        return self._client._get_documents([self], field_paths, transaction)[0]
+
+    def create(self, document_data: Dict[str, Any]) -> None:
+        self._client._commit([("create", self, document_data, False)])
+
+    def set(self, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._client._commit([("set", self, document_data, merge)])
+
+    def update(self, field_updates: Dict[str, Any]) -> None:
+        self._client._commit([("update", self, field_updates, False)])
+
+    def delete(self) -> None:
+        self._client._commit([("delete", self, None, False)])
+
+
+class MemoryQuery:
+    """An immutable query; every builder method returns a new one."""
+
+    def __init__(
+        self,
+        client: "MemoryFirestore",
+        parent: Path,
+        collection_id: str,
+        all_descendants: bool = False,
+    ) -> None:
+        self._client = client
+        self._parent = parent
+        self._collection_id = collection_id
+        self._all_descendants = all_descendants
+        self._filters: List[Any] = []
+        self._orders: List[Tuple[Path, str]] = []
+        self._projection: Optional[List[Path]] = None
+        self._limit: Optional[int] = None
+        self._limit_to_last = False
+        self._offset = 0
+        self._start: Optional[Tuple[List[Any], bool]] = None
+        self._end: Optional[Tuple[List[Any], bool]] = None
+
+    def _copy(self) -> "MemoryQuery":
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+    def where(
+        self,
+        field_path: Optional[str] = None,
+        op_string: Optional[str] = None,
+        value: Any = None,
+        *,
+        filter: Any = None,
+    ) -> "MemoryQuery":
+        if filter is None:
+            filter = FieldFilter(field_path, op_string, value)
+        query = self._copy()
+        query._filters.append(filter)
+        return query
+
+    def order_by(
+        self, field_path: str, direction: str = firestore.Query.ASCENDING
+    ) -> "MemoryQuery":
+        query = self._copy()
+        query._orders.append((_field_path(field_path), direction))
+        return query
+
+    def select(self, field_paths: Iterable[str]) -> "MemoryQuery":
+        query = self._copy()
+        query._projection = [_field_path(field) for field in field_paths]
+        return query
+
+    def limit(self, count: int) -> "MemoryQuery":
+        query = self._copy()
+        query._limit = count
+        query._limit_to_last = False
+        return query
+
+    def limit_to_last(self, count: int) -> "MemoryQuery":
+        query = self.limit(count)
+        query._limit_to_last = True
+        return query
+
+    def offset(self, num_to_skip: int) -> "MemoryQuery":
+        query = self._copy()
+        query._offset = num_to_skip
+        return query
+
+    def start_at(self, document_fields_or_snapshot: Any) -> "MemoryQuery":
+        return self._with_cursor("_start", document_fields_or_snapshot, True)
+
+    def start_after(self, document_fields_or_snapshot: Any) -> "MemoryQuery":
+        return self._with_cursor("_start", document_fields_or_snapshot, False)
+
+    def end_at(self, document_fields_or_snapshot: Any) -> "MemoryQuery":
+        return self._with_cursor("_end", document_fields_or_snapshot, True)
+
+    def end_before(self, document_fields_or_snapshot: Any) -> "MemoryQuery":
+        return self._with_cursor("_end", document_fields_or_snapshot, False)
+
+    def _with_cursor(self, name: str, cursor: Any, inclusive: bool) -> "MemoryQuery":
+        query = self._copy()
+        setattr(query, name, (cursor, inclusive))
+        return query
+
+    def stream(
+        self, transaction: Optional["MemoryTransaction"] = None
+    ) -> Iterator[MemoryDocumentSnapshot]:
+        yield from self._client._run_query(self, transaction)
+
+    def get(
+        self, transaction: Optional["MemoryTransaction"] = None
+    ) -> List[MemoryDocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+    # Evaluation, used by the client while holding its lock
+
+    def _contains(self, path: Path) -> bool:
+        if len(path) % 2 or path[-2] != self._collection_id:
+            return False
+        if self._all_descendants:
+            return path[: len(self._parent)] == self._parent
+        return path[:-2] == self._parent
+
+    def _matches(self, path: Path, data: Dict[str, Any]) -> bool:
+        return all(self._evaluate(condition, path, data) for condition in self._filters)
+
+    def _evaluate(self, condition: Any, path: Path, data: Dict[str, Any]) -> bool:
+        if isinstance(condition, BaseCompositeFilter):
+            results = (self._evaluate(child, path, data) for child in condition.filters)
+            if condition.operator == StructuredQuery.CompositeFilter.Operator.OR:
+                return any(results)
+            return all(results)
+        field = _field_path(condition.field_path)
+        if field == (DOCUMENT_ID,):
+            found, value = True, MemoryDocumentReference(self._client, path)
+        else:
+            found, value = _get_field(data, field)
+        op, expected = condition.op_string, condition.value
+        if isinstance(expected, str) and field == (DOCUMENT_ID,):
+            expected = MemoryDocumentReference(self._client, self._parent_of(expected))
+
+        if op == "not-in":
+            return found and value is not None and value not in expected
+        if not found:
+            return False
+        if op == "==":
+            return value == expected
+        if op == "!=":
+            return value is not None and value != expected
+        if op == "in":
+            return value in expected
+        if op == "array_contains":
+            return isinstance(value, list) and expected in value
+        if op == "array_contains_any":
+            return isinstance(value, list) and any(item in value for item in expected)
+
+        if _type_rank(value) != _type_rank(expected):
+            return False
+        value_key, expected_key = sort_key(value), sort_key(expected)
+        if op == "<":
+            return value_key < expected_key
+        if op == "<=":
+            return value_key <= expected_key
+        if op == ">":
+            return value_key > expected_key
+        if op == ">=":
+            return value_key >= expected_key
+        raise ValueError(f"Unsupported operator {op!r}")
+
+    def _parent_of(self, document_id: str) -> Path:
+        return self._parent + (self._collection_id, document_id)
+
+    def _effective_orders(self) -> List[Tuple[Path, str]]:
+        orders = list(self._orders)
+        if not orders:
+            # Inequality filters order by their field first, like Firestore
+            for condition in self._filters:
+                if isinstance(condition, FieldFilter) and condition.op_string in (
+                    "<",
+                    "<=",
+                    ">",
+                    ">=",
+                    "!=",
+                    "not-in",
+                ):
+                    orders.append(
+                        (_field_path(condition.field_path), firestore.Query.ASCENDING)
+                    )
+                    break
+        if not orders or orders[-1][0] != (DOCUMENT_ID,):
+            direction = orders[-1][1] if orders else firestore.Query.ASCENDING
+            orders.append(((DOCUMENT_ID,), direction))
+        return orders
+
+    def _order_values(
+        self, path: Path, data: Dict[str, Any], orders: List[Tuple[Path, str]]
+    ) -> Optional[List[Any]]:
+        values = []
+        for field, _direction in orders:
+            if field == (DOCUMENT_ID,):
+                values.append(MemoryDocumentReference(self._client, path))
+                continue
+            found, value = _get_field(data, field)
+            if not found:
+                return None
+            values.append(value)
+        return values
+
+    def _cursor_values(self, cursor: Any, orders: List[Tuple[Path, str]]) -> List[Any]:
+        if isinstance(cursor, MemoryDocumentSnapshot):
+            data = self._client._read_raw(cursor.reference._path) or {}
+            return self._order_values(cursor.reference._path, data, orders) or []
+        if isinstance(cursor, dict):
+            values = []
+            for field, _direction in orders:
+                found, value = _get_field(cursor, field)
+                if not found:
+                    break
+                values.append(value)
+        else:
+            values = list(cursor)
+        for position, (field, _direction) in enumerate(orders[: len(values)]):
+            if field == (DOCUMENT_ID,) and isinstance(values[position], str):
+                values[position] = MemoryDocumentReference(
+                    self._client, self._parent_of(values[position])
+                )
+        return values
+
+    @staticmethod
+    def _compare(
+        values: List[Any], cursor: List[Any], orders: List[Tuple[Path, str]]
+    ) -> int:
+        count = len(cursor)
+        for value, bound, (_field, direction) in zip(
+            values[:count], cursor, orders[:count], strict=True
+        ):
+            left, right = sort_key(value), sort_key(bound)
+            if left != right:
+                result = -1 if left < right else 1
+                return -result if direction == firestore.Query.DESCENDING else result
+        return 0
+
+    def _select(
+        self, documents: List[Tuple[Path, Dict[str, Any]]]
+    ) -> List[Tuple[Path, Dict[str, Any]]]:
+        orders = self._effective_orders()
+        rows = []
+        for path, data in documents:
+            if not self._contains(path) or not self._matches(path, data):
+                continue
+            values = self._order_values(path, data, orders)
+            if values is not None:
+                rows.append((values, path, data))
+
+        for position in reversed(range(len(orders))):
+            rows.sort(
+                key=lambda row, position=position: sort_key(row[0][position]),
+                reverse=orders[position][1] == firestore.Query.DESCENDING,
+            )
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            bound = self._cursor_values(cursor, orders)
+            rows = [
+                row
+                for row in rows
+                if self._compare(row[0], bound, orders) > (-1 if inclusive else 0)
+            ]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            bound = self._cursor_values(cursor, orders)
+            rows = [
+                row
+                for row in rows
+                if self._compare(row[0], bound, orders) < (1 if inclusive else 0)
+            ]
+
+        rows = rows[self._offset :]
+        if self._limit is not None:
+            rows = rows[-self._limit :] if self._limit_to_last else rows[: self._limit]
+        return [(path, self._project(data)) for _values, path, data in rows]
+
+    def _project(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if self._projection is None:
+            return data
+        projected: Dict[str, Any] = {}
+        for field in self._projection:
+            found, value = _get_field(data, field)
+            if not found:
+                continue
+            target = projected
+            for part in field[:-1]:
+                target = target.setdefault(part, {})
+            target[field[-1]] = value
+        return projected
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client: "MemoryFirestore", path: Path) -> None:
+        super().__init__(client, path[:-1], path[-1])
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self) -> Optional[MemoryDocumentReference]:
+        if len(self._path) == 1:
+            return None
+        return MemoryDocumentReference(self._client, self._path[:-1])
+
+    def document(self, document_id: Optional[str] = None) -> MemoryDocumentReference:
+        if document_id is None:
+            document_id = self._client._auto_id()
+        return MemoryDocumentReference(self._client, self._path + (document_id,))
+
+    def add(
+        self, document_data: Dict[str, Any], document_id: Optional[str] = None
+    ) -> Tuple[datetime, MemoryDocumentReference]:
+        doc_ref = self.document(document_id)
+        doc_ref.create(document_data)
+        return self._client._clock(), doc_ref
+
+    def list_documents(self) -> Iterator[MemoryDocumentReference]:
+        for path in self._client._document_paths(self._path):
+            yield MemoryDocumentReference(self._client, path)
+
+
+class MemoryWriteBatch:
+    """Writes applied atomically on commit, like a WriteBatch."""
+
+    def __init__(self, client: "MemoryFirestore") -> None:
+        self._client = client
+        self._writes: List[Tuple[str, MemoryDocumentReference, Any, bool]] = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def create(
+        self, reference: MemoryDocumentReference, document_data: Dict[str, Any]
+    ) -> None:
+        self._writes.append(("create", reference, document_data, False))
+
+    def set(
+        self,
+        reference: MemoryDocumentReference,
+        document_data: Dict[str, Any],
+        merge: bool = False,
+    ) -> None:
+        self._writes.append(("set", reference, document_data, merge))
+
+    def update(
+        self, reference: MemoryDocumentReference, field_updates: Dict[str, Any]
+    ) -> None:
+        self._writes.append(("update", reference, field_updates, False))
+
+    def delete(self, reference: MemoryDocumentReference) -> None:
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self) -> List[datetime]:
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+        return [self._client._clock()] * len(writes)
+
+
+class MemoryBulkWriter(MemoryWriteBatch):
+    """Writes applied one by one as they are flushed, like a BulkWriter.
+
+    A write that fails is passed to the `on_write_error` callback and retried
+    for as long as the callback returns True, then dropped.
+    """
+
+    def __init__(self, client: "MemoryFirestore") -> None:
+        super().__init__(client)
+        self._error_callback = BulkWriter._default_on_error
+
+    def on_write_error(
+        self, callback: Optional[Callable[[BulkWriteFailure, Any], bool]]
+    ) -> None:
+        self._error_callback = callback or BulkWriter._default_on_error
+
+    def flush(self) -> None:
+        writes, self._writes = self._writes, []
+        for write in writes:
+            attempts = 0
+            while True:
+                try:
+                    self._client._commit([write])
+                    break
+                except exceptions.GoogleAPICallError as e:
+                    attempts += 1
+                    failure = BulkWriteFailure(
+                        operation=_bulk_operation(write, attempts),
+                        code=e.grpc_status_code.value[0],
+                        message=e.message,
+                    )
+                    if not self._error_callback(failure, self):
+                        break
+
+    def close(self) -> None:
+        self.flush()
+
+
+def _bulk_operation(
+    write: Tuple[str, MemoryDocumentReference, Any, bool], attempts: int
+) -> BulkWriterOperation:
+    kind, reference, data, merge = write
+    if kind == "create":
+        return BulkWriterCreateOperation(reference, data, attempts)
+    if kind == "set":
+        return BulkWriterSetOperation(reference, data, merge, attempts)
+    if kind == "update":
+        return BulkWriterUpdateOperation(reference, data, None, attempts)
+    return BulkWriterDeleteOperation(reference, None, attempts)
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """A transaction usable with the real `firestore.transactional` decorator.
+
+    Reads record the version of every document they return; the commit aborts
+    (and the decorator retries) if any of them changed in the meantime.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        client: "MemoryFirestore",
+        max_attempts: int = MAX_TRANSACTION_ATTEMPTS,
+        read_only: bool = False,
+    ) -> None:
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id: Optional[bytes] = None
+        self._read_versions: Dict[Path, int] = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self) -> Optional[bytes]:
+        return self._id
+
+    def _begin(self, retry_id: Optional[bytes] = None) -> None:
+        if self.in_progress:
+            raise ValueError("The transaction has already begun.")
+        self._id = str(next(self._ids)).encode()
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _rollback(self) -> None:
+        self._clean_up()
+
+    def _commit(self) -> List[datetime]:
+        if not self.in_progress:
+            raise ValueError("The transaction has no transaction ID.")
+        try:
+            self._client._commit(self._writes, self._read_versions)
+        finally:
+            self._clean_up()
+        return []
+
+    def _record_read(self, path: Path, version: int) -> None:
+        if self._writes:
+            raise ValueError("Attempted read after write in a transaction.")
+        self._read_versions.setdefault(path, version)
+
+    def get(self, ref_or_query: Any) -> Iterator[MemoryDocumentSnapshot]:
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(
+        self, references: Iterable[MemoryDocumentReference]
+    ) -> Iterator[MemoryDocumentSnapshot]:
+        return self._client.get_all(references, transaction=self)
+
+
+class MemoryFirestore:
+    """In-memory Firestore client with operation counters."""
+
+    def __init__(
+        self, seed: int = 0, clock: Optional[Callable[[], datetime]] = None
+    ) -> None:
+        self._documents: Dict[Path, Dict[str, Any]] = {}
+        self._versions: Dict[Path, int] = {}
+        self._create_times: Dict[Path, datetime] = {}
+        self._update_times: Dict[Path, datetime] = {}
+        self._random = random.Random(seed)
+        self._clock = clock or utc_now
+        self._lock = threading.RLock()
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.operations: Dict[str, int] = defaultdict(int)
+
+    # Client API
+
+    def collection(self, *collection_path: str) -> MemoryCollectionReference:
+        return MemoryCollectionReference(self, self._split(collection_path))
+
+    def document(self, *document_path: str) -> MemoryDocumentReference:
+        return MemoryDocumentReference(self, self._split(document_path))
+
+    def collection_group(self, collection_id: str) -> MemoryQuery:
+        return MemoryQuery(self, (), collection_id, all_descendants=True)
+
+    def collections(self) -> Iterator[MemoryCollectionReference]:
+        for collection_id in self._subcollection_ids(()):
+            yield self.collection(collection_id)
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
+
+    def bulk_writer(self, **_options: Any) -> MemoryBulkWriter:
+        return MemoryBulkWriter(self)
+
+    def transaction(
+        self, max_attempts: int = MAX_TRANSACTION_ATTEMPTS, read_only: bool = False
+    ) -> MemoryTransaction:
+        return MemoryTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(
+        self,
+        references: Iterable[MemoryDocumentReference],
+        field_paths: Optional[Iterable[str]] = None,
+        transaction: Optional[MemoryTransaction] = None,
+    ) -> Iterator[MemoryDocumentSnapshot]:
+        yield from self._get_documents(list(references), field_paths, transaction)
+
+    def recursive_delete(
+        self, reference: Any, bulk_writer: Optional[MemoryBulkWriter] = None
+    ) -> int:
+        prefix = reference._path
+        with self._lock:
+            paths = [
+                path
+                for path in self._documents
+                if path[: len(prefix)] == prefix and path != prefix[:-1]
+            ]
+        writer = bulk_writer or self.bulk_writer()
+        for path in paths:
+            writer.delete(MemoryDocumentReference(self, path))
+        writer.flush()
+        return len(paths)
+
+    # Counters
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"reads": self.reads, "writes": self.writes, "deletes": self.deletes}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.reads = self.writes = self.deletes = 0
+            self.operations.clear()
+
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        """All documents by path, for assertions and snapshots of a load test."""
+        with self._lock:
+            return {
+                "/".join(path): copy.deepcopy(data)
+                for path, data in sorted(self._documents.items())
+            }
+
+    # Internals
+
+    @staticmethod
+    def _split(parts: Tuple[str, ...]) -> Path:
+        return tuple(
+            segment for part in parts for segment in part.split("/") if segment
+        )
+
+    def _auto_id(self) -> str:
+        with self._lock:
+            return "".join(self._random.choices(AUTO_ID_ALPHABET, k=AUTO_ID_LENGTH))
+
+    def _read_raw(self, path: Path) -> Optional[Dict[str, Any]]:
+        return self._documents.get(path)
+
+    def _document_paths(self, collection: Path) -> List[Path]:
+        with self._lock:
+            return sorted(
+                path
+                for path in self._documents
+                if len(path) == len(collection) + 1 and path[:-1] == collection
+            )
+
+    def _subcollection_ids(self, document: Path) -> List[str]:
+        with self._lock:
+            return sorted(
+                {
+                    path[len(document)]
+                    for path in self._documents
+                    if len(path) > len(document) + 1
+                    and path[: len(document)] == document
+                }
+            )
+
+    def _snapshot(
+        self,
+        path: Path,
+        data: Optional[Dict[str, Any]],
+        transaction: Optional[MemoryTransaction],
+    ) -> MemoryDocumentSnapshot:
+        if transaction is not None:
+            transaction._record_read(path, self._versions.get(path, 0))
+        return MemoryDocumentSnapshot(
+            MemoryDocumentReference(self, path),
+            copy.deepcopy(data),
+            self._create_times.get(path),
+            self._update_times.get(path),
+        )
+
+    def _get_documents(
+        self,
+        references: List[MemoryDocumentReference],
+        field_paths: Optional[Iterable[str]],
+        transaction: Optional[MemoryTransaction],
+    ) -> List[MemoryDocumentSnapshot]:
+        projection = None
+        if field_paths is not None:
+            projection = self.collection("_").select(field_paths)
+        with self._lock:
+            snapshots = []
+            for reference in references:
+                data = self._documents.get(reference._path)
+                if data is not None and projection is not None:
+                    data = projection._project(data)
+                snapshots.append(self._snapshot(reference._path, data, transaction))
+            self.reads += len(references)
+            self.operations["get"] += 1
+        return snapshots
+
+    def _run_query(
+        self, query: MemoryQuery, transaction: Optional[MemoryTransaction]
+    ) -> List[MemoryDocumentSnapshot]:
+        with self._lock:
+            results = query._select(self._query_source(query))
+            snapshots = [
+                self._snapshot(path, data, transaction) for path, data in results
+            ]
+            # Firestore bills a query that returns nothing as one read
+            self.reads += max(len(snapshots), 1)
+            self.operations["query"] += 1
+        return snapshots
+
+    def _query_source(self, query: MemoryQuery) -> List[Tuple[Path, Dict[str, Any]]]:
+        return list(self._documents.items())
+
+    def _commit(
+        self,
+        writes: List[Tuple[str, MemoryDocumentReference, Any, bool]],
+        read_versions: Optional[Dict[Path, int]] = None,
+    ) -> None:
+        with self._lock:
+            for path, version in (read_versions or {}).items():
+                if self._versions.get(path, 0) != version:
+                    raise exceptions.Aborted(
+                        f"Document {'/'.join(path)} changed during the transaction"
+                    )
+
+            now = self._clock()
+            staged: Dict[Path, Optional[Dict[str, Any]]] = {}
+            for method, reference, data, merge in writes:
+                path = reference._path
+                current = staged[path] if path in staged else self._documents.get(path)
+                staged[path] = self._apply(method, path, current, data, merge, now)
+
+            for path, data in staged.items():
+                self._versions[path] = self._versions.get(path, 0) + 1
+                if data is None:
+                    self._documents.pop(path, None)
+                    self._create_times.pop(path, None)
+                    self._update_times.pop(path, None)
+                    continue
+                if path not in self._documents:
+                    self._create_times[path] = now
+                self._documents[path] = data
+                self._update_times[path] = now
+
+            for method, reference, data, _merge in writes:
+                if method == "delete":
+                    self.deletes += 1
+                else:
+                    self.writes += 1
+                self._record_write(reference._path, method, data)
+            self.operations["commit"] += 1
+
+    def _record_write(self, path: Path, method: str, data: Any) -> None:
+        """Hook for subclasses that track more than the counts."""
+
+    def _apply(
+        self,
+        method: str,
+        path: Path,
+        current: Optional[Dict[str, Any]],
+        data: Any,
+        merge: bool,
+        now: datetime,
+    ) -> Optional[Dict[str, Any]]:
+        if method == "delete":
+            return None
+        if method == "create" and current is not None:
+            raise exceptions.AlreadyExists(f"Document already exists: {'/'.join(path)}")
+        if method == "update" and current is None:
+            raise exceptions.NotFound(f"No document to update: {'/'.join(path)}")
+
+        if method == "update":
+            document = copy.deepcopy(current)
+            for field, value in data.items():
+                self._set_field(document, _field_path(field), value, now)
+            return document
+
+        document = copy.deepcopy(current) if merge and current is not None else {}
+        self._merge(document, data, now, replace=not merge)
+        return document
+
+    def _merge(
+        self,
+        document: Dict[str, Any],
+        data: Dict[str, Any],
+        now: datetime,
+        replace: bool,
+    ) -> None:
+        for key, value in data.items():
+            if (
+                not replace
+                and isinstance(value, dict)
+                and isinstance(document.get(key), dict)
+            ):
+                self._merge(document[key], value, now, replace=False)
+            else:
+                self._set_field(document, (key,), value, now)
+
+    def _set_field(
+        self, document: Dict[str, Any], path: Path, value: Any, now: datetime
+    ) -> None:
+        target = document
+        for part in path[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        leaf = path[-1]
+
+        if value is firestore.DELETE_FIELD:
+            target.pop(leaf, None)
+        elif value is firestore.SERVER_TIMESTAMP:
+            target[leaf] = now
+        elif isinstance(value, Increment):
+            current = target.get(leaf)
+            base = current if isinstance(current, (int, float)) else 0
+            target[leaf] = base + value.value
+        elif isinstance(value, (Minimum, Maximum)):
+            current = target.get(leaf)
+            if not isinstance(current, (int, float)) or isinstance(current, bool):
+                target[leaf] = value.value
+            elif isinstance(value, Minimum):
+                target[leaf] = min(current, value.value)
+            else:
+                target[leaf] = max(current, value.value)
+        elif isinstance(value, ArrayUnion):
+            current = list(target.get(leaf) or [])
+            current.extend(item for item in value.values if item not in current)
+            target[leaf] = _normalize(current)
+        elif isinstance(value, ArrayRemove):
+            current = target.get(leaf) or []
+            target[leaf] = [item for item in current if item not in value.values]
+        elif isinstance(value, dict):
+            nested: Dict[str, Any] = {}
+            self._merge(nested, value, now, replace=True)
+            target[leaf] = nested
+        else:
+            target[leaf] = _normalize(copy.deepcopy(value))
@@ -0,0 +1,134 @@
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from firebase_admin import firestore
+from instrumentation import count_reads, count_writes
+
+MIGRATION_JOBS_COLLECTION = "migrationJobs"
+# Set to the job ID on every document a migration rewrites. Triggers skip the
+# writes that change it: the job updates the stats itself once it is done.
+MIGRATION_JOB_FIELD = "migrationJobId"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def written_by_migration(
+    data_before: Optional[Dict[str, Any]], data_after: Optional[Dict[str, Any]]
+) -> bool:
+    """Whether a document write is a migration job's rewrite."""
+    job_id = (data_after or {}).get(MIGRATION_JOB_FIELD)
+    return job_id is not None and job_id != (data_before or {}).get(MIGRATION_JOB_FIELD)
+
+
+def create_migration_job(
+    db: firestore.Client,
+    group_id: str,
+    requested_by: str,
+    migrations: Dict[str, Tuple[str, str, str]],
+) -> str:
+    """Queue a migration of guest_id -> (guest name, member id, member name).
+
+    Returns the job ID; the job doc carries its status and progress.
+    """
+    job_ref = db.collection(MIGRATION_JOBS_COLLECTION).document()
+    job_ref.set(
+        {
+            "groupId": group_id,
+            "requestedBy": requested_by,
+            "migrations": {
+                guest_id: {
+                    "guestName": guest_name,
+                    "memberId": member_id,
+                    "memberName": member_name,
+                }
+                for guest_id, (guest_name, member_id, member_name) in migrations.items()
+            },
+            "status": JOB_QUEUED,
+            "matchesUpdated": 0,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    count_writes()
+    return job_ref.id
+
+
+def get_job_migrations(job_data: Dict[str, Any]) -> Dict[str, Tuple[str, str, str]]:
+    return {
+        guest_id: (
+            migration.get("guestName", ""),
+            migration["memberId"],
+            migration.get("memberName", ""),
+        )
+        for guest_id, migration in job_data.get("migrations", {}).items()
+    }
+
+
+def claim_migration_job(db: firestore.Client, job_id: str) -> Optional[Dict[str, Any]]:
+    """Mark a queued job as running; returns None if it was already started."""
+    job_ref = db.collection(MIGRATION_JOBS_COLLECTION).document(job_id)
+    return _claim_job(db.transaction(), job_ref)
+
+
+@firestore.transactional
+def _claim_job(
+    transaction: firestore.Transaction, job_ref: firestore.DocumentReference
+) -> Optional[Dict[str, Any]]:
+    job_doc = job_ref.get(transaction=transaction)
+    count_reads()
+    if not job_doc.exists:
+        return None
+
+    job_data = job_doc.to_dict()
+    if job_data.get("status") != JOB_QUEUED:
+        return None
+
+    transaction.update(
+        job_ref, {"status": JOB_RUNNING, "updatedAt": firestore.SERVER_TIMESTAMP}
+    )
+    count_writes()
+    return job_data
+
+
+def save_migration_progress(
+    db: firestore.Client, job_id: str, matches_updated: int
+) -> None:
+    db.collection(MIGRATION_JOBS_COLLECTION).document(job_id).update(
+        {"matchesUpdated": matches_updated, "updatedAt": firestore.SERVER_TIMESTAMP}
+    )
+    count_writes()
+
+
+def finish_migration_job(
+    db: firestore.Client, job_id: str, matches_updated: int, stats_relabelled: bool
+) -> None:
+    db.collection(MIGRATION_JOBS_COLLECTION).document(job_id).update(
+        {
+            "status": JOB_DONE,
+            "matchesUpdated": matches_updated,
+            "statsRelabelled": stats_relabelled,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+            "finishedAt": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    count_writes()
+
+
+def fail_migration_job(db: firestore.Client, job_id: str, error: str) -> None:
+    """Record a failed job. Migrations are safe to repeat, so the admin can
+    simply start it again."""
+    try:
+        db.collection(MIGRATION_JOBS_COLLECTION).document(job_id).update(
+            {
+                "status": JOB_FAILED,
+                "error": error,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+                "finishedAt": firestore.SERVER_TIMESTAMP,
+            }
+        )
+        count_writes()
+    except Exception as e:
+        logging.error(f"Error recording failure of migration job {job_id}: {e}")
@@ -0,0 +1,180 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class PartnerRecord:
+    __slots__ = ("display_name", "matches", "wins", "win_rate")
+
+    def __init__(
+        self,
+        display_name: str,
+        matches: int = 0,
+        wins: int = 0,
+        win_rate: float = 0.0,
+    ) -> None:
+        self.display_name = display_name
+        self.matches = matches
+        self.wins = wins
+        self.win_rate = win_rate
+
+
+class PlayerRecord:
+    """One player's counters during a replay.
+
+    Attribute access on a slotted record replaces the repeated string-keyed
+    lookups of the stats dict; partners are keyed by interned player index.
+    """
+
+    __slots__ = (
+        "display_name",
+        "is_guest",
+        "total_matches",
+        "wins",
+        "draws",
+        "losses",
+        "win_rate",
+        "rating",
+        "streak",
+        "current_streak",
+        "longest_win_streak",
+        "longest_loss_streak",
+        "team_partners",
+        "last_played",
+        "goals_scored",
+        "goals_conceded",
+        "average_goals_scored",
+        "average_goals_conceded",
+    )
+
+    def __init__(self, display_name: str, is_guest: bool) -> None:
+        self.display_name = display_name
+        self.is_guest = is_guest
+        self.total_matches = 0
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.win_rate = 0.0
+        self.rating = 1000
+        self.streak = 0
+        self.current_streak = 0
+        self.longest_win_streak = 0
+        self.longest_loss_streak = 0
+        self.team_partners: Dict[int, PartnerRecord] = {}
+        self.last_played = None
+        self.goals_scored = 0
+        self.goals_conceded = 0
+        self.average_goals_scored = 0.0
+        self.average_goals_conceded = 0.0
+
+
+class PlayerTable:
+    """Player records addressed by interned integer index.
+
+    Teammates that are not members or guests of the group still get an index
+    so that partnerships with them can be recorded, but have no record.
+    """
+
+    __slots__ = ("ids", "index", "records")
+
+    def __init__(self) -> None:
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.records: List[Optional[PlayerRecord]] = []
+
+    def intern(self, player_id: str) -> int:
+        player_index = self.index.get(player_id)
+        if player_index is None:
+            player_index = len(self.ids)
+            self.index[player_id] = player_index
+            self.ids.append(player_id)
+            self.records.append(None)
+        return player_index
+
+    def add(self, player_id: str, record: PlayerRecord) -> None:
+        self.records[self.intern(player_id)] = record
+
+    def get(self, player_id: str) -> Optional[PlayerRecord]:
+        player_index = self.index.get(player_id)
+        if player_index is None:
+            return None
+        return self.records[player_index]
+
+    def __contains__(self, player_id: str) -> bool:
+        return self.get(player_id) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for player_id, _record in self.items():
+            yield player_id
+
+    def items(self) -> Iterator[Tuple[str, PlayerRecord]]:
+        for player_id, record in zip(self.ids, self.records, strict=True):
+            if record is not None:
+                yield player_id, record
+
+    @classmethod
+    def from_dicts(cls, player_stats: Dict[str, Dict[str, Any]]) -> "PlayerTable":
+        table = cls()
+        for player_id, stats in player_stats.items():
+            record = PlayerRecord(stats["displayName"], stats["isGuest"])
+            record.total_matches = stats["totalMatches"]
+            record.wins = stats["wins"]
+            record.draws = stats["draws"]
+            record.losses = stats["losses"]
+            record.win_rate = stats["winRate"]
+            record.rating = stats["rating"]
+            record.streak = stats["streak"]
+            record.current_streak = stats["currentStreak"]
+            record.longest_win_streak = stats["longestWinStreak"]
+            record.longest_loss_streak = stats["longestLossStreak"]
+            record.last_played = stats["lastPlayed"]
+            record.goals_scored = stats["goalsScored"]
+            record.goals_conceded = stats["goalsConceded"]
+            record.average_goals_scored = stats["averageGoalsScored"]
+            record.average_goals_conceded = stats["averageGoalsConceded"]
+            table.add(player_id, record)
+
+        for player_id, stats in player_stats.items():
+            record = table.get(player_id)
+            for partner_id, partner in stats.get("teamPartners", {}).items():
+                record.team_partners[table.intern(partner_id)] = PartnerRecord(
+                    partner["displayName"],
+                    partner["matches"],
+                    partner["wins"],
+                    partner["winRate"],
+                )
+
+        return table
+
+    def to_dicts(self) -> Dict[str, Dict[str, Any]]:
+        """Serialize to the groupStats playerStats schema."""
+        ids = self.ids
+        return {
+            player_id: {
+                "displayName": record.display_name,
+                "isGuest": record.is_guest,
+                "totalMatches": record.total_matches,
+                "wins": record.wins,
+                "draws": record.draws,
+                "losses": record.losses,
+                "winRate": record.win_rate,
+                "rating": record.rating,
+                "streak": record.streak,
+                "currentStreak": record.current_streak,
+                "longestWinStreak": record.longest_win_streak,
+                "longestLossStreak": record.longest_loss_streak,
+                "teamPartners": {
+                    ids[partner_index]: {
+                        "displayName": partner.display_name,
+                        "matches": partner.matches,
+                        "wins": partner.wins,
+                        "winRate": partner.win_rate,
+                    }
+                    for partner_index, partner in record.team_partners.items()
+                },
+                "lastPlayed": record.last_played,
+                "goalsScored": record.goals_scored,
+                "goalsConceded": record.goals_conceded,
+                "averageGoalsScored": record.average_goals_scored,
+                "averageGoalsConceded": record.average_goals_conceded,
+            }
+            for player_id, record in self.items()
+        }
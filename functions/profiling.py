@@ -0,0 +1,247 @@
+"""Opt-in cProfile and tracemalloc capture around deployed functions.
+
+Nothing is profiled unless PROFILE_FUNCTIONS names the function (or is "*");
+for any other function `profiled` returns the function itself, so profiling
+costs nothing when it is off. An enabled function profiles its next
+PROFILE_INVOCATIONS invocations on each instance, one at a time, optionally
+only those for the groups in PROFILE_GROUPS, e.g.
+
+    PROFILE_FUNCTIONS=on_match_update PROFILE_GROUPS=abc123 PROFILE_INVOCATIONS=5
+
+Each profiled invocation writes a `.prof` file (loadable with pstats) and a
+`.txt` report with the invocation record, the top functions by cumulative
+time and the top allocation sites, to PROFILE_SINK: a local directory, or
+`gs://bucket/prefix` for Cloud Storage.
+
+The group of an invocation is taken from its request before the profiler
+starts, so with PROFILE_GROUPS set, functions whose request does not name a
+group (joins, scheduled functions) are not profiled.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import logging
+import marshal
+import os
+import posixpath
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from cloudevents.http import CloudEvent
+from flask import Request
+from google.events.cloud.firestore import DocumentEventData
+from instrumentation import last_invocation_record
+
+T = TypeVar("T")
+
+
+def _parse_list(value: str) -> frozenset:
+    return frozenset(item.strip() for item in value.split(",") if item.strip())
+
+
+PROFILE_FUNCTIONS = _parse_list(os.environ.get("PROFILE_FUNCTIONS", ""))
+PROFILE_GROUPS = _parse_list(os.environ.get("PROFILE_GROUPS", ""))
+PROFILE_INVOCATIONS = int(os.environ.get("PROFILE_INVOCATIONS", "10"))
+PROFILE_SINK = os.environ.get(
+    "PROFILE_SINK", os.path.join(tempfile.gettempdir(), "profiles")
+)
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "25"))
+
+_lock = threading.Lock()
+_profiles_taken: Dict[str, int] = {}
+# One profiled invocation at a time per instance: Python 3.12 allows only one
+# active cProfile profiler, and tracemalloc is process wide.
+_active = threading.Lock()
+
+
+def is_profiling_enabled(name: str) -> bool:
+    return "*" in PROFILE_FUNCTIONS or name in PROFILE_FUNCTIONS
+
+
+def _take_budget(name: str) -> Optional[int]:
+    """Claim one of the function's profiles; returns its sequence number."""
+    with _lock:
+        taken = _profiles_taken.get(name, 0)
+        if taken >= PROFILE_INVOCATIONS:
+            return None
+        _profiles_taken[name] = taken + 1
+        return taken + 1
+
+
+def _return_budget(name: str) -> None:
+    with _lock:
+        _profiles_taken[name] -= 1
+
+
+def reset_profiles_taken() -> None:
+    with _lock:
+        _profiles_taken.clear()
+
+
+def get_request_group_id(args: Tuple[Any, ...]) -> Optional[str]:
+    """The group a deployed function's request is for, if it says.
+
+    `profiled` wraps the deployed functions, which get the raw CloudEvent or
+    HTTP request. Group triggers carry the group in their document path,
+    match triggers in the match, and callables in their data; joins and
+    scheduled functions do not know it.
+    """
+    if not args:
+        return None
+    request = args[0]
+    if isinstance(request, CloudEvent):
+        return _get_event_group_id(request)
+    if isinstance(request, Request):
+        body = request.get_json(silent=True)
+        data = body.get("data") if isinstance(body, dict) else None
+        group_id = data.get("groupId") if isinstance(data, dict) else None
+        return group_id if isinstance(group_id, str) else None
+    return None
+
+
+def _get_event_group_id(event: CloudEvent) -> Optional[str]:
+    document = event.get("document") or ""
+    if not document:
+        subject = event.get("subject") or ""
+        document = subject.removeprefix("documents/")
+    collection, _, document_id = document.partition("/")
+    if collection == "groups":
+        return document_id or None
+    if collection != "matches":
+        return None
+
+    try:
+        data = event.get_data()
+        if isinstance(data, bytes):
+            event_data = DocumentEventData.deserialize(data)
+        else:
+            event_data = DocumentEventData.from_json(json.dumps(data))
+    except Exception:
+        return None
+    for match in (event_data.value, event_data.old_value):
+        if match and "groupId" in match.fields:
+            return match.fields["groupId"].string_value or None
+    return None
+
+
+def profiled(func: Callable[..., T]) -> Callable[..., T]:
+    """Profile invocations of a deployed function when configured to."""
+    name = func.__name__
+    if not is_profiling_enabled(name):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        group_id = None
+        if PROFILE_GROUPS:
+            group_id = get_request_group_id(args)
+            if group_id not in PROFILE_GROUPS:
+                return func(*args, **kwargs)
+        if not _active.acquire(blocking=False):
+            return func(*args, **kwargs)
+
+        try:
+            sequence = _take_budget(name)
+            if sequence is None:
+                return func(*args, **kwargs)
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # Something else, such as a debugger, is already profiling
+                logging.warning(f"Not profiling {name}: {str(e)}")
+                _return_budget(name)
+                return func(*args, **kwargs)
+
+            record_before = last_invocation_record()
+            started_tracing = not tracemalloc.is_tracing()
+            try:
+                if started_tracing:
+                    tracemalloc.start()
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                if tracemalloc.is_tracing():
+                    snapshot = tracemalloc.take_snapshot()
+                    _current, peak = tracemalloc.get_traced_memory()
+                    if started_tracing:
+                        tracemalloc.stop()
+
+                    record = last_invocation_record()
+                    if record is record_before:
+                        record = None
+                    _save_profile(
+                        name, sequence, group_id, profiler, snapshot, peak, record
+                    )
+        finally:
+            _active.release()
+
+    return wrapper
+
+
+def _save_profile(
+    name: str,
+    sequence: int,
+    group_id: Optional[str],
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    peak_memory: int,
+    record: Optional[Dict[str, Any]],
+) -> None:
+    group_id = group_id or (record or {}).get("groupId")
+    try:
+        profiler.create_stats()
+        timestamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        base = posixpath.join(
+            name, f"{timestamp}-{group_id or 'all'}-{os.getpid()}-{sequence}"
+        )
+        write_to_sink(f"{base}.prof", marshal.dumps(profiler.stats))
+        report = format_report(name, profiler, snapshot, peak_memory, record)
+        write_to_sink(f"{base}.txt", report.encode("utf-8"))
+        logging.info(f"Saved profile {base} for {name} to {PROFILE_SINK}")
+    except Exception as e:
+        logging.error(f"Error saving profile for {name}: {str(e)}")
+
+
+def format_report(
+    name: str,
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    peak_memory: int,
+    record: Optional[Dict[str, Any]],
+) -> str:
+    output = io.StringIO()
+    output.write(f"Profile of {name}\n")
+    if record is not None:
+        output.write(f"Invocation: {json.dumps(record, default=str)}\n")
+    output.write(f"Peak traced memory: {peak_memory} bytes\n\n")
+
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+
+    output.write(f"Top {PROFILE_TOP_N} allocation sites:\n")
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    for statistic in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+        output.write(f"{statistic}\n")
+    return output.getvalue()
+
+
+def write_to_sink(path: str, data: bytes) -> None:
+    if PROFILE_SINK.startswith("gs://"):
+        from firebase_admin import storage
+
+        bucket_name, _, prefix = PROFILE_SINK[len("gs://") :].partition("/")
+        blob = storage.bucket(bucket_name).blob(posixpath.join(prefix, path))
+        blob.upload_from_string(data)
+        return
+
+    full_path = os.path.join(PROFILE_SINK, *path.split("/"))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "wb") as output:
+        output.write(data)
@@ -0,0 +1,157 @@
+"""Token-bucket rate limits per user and action.
+
+A limit is a bucket of `capacity` requests that regains one request every
+`period_seconds`. It is stored as a single timestamp on the user's rate
+limit doc, `<action>Tat`: the GCRA "theoretical arrival time", when the
+bucket would be full again. A request is allowed while that time is less
+than `capacity` periods ahead, and moves it one period further. The check
+and the update are one transaction with one read and one write, which also
+carries any other fields the caller records.
+
+Instances remember the timestamps they read and wrote. A timestamp only
+moves forward, so when a remembered one already rules a request out, the
+request is rejected without a Firestore read. Requests that record
+something even when denied always go to Firestore.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from firebase_admin import firestore
+from instrumentation import annotate, count_reads, count_writes
+
+# Users whose timestamps an instance remembers
+LOCAL_BUCKETS_MAX_ENTRIES = 10000
+
+
+class RateLimit(NamedTuple):
+    action: str
+    collection: str
+    capacity: int
+    period_seconds: float
+    # An optional cap on a counter of the doc, such as the groups a user owns
+    count_field: Optional[str] = None
+    max_count: Optional[int] = None
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, limit: RateLimit, retry_after_seconds: float) -> None:
+        self.limit = limit
+        self.retry_after_seconds = retry_after_seconds
+        super().__init__(
+            f"Too many {limit.action} requests, try again in "
+            f"{max(1, round(retry_after_seconds))} seconds"
+        )
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, limit: RateLimit) -> None:
+        self.limit = limit
+        super().__init__(f"Limit of {limit.max_count} {limit.count_field} reached")
+
+
+_local_lock = threading.Lock()
+_local_tats: "OrderedDict[Tuple[str, str], datetime]" = OrderedDict()
+
+
+def _remember(key: Tuple[str, str], tat: datetime) -> None:
+    with _local_lock:
+        if key not in _local_tats or _local_tats[key] < tat:
+            _local_tats[key] = tat
+        _local_tats.move_to_end(key)
+        while len(_local_tats) > LOCAL_BUCKETS_MAX_ENTRIES:
+            _local_tats.popitem(last=False)
+
+
+def _remembered(key: Tuple[str, str]) -> Optional[datetime]:
+    with _local_lock:
+        return _local_tats.get(key)
+
+
+def reset_local_buckets() -> None:
+    with _local_lock:
+        _local_tats.clear()
+
+
+def tat_field(limit: RateLimit) -> str:
+    return f"{limit.action}Tat"
+
+
+def get_retry_after(
+    limit: RateLimit, tat: Optional[datetime], now: datetime
+) -> Optional[float]:
+    """Seconds until the bucket allows a request, or None if it does now."""
+    if tat is None:
+        return None
+    burst = timedelta(seconds=limit.period_seconds * (limit.capacity - 1))
+    wait = (tat - burst - now).total_seconds()
+    return wait if wait > 0 else None
+
+
+def acquire(
+    db: firestore.Client,
+    limit: RateLimit,
+    uid: str,
+    now: Optional[datetime] = None,
+    updates: Optional[Dict[str, Any]] = None,
+    denied_updates: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Take a request from the user's bucket, or raise RateLimitExceeded.
+
+    `updates` are written along with the bucket when the request is allowed,
+    `denied_updates` when it is not. Raises QuotaExceeded once the limit's
+    counter reached `max_count`; the counter itself is up to the caller.
+    """
+    now = now or datetime.now(timezone.utc)
+    key = (limit.action, uid)
+    retry_after = get_retry_after(limit, _remembered(key), now)
+    if retry_after is not None and not denied_updates:
+        annotate(rateLimited=limit.action, rateLimitCheck="local")
+        raise RateLimitExceeded(limit, retry_after)
+
+    doc_ref = db.collection(limit.collection).document(uid)
+    tat, error = _acquire_in_transaction(
+        db.transaction(), doc_ref, limit, now, updates or {}, denied_updates or {}
+    )
+    _remember(key, tat)
+    if error is not None:
+        annotate(rateLimited=limit.action, rateLimitCheck="firestore")
+        raise error
+
+
+@firestore.transactional
+def _acquire_in_transaction(
+    transaction: firestore.Transaction,
+    doc_ref: firestore.DocumentReference,
+    limit: RateLimit,
+    now: datetime,
+    updates: Dict[str, Any],
+    denied_updates: Dict[str, Any],
+) -> Tuple[datetime, Optional[Exception]]:
+    doc = doc_ref.get(transaction=transaction)
+    count_reads()
+    data = doc.to_dict() if doc.exists else {}
+    tat = data.get(tat_field(limit))
+
+    error: Optional[Exception] = None
+    retry_after = get_retry_after(limit, tat, now)
+    if retry_after is not None:
+        error = RateLimitExceeded(limit, retry_after)
+    elif (
+        limit.count_field is not None
+        and data.get(limit.count_field, 0) >= limit.max_count
+    ):
+        error = QuotaExceeded(limit)
+
+    if error is None:
+        tat = max(tat or now, now) + timedelta(seconds=limit.period_seconds)
+        writes = {**updates, tat_field(limit): tat}
+    else:
+        writes = denied_updates
+
+    if writes:
+        transaction.set(doc_ref, writes, merge=True)
+        count_writes()
+    return tat, error
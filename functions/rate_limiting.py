@@ -1,18 +1,72 @@
 import logging
+from datetime import datetime
+from typing import Any, Optional
 
+from data_access import get_db
 from firebase_admin import firestore
 from firebase_functions import firestore_fn
+from instrumentation import (
+    annotate,
+    count_deletes,
+    count_reads,
+    count_writes,
+    instrumented,
+    phase,
+)
+from rate_limiter import QuotaExceeded, RateLimit, RateLimitExceeded, acquire
 
 GROUP_LIMIT = 20  # Maximum per user
 GROUP_COOLDOWN_SECONDS = 60
 MATCH_COOLDOWN_SECONDS = 10
+# A second match right after the first one, e.g. to correct a mistyped score
+MATCH_BURST = 2
+JOIN_COOLDOWN_SECONDS = 12
+JOIN_BURST = 5
+MIGRATION_COOLDOWN_SECONDS = 12
+MIGRATION_BURST = 5
+
+GROUP_CREATE_LIMIT = RateLimit(
+    "groupCreate",
+    "ratelimits",
+    capacity=1,
+    period_seconds=GROUP_COOLDOWN_SECONDS,
+    count_field="groupCount",
+    max_count=GROUP_LIMIT,
+)
+MATCH_CREATE_LIMIT = RateLimit(
+    "matchCreate",
+    "matchRatelimits",
+    capacity=MATCH_BURST,
+    period_seconds=MATCH_COOLDOWN_SECONDS,
+)
+JOIN_GROUP_LIMIT = RateLimit(
+    "joinGroup",
+    "ratelimits",
+    capacity=JOIN_BURST,
+    period_seconds=JOIN_COOLDOWN_SECONDS,
+)
+MIGRATION_LIMIT = RateLimit(
+    "migrateGuests",
+    "ratelimits",
+    capacity=MIGRATION_BURST,
+    period_seconds=MIGRATION_COOLDOWN_SECONDS,
+)
+
+
+def get_create_time(snapshot: Any) -> Optional[datetime]:
+    """When the document of a create event was written, so a trigger that
+    runs late still counts the request at the time it was made."""
+    create_time = getattr(snapshot, "create_time", None)
+    return create_time if isinstance(create_time, datetime) else None
 
 
 @firestore_fn.on_document_created(document="groups/{groupId}")
+@instrumented("on_group_created")
 def on_group_created(event: firestore_fn.Event) -> None:
-    """Manages rate limiting when a group document is created.
+    """Enforces the group limits when a group document is created.
 
-    Creates or updates the rate limit document for the user who created the group.
+    Counts the group for its admin, and deletes it again if the admin is over
+    GROUP_LIMIT or created another group less than GROUP_COOLDOWN_SECONDS ago.
     """
     try:
         group_data = event.data.to_dict()
@@ -21,23 +75,30 @@ def on_group_created(event: firestore_fn.Event) -> None:
             return
 
         admin_uid = group_data["adminUid"]
-
-        db = firestore.client()
-        ratelimit_ref = db.collection("ratelimits").document(admin_uid)
-
-        ratelimit_doc = ratelimit_ref.get()
-
-        if ratelimit_doc.exists:
-            db.collection("ratelimits").document(admin_uid).update(
-                {
-                    "groupCount": firestore.Increment(1),
-                    "lastGroupCreation": firestore.SERVER_TIMESTAMP,
-                }
-            )
-        else:
-            db.collection("ratelimits").document(admin_uid).set(
-                {"groupCount": 1, "lastGroupCreation": firestore.SERVER_TIMESTAMP}
-            )
+        group_id = event.params["groupId"]
+        annotate(uid=admin_uid, groupId=group_id)
+
+        db = get_db()
+        try:
+            with phase("write"):
+                # The group is counted either way; deleting it uncounts it
+                acquire(
+                    db,
+                    GROUP_CREATE_LIMIT,
+                    admin_uid,
+                    now=get_create_time(event.data),
+                    updates={
+                        "groupCount": firestore.Increment(1),
+                        "lastGroupCreation": firestore.SERVER_TIMESTAMP,
+                    },
+                    denied_updates={"groupCount": firestore.Increment(1)},
+                )
+        except (RateLimitExceeded, QuotaExceeded) as e:
+            logging.warning(f"Deleting group {group_id} of user {admin_uid}: {e}")
+            with phase("write"):
+                db.collection("groups").document(group_id).delete()
+                count_deletes()
+            return
 
         logging.info(f"Updated group rate limit for user {admin_uid}")
     except Exception as e:
@@ -45,6 +106,7 @@ def on_group_created(event: firestore_fn.Event) -> None:
 
 
 @firestore_fn.on_document_deleted(document="groups/{groupId}")
+@instrumented("on_group_deleted")
 def on_group_deleted(event: firestore_fn.Event) -> None:
     """Decrements the group count when a group is deleted."""
     try:
@@ -54,28 +116,40 @@ def on_group_deleted(event: firestore_fn.Event) -> None:
             return
 
         admin_uid = group_data["adminUid"]
+        annotate(uid=admin_uid)
 
-        db = firestore.client()
+        db = get_db()
         ratelimit_ref = db.collection("ratelimits").document(admin_uid)
-
-        ratelimit_doc = ratelimit_ref.get()
-
-        if ratelimit_doc.exists:
-            current_count = ratelimit_doc.to_dict().get("groupCount", 0)
-            new_count = max(0, current_count - 1)
-
-            db.collection("ratelimits").document(admin_uid).update(
-                {"groupCount": new_count}
-            )
+        with phase("write"):
+            _decrement_group_count(db.transaction(), ratelimit_ref)
 
         logging.info(f"Decremented group count for user {admin_uid}")
     except Exception as e:
         logging.error(f"Error decrementing group count: {e}")
 
 
+@firestore.transactional
+def _decrement_group_count(
+    transaction: firestore.Transaction, ratelimit_ref: firestore.DocumentReference
+) -> None:
+    ratelimit_doc = ratelimit_ref.get(transaction=transaction)
+    count_reads()
+    if not ratelimit_doc.exists:
+        return
+
+    current_count = ratelimit_doc.to_dict().get("groupCount", 0)
+    transaction.update(ratelimit_ref, {"groupCount": max(0, current_count - 1)})
+    count_writes()
+
+
 @firestore_fn.on_document_created(document="matches/{matchId}")
+@instrumented("on_match_created")
 def on_match_created(event: firestore_fn.Event) -> None:
-    """Manages rate limiting when a match document is created."""
+    """Enforces the match cooldown when a match document is created.
+
+    Deletes the match if its creator used up MATCH_BURST matches within
+    MATCH_COOLDOWN_SECONDS each.
+    """
     try:
         match_data = event.data.to_dict()
         if not match_data or "createdBy" not in match_data:
@@ -83,20 +157,25 @@ def on_match_created(event: firestore_fn.Event) -> None:
             return
 
         user_uid = match_data["createdBy"]
-
-        db = firestore.client()
-        ratelimit_ref = db.collection("matchRatelimits").document(user_uid)
-
-        ratelimit_doc = ratelimit_ref.get()
-
-        if ratelimit_doc.exists:
-            db.collection("matchRatelimits").document(user_uid).update(
-                {"lastMatchCreation": firestore.SERVER_TIMESTAMP}
-            )
-        else:
-            db.collection("matchRatelimits").document(user_uid).set(
-                {"lastMatchCreation": firestore.SERVER_TIMESTAMP}
-            )
+        match_id = event.params["matchId"]
+        annotate(uid=user_uid, matchId=match_id)
+
+        db = get_db()
+        try:
+            with phase("write"):
+                acquire(
+                    db,
+                    MATCH_CREATE_LIMIT,
+                    user_uid,
+                    now=get_create_time(event.data),
+                    updates={"lastMatchCreation": firestore.SERVER_TIMESTAMP},
+                )
+        except RateLimitExceeded as e:
+            logging.warning(f"Deleting match {match_id} of user {user_uid}: {e}")
+            with phase("write"):
+                db.collection("matches").document(match_id).delete()
+                count_deletes()
+            return
 
         logging.info(f"Updated match rate limit for user {user_uid}")
     except Exception as e:
@@ -0,0 +1,465 @@
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from match_utils import (
+    create_player_stats_object,
+    create_team_color_stats_object,
+    extract_players_from_team,
+    get_date_string_from_timestamp,
+    get_match_sort_key,
+)
+from player_records import PlayerTable
+
+# Worker processes used for full replays; 0 or 1 keeps the sequential fold.
+STATS_PARALLEL_WORKERS = int(os.environ.get("STATS_PARALLEL_WORKERS", "0"))
+STATS_PARALLEL_CHUNK_SIZE = int(os.environ.get("STATS_PARALLEL_CHUNK_SIZE", "5000"))
+
+# Additive counters shared by player and team color stats.
+COUNTERS = (
+    "totalMatches",
+    "wins",
+    "draws",
+    "losses",
+    "goalsScored",
+    "goalsConceded",
+)
+RESULT_COUNTERS = {"win": "wins", "draw": "draws", "loss": "losses"}
+# Position of results already folded into a state, before any match in a chunk.
+STATE_POSITION = (float("-inf"), float("-inf"), "")
+
+Runs = Iterable[Tuple[Any, List[Tuple[str, Dict[str, Any]]]]]
+
+# A partial aggregate summarises a time-ordered chunk of matches so that
+# merge_partials(a, b) equals folding a's matches and then b's one by one.
+# Streaks are kept as run information per player: the kind and length of the
+# first run (prefix) and the last run (suffix), plus the longest win run and
+# the position (sort key, slot) where it first reached that length, which is
+# what decides the group-wide longestWinStreak holder.
+
+
+def create_partial() -> Dict[str, Any]:
+    return {
+        "totalMatches": 0,
+        "matchesByGameType": {},
+        "team_color_stats": {},
+        "matches_per_day": {},
+        "watermark": None,
+        "players": {},
+    }
+
+
+def create_player_partial() -> Dict[str, Any]:
+    return {
+        **{counter: 0 for counter in COUNTERS},
+        "lastPlayed": None,
+        "teamPartners": {},
+        "n": 0,
+        "prefix_kind": None,
+        "prefix_len": 0,
+        "prefix_end": None,
+        "suffix_kind": None,
+        "suffix_len": 0,
+        "max_win": 0,
+        "max_win_end": None,
+        "max_loss": 0,
+    }
+
+
+def add_result(player: Dict[str, Any], result: str, position: Tuple) -> None:
+    """Append one win/loss/draw to a player's run information."""
+    single = create_player_partial()
+    single.update(
+        n=1,
+        prefix_kind=result,
+        prefix_len=1,
+        prefix_end=position,
+        suffix_kind=result,
+        suffix_len=1,
+        max_win=1 if result == "win" else 0,
+        max_win_end=position if result == "win" else None,
+        max_loss=1 if result == "loss" else 0,
+    )
+    merge_runs(player, single)
+
+
+def merge_runs(left: Dict[str, Any], right: Dict[str, Any]) -> None:
+    """Merge the run information of `right` (later) into `left` in place."""
+    if right["n"] == 0:
+        return
+    if left["n"] == 0:
+        for key in (
+            "n",
+            "prefix_kind",
+            "prefix_len",
+            "prefix_end",
+            "suffix_kind",
+            "suffix_len",
+            "max_win",
+            "max_win_end",
+            "max_loss",
+        ):
+            left[key] = right[key]
+        return
+
+    joined = left["suffix_kind"] == right["prefix_kind"]
+    joined_len = left["suffix_len"] + right["prefix_len"]
+
+    max_win, max_win_end = left["max_win"], left["max_win_end"]
+    candidates = [(right["max_win"], right["max_win_end"])]
+    if joined and right["prefix_kind"] == "win":
+        candidates.append((joined_len, right["prefix_end"]))
+    for length, end in candidates:
+        if length > max_win or (length == max_win and length and end < max_win_end):
+            max_win, max_win_end = length, end
+
+    max_loss = max(left["max_loss"], right["max_loss"])
+    if joined and right["prefix_kind"] == "loss":
+        max_loss = max(max_loss, joined_len)
+
+    if joined and left["prefix_len"] == left["n"]:
+        left["prefix_len"] = left["n"] + right["prefix_len"]
+        left["prefix_end"] = right["prefix_end"]
+
+    if joined and right["suffix_len"] == right["n"]:
+        left["suffix_len"] = left["suffix_len"] + right["n"]
+    else:
+        left["suffix_kind"] = right["suffix_kind"]
+        left["suffix_len"] = right["suffix_len"]
+
+    left["n"] += right["n"]
+    left["max_win"], left["max_win_end"] = max_win, max_win_end
+    left["max_loss"] = max_loss
+
+
+def merge_partials(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine two partials, `left` covering the earlier matches. Mutates `left`."""
+    left["totalMatches"] += right["totalMatches"]
+
+    for game_type, count in right["matchesByGameType"].items():
+        by_type = left["matchesByGameType"]
+        by_type[game_type] = by_type.get(game_type, 0) + count
+
+    for color, stats in right["team_color_stats"].items():
+        if color not in left["team_color_stats"]:
+            left["team_color_stats"][color] = create_team_color_stats_object()
+        for counter in COUNTERS:
+            left["team_color_stats"][color][counter] += stats[counter]
+
+    for date, count in right["matches_per_day"].items():
+        left["matches_per_day"][date] = left["matches_per_day"].get(date, 0) + count
+
+    if right["watermark"] is not None:
+        if left["watermark"] is None or right["watermark"] > left["watermark"]:
+            left["watermark"] = right["watermark"]
+
+    for player_id, right_player in right["players"].items():
+        if player_id not in left["players"]:
+            left["players"][player_id] = create_player_partial()
+        left_player = left["players"][player_id]
+
+        for counter in COUNTERS:
+            left_player[counter] += right_player[counter]
+        if right_player["n"]:
+            left_player["lastPlayed"] = right_player["lastPlayed"]
+
+        for partner_id, partner in right_player["teamPartners"].items():
+            if partner_id not in left_player["teamPartners"]:
+                left_player["teamPartners"][partner_id] = {
+                    "displayName": partner["displayName"],
+                    "matches": 0,
+                    "wins": 0,
+                }
+            left_player["teamPartners"][partner_id]["matches"] += partner["matches"]
+            left_player["teamPartners"][partner_id]["wins"] += partner["wins"]
+
+        merge_runs(left_player, right_player)
+
+    return left
+
+
+def fold_chunk(
+    player_ids: FrozenSet[str], matches: List[Tuple[str, Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Summarise a time-ordered chunk of matches as a partial aggregate.
+
+    Mirrors process_match: players outside `player_ids` (the group's members
+    and guests) are ignored, exactly as the sequential fold skips them.
+    """
+    partial = create_partial()
+
+    for match_id, match_data in matches:
+        partial["totalMatches"] += 1
+
+        game_type = match_data.get("gameType", "1v1")
+        by_type = partial["matchesByGameType"]
+        by_type[game_type] = by_type.get(game_type, 0) + 1
+
+        if "playedAt" in match_data:
+            match_date = get_date_string_from_timestamp(match_data["playedAt"])
+            if match_date:
+                per_day = partial["matches_per_day"]
+                per_day[match_date] = per_day.get(match_date, 0) + 1
+
+        sort_key = get_match_sort_key(match_data, match_id)
+        if sort_key:
+            if partial["watermark"] is None or sort_key > partial["watermark"]:
+                partial["watermark"] = sort_key
+        position_key = sort_key or (float("-inf"), 0.0, match_id)
+
+        winner = match_data.get("winner", "draw")
+        team1_data = match_data.get("team1", {})
+        team2_data = match_data.get("team2", {})
+        team1_score = team1_data.get("score", 0)
+        team2_score = team2_data.get("score", 0)
+
+        sides = (
+            ("team1", team1_data, "#000000", team1_score, team2_score),
+            ("team2", team2_data, "#ffffff", team2_score, team1_score),
+        )
+        slot = 0
+        for team_key, team_data, default_color, scored, conceded in sides:
+            if winner not in ("team1", "team2"):
+                result = "draw"
+            else:
+                result = "win" if winner == team_key else "loss"
+
+            color = team_data.get("color", default_color)
+            if color not in partial["team_color_stats"]:
+                partial["team_color_stats"][color] = create_team_color_stats_object()
+            color_stats = partial["team_color_stats"][color]
+            color_stats["totalMatches"] += 1
+            color_stats["goalsScored"] += scored
+            color_stats["goalsConceded"] += conceded
+            color_stats[RESULT_COUNTERS[result]] += 1
+
+            team_players = extract_players_from_team(team_data)
+            for player in team_players:
+                player_id = player.get("uid", "")
+                if not player_id or player_id not in player_ids:
+                    continue
+
+                if player_id not in partial["players"]:
+                    partial["players"][player_id] = create_player_partial()
+                stats = partial["players"][player_id]
+
+                stats["totalMatches"] += 1
+                stats["goalsScored"] += scored
+                stats["goalsConceded"] += conceded
+                stats["lastPlayed"] = match_data.get("playedAt")
+                stats[RESULT_COUNTERS[result]] += 1
+                add_result(stats, result, (position_key, slot))
+                slot += 1
+
+                if game_type == "2v2" and len(team_players) > 1:
+                    for teammate in team_players:
+                        teammate_id = teammate.get("uid", "")
+                        if not teammate_id or teammate_id == player_id:
+                            continue
+                        if teammate_id not in stats["teamPartners"]:
+                            stats["teamPartners"][teammate_id] = {
+                                "displayName": teammate.get("displayName", "Unknown"),
+                                "matches": 0,
+                                "wins": 0,
+                            }
+                        stats["teamPartners"][teammate_id]["matches"] += 1
+                        if result == "win":
+                            stats["teamPartners"][teammate_id]["wins"] += 1
+
+    return partial
+
+
+def state_to_partial(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Express a replay state (fresh or from a checkpoint) as a partial.
+
+    Results already in the state are placed before every chunk position; the
+    current longestWinStreak holder ranks first so later ties never displace it.
+    """
+    general_stats = state["general_stats"]
+    holder = general_stats["longestWinStreak"].get("player", "")
+
+    partial = create_partial()
+    partial["totalMatches"] = general_stats["totalMatches"]
+    partial["matchesByGameType"] = dict(general_stats["matchesByGameType"])
+    partial["matches_per_day"] = dict(state["matches_per_day"])
+    partial["watermark"] = state["watermark"]
+    for color, stats in state["team_color_stats"].items():
+        partial["team_color_stats"][color] = {
+            counter: stats[counter] for counter in COUNTERS
+        }
+
+    for player_id, stats in state["player_stats"].to_dicts().items():
+        if stats["totalMatches"] == 0:
+            continue
+
+        current_streak = stats["currentStreak"]
+        if current_streak > 0:
+            suffix_kind = "win"
+        elif current_streak < 0:
+            suffix_kind = "loss"
+        else:
+            suffix_kind = "draw"
+
+        player = create_player_partial()
+        player.update({counter: stats[counter] for counter in COUNTERS})
+        player.update(
+            lastPlayed=stats["lastPlayed"],
+            teamPartners={
+                partner_id: {
+                    "displayName": partner["displayName"],
+                    "matches": partner["matches"],
+                    "wins": partner["wins"],
+                }
+                for partner_id, partner in stats.get("teamPartners", {}).items()
+            },
+            n=stats["totalMatches"],
+            # Never treated as a single run: only the suffix matters on the left.
+            prefix_kind=None,
+            prefix_len=0,
+            suffix_kind=suffix_kind,
+            suffix_len=max(abs(current_streak), 1),
+            max_win=stats["longestWinStreak"],
+            max_win_end=(
+                (STATE_POSITION, 0 if player_id == holder else 1)
+                if stats["longestWinStreak"]
+                else None
+            ),
+            max_loss=stats["longestLossStreak"],
+        )
+        partial["players"][player_id] = player
+
+    return partial
+
+
+def partial_to_state(
+    partial: Dict[str, Any], roster_state: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Turn a merged partial back into a replay state for the roster given."""
+    player_stats = {}
+    for player_id, roster_record in roster_state["player_stats"].items():
+        stats = create_player_stats_object(
+            display_name=roster_record.display_name, is_guest=roster_record.is_guest
+        )
+        player_stats[player_id] = stats
+
+        player = partial["players"].get(player_id)
+        if not player:
+            continue
+
+        for counter in COUNTERS:
+            stats[counter] = player[counter]
+        stats["lastPlayed"] = player["lastPlayed"]
+        stats["teamPartners"] = {
+            partner_id: {**partner, "winRate": 0.0}
+            for partner_id, partner in player["teamPartners"].items()
+        }
+        if player["suffix_kind"] == "win":
+            stats["currentStreak"] = player["suffix_len"]
+        elif player["suffix_kind"] == "loss":
+            stats["currentStreak"] = -player["suffix_len"]
+        stats["longestWinStreak"] = player["max_win"]
+        stats["longestLossStreak"] = player["max_loss"]
+
+    team_color_stats = {
+        color: create_team_color_stats_object()
+        for color in roster_state["team_color_stats"]
+    }
+    for color, stats in partial["team_color_stats"].items():
+        team_color_stats.setdefault(color, create_team_color_stats_object())
+        for counter in COUNTERS:
+            team_color_stats[color][counter] = stats[counter]
+
+    longest_win_streak = {"player": "", "count": 0, "playerName": ""}
+    best_end = None
+    for player_id, player in partial["players"].items():
+        if player_id not in player_stats or player["max_win"] == 0:
+            continue
+        count = player["max_win"]
+        if count > longest_win_streak["count"] or (
+            count == longest_win_streak["count"] and player["max_win_end"] < best_end
+        ):
+            longest_win_streak = {
+                "player": player_id,
+                "count": count,
+                "playerName": player_stats[player_id]["displayName"],
+            }
+            best_end = player["max_win_end"]
+
+    matches_by_game_type = {"1v1": 0, "2v2": 0}
+    matches_by_game_type.update(partial["matchesByGameType"])
+
+    return {
+        "player_stats": PlayerTable.from_dicts(player_stats),
+        "team_color_stats": team_color_stats,
+        "general_stats": {
+            "totalMatches": partial["totalMatches"],
+            "matchesByGameType": matches_by_game_type,
+            "longestWinStreak": longest_win_streak,
+            "mostMatchesInOneDay": {"date": None, "count": 0},
+        },
+        "matches_per_day": defaultdict(int, partial["matches_per_day"]),
+        "watermark": partial["watermark"],
+    }
+
+
+def chunk_runs(
+    runs: Runs, chunk_size: int
+) -> Iterator[Tuple[Any, List[Tuple[str, Dict[str, Any]]]]]:
+    """Group playedAt runs into chunks of roughly `chunk_size` matches.
+
+    Runs are never split, so every chunk ends on a playedAt boundary.
+    """
+    chunk: List[Tuple[str, Dict[str, Any]]] = []
+    played_at = None
+    for played_at, run in runs:
+        chunk.extend(run)
+        if len(chunk) >= chunk_size:
+            yield played_at, chunk
+            chunk = []
+    if chunk:
+        yield played_at, chunk
+
+
+def fold_runs_in_parallel(
+    state: Dict[str, Any],
+    runs: Runs,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    fold: Callable[..., Dict[str, Any]] = fold_chunk,
+) -> Iterator[Tuple[Dict[str, Any], Any]]:
+    """Fold playedAt runs into `state` using a process pool.
+
+    Chunks are reduced to partials by `fold` in worker processes and merged in
+    order.
+    Yields (state, playedAt) after each merged chunk, like the sequential fold
+    does after each run. At most two chunks per worker are in flight.
+    """
+    workers = workers or STATS_PARALLEL_WORKERS
+    chunk_size = chunk_size or STATS_PARALLEL_CHUNK_SIZE
+    player_ids = frozenset(state["player_stats"])
+    partial = state_to_partial(state)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for played_at, chunk in chunk_runs(runs, chunk_size):
+            pending.append((played_at, pool.submit(fold, player_ids, chunk)))
+            if len(pending) >= workers * 2:
+                chunk_played_at, future = pending.popleft()
+                partial = merge_partials(partial, future.result())
+                yield partial_to_state(partial, state), chunk_played_at
+
+        while pending:
+            chunk_played_at, future = pending.popleft()
+            partial = merge_partials(partial, future.result())
+            yield partial_to_state(partial, state), chunk_played_at
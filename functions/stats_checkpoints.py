@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from instrumentation import count_deletes, count_query, count_writes, phase
+from player_records import PlayerTable
+from stats_players import get_payload_size
+
+CHECKPOINTS_COLLECTION = "checkpoints"
+# Persist the replay state every N matches (at the next playedAt boundary).
+STATS_CHECKPOINT_INTERVAL = int(os.environ.get("STATS_CHECKPOINT_INTERVAL", "1000"))
+MAX_BATCH_SIZE = 500
+# Below Firestore's 1 MiB document limit, with room for its own overhead
+MAX_CHECKPOINT_BYTES = 900_000
+
+
+def get_roster_signature(state: Dict[str, Any]) -> str:
+    """Fingerprint of the players and team colors a replay state starts from.
+
+    Checkpoints taken with a different roster (a member joined, a guest was
+    removed) cannot be resumed from. Display names are left out: a rename only
+    relabels players, see checkpoint_to_state.
+    """
+    roster = {
+        "players": sorted(
+            [player_id, record.is_guest]
+            for player_id, record in state["player_stats"].items()
+        ),
+        "teamColors": sorted(state["team_color_stats"].keys()),
+    }
+    return hashlib.sha1(json.dumps(roster).encode("utf-8")).hexdigest()
+
+
+def state_to_checkpoint(
+    state: Dict[str, Any], roster: str, played_at: Any
+) -> Dict[str, Any]:
+    watermark = state["watermark"]
+    return {
+        "roster": roster,
+        "playedAt": played_at,
+        "playedAtSeconds": watermark[0] if watermark else float("-inf"),
+        "matchCount": state["general_stats"]["totalMatches"],
+        "playerStats": state["player_stats"].to_dicts(),
+        "teamColorStats": state["team_color_stats"],
+        "generalStats": state["general_stats"],
+        "matchesPerDay": dict(state["matches_per_day"]),
+        "watermark": list(watermark) if watermark else None,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def checkpoint_to_state(
+    checkpoint: Dict[str, Any], roster_state: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Restore a replay state, with display names taken from `roster_state`."""
+    watermark = checkpoint.get("watermark")
+    player_stats = PlayerTable.from_dicts(checkpoint["playerStats"])
+    for player_id, roster_record in roster_state["player_stats"].items():
+        player_stats.get(player_id).display_name = roster_record.display_name
+
+    return {
+        "player_stats": player_stats,
+        "team_color_stats": checkpoint["teamColorStats"],
+        "general_stats": checkpoint["generalStats"],
+        "matches_per_day": defaultdict(int, checkpoint.get("matchesPerDay", {})),
+        "watermark": tuple(watermark) if watermark else None,
+    }
+
+
+def save_checkpoint(
+    checkpoints_ref: firestore.CollectionReference,
+    state: Dict[str, Any],
+    roster: str,
+    played_at: Any,
+) -> bool:
+    """Persist the replay state; returns whether a checkpoint was written.
+
+    A checkpoint only saves later replays work, so one that is too large for
+    a document or fails to write is skipped instead of failing the replay.
+    """
+    match_count = state["general_stats"]["totalMatches"]
+    checkpoint = state_to_checkpoint(state, roster, played_at)
+    checkpoint_size = get_payload_size(checkpoint)
+    if checkpoint_size > MAX_CHECKPOINT_BYTES:
+        logging.warning(
+            f"Skipping stats checkpoint after {match_count} matches, "
+            f"{checkpoint_size} bytes is over the document limit"
+        )
+        return False
+
+    try:
+        with phase("write"):
+            checkpoints_ref.document(f"{match_count:010d}").set(checkpoint)
+            count_writes()
+    except Exception as e:
+        logging.warning(
+            f"Skipping stats checkpoint after {match_count} matches: {str(e)}"
+        )
+        return False
+    return True
+
+
+def load_checkpoint(
+    db: firestore.Client,
+    checkpoints_ref: firestore.CollectionReference,
+    roster: str,
+    replay_from: float,
+) -> Optional[Dict[str, Any]]:
+    """Return the newest checkpoint taken strictly before `replay_from`.
+
+    Checkpoints at or after `replay_from` no longer reflect the matches and are
+    deleted, as are all checkpoints when the roster changed.
+    """
+    delete_checkpoints(
+        db,
+        checkpoints_ref.where(filter=FieldFilter("playedAtSeconds", ">=", replay_from)),
+    )
+
+    query = (
+        checkpoints_ref.where(filter=FieldFilter("playedAtSeconds", "<", replay_from))
+        .order_by("playedAtSeconds", direction=firestore.Query.DESCENDING)
+        .limit(1)
+    )
+    for checkpoint_doc in count_query(query.stream()):
+        checkpoint = checkpoint_doc.to_dict()
+        if checkpoint.get("roster") == roster:
+            return checkpoint
+
+        logging.info("Group roster changed, discarding stats checkpoints")
+        delete_checkpoints(db, checkpoints_ref)
+
+    return None
+
+
+def get_checkpoints_from(
+    checkpoints_ref: firestore.CollectionReference,
+    replay_from: float,
+    transaction: Optional[firestore.Transaction] = None,
+) -> List[firestore.DocumentReference]:
+    """The checkpoints taken at or after `replay_from`, which every change to
+    a match played then makes stale."""
+    query = checkpoints_ref.where(
+        filter=FieldFilter("playedAtSeconds", ">=", replay_from)
+    ).select([])
+    return [
+        checkpoint_doc.reference
+        for checkpoint_doc in count_query(query.stream(transaction=transaction))
+    ]
+
+
+def delete_checkpoints(db: firestore.Client, query: firestore.Query) -> None:
+    batch = db.batch()
+    batch_count = 0
+
+    for checkpoint_doc in count_query(query.select([]).stream()):
+        batch.delete(checkpoint_doc.reference)
+        count_deletes()
+        batch_count += 1
+
+        if batch_count == MAX_BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            batch_count = 0
+
+    if batch_count:
+        batch.commit()
@@ -0,0 +1,339 @@
+import os
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+import numpy as np
+from match_utils import (
+    create_team_color_stats_object,
+    extract_players_from_team,
+    get_date_string_from_timestamp,
+    get_match_sort_key,
+)
+from stats_aggregate import (
+    STATS_PARALLEL_WORKERS,
+    Runs,
+    chunk_runs,
+    create_partial,
+    create_player_partial,
+    fold_runs_in_parallel,
+    merge_partials,
+    partial_to_state,
+    state_to_partial,
+)
+
+# "python" folds match by match with process_match; "columnar" folds chunks of
+# matches with the NumPy kernels below. Both produce the same groupStats.
+STATS_ENGINE = os.environ.get("STATS_ENGINE", "python")
+STATS_COLUMNAR_CHUNK_SIZE = int(os.environ.get("STATS_COLUMNAR_CHUNK_SIZE", "20000"))
+
+WIN, DRAW, LOSS = 0, 1, 2
+RESULTS = ("win", "draw", "loss")
+RESULT_COUNTERS = ("wins", "draws", "losses")
+
+
+def intern(index: Dict[Any, int], value: Any) -> int:
+    value_index = index.get(value)
+    if value_index is None:
+        value_index = index[value] = len(index)
+    return value_index
+
+
+def load_columns(
+    player_ids: FrozenSet[str], matches: List[Tuple[str, Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Flatten a time-ordered chunk of matches into arrays.
+
+    Per match: winner code, both scores, both team colors, game type and day.
+    Per appearance of a group player: match, side and slot within the match.
+    Per 2v2 partnership: the appearance it belongs to and the teammate.
+    Strings are interned in first-seen order so output maps keep that order.
+    """
+    game_types: Dict[str, int] = {}
+    days: Dict[str, int] = {}
+    colors: Dict[str, int] = {}
+    uids: Dict[str, int] = {}
+    partner_names: Dict[Tuple[int, int], str] = {}
+
+    winners, scores, team_colors, game_type_codes, day_codes = [], [], [], [], []
+    positions, played_ats = [], []
+    app_match, app_player, app_side, app_slot = [], [], [], []
+    pair_app, pair_teammate = [], []
+    watermark = None
+
+    for match_number, (match_id, match_data) in enumerate(matches):
+        game_type = match_data.get("gameType", "1v1")
+        game_type_codes.append(intern(game_types, game_type))
+
+        match_date = None
+        if "playedAt" in match_data:
+            match_date = get_date_string_from_timestamp(match_data["playedAt"])
+        day_codes.append(intern(days, match_date) if match_date else -1)
+
+        sort_key = get_match_sort_key(match_data, match_id)
+        if sort_key and (watermark is None or sort_key > watermark):
+            watermark = sort_key
+        positions.append(sort_key or (float("-inf"), 0.0, match_id))
+        played_ats.append(match_data.get("playedAt"))
+
+        winner = match_data.get("winner", "draw")
+        winners.append(1 if winner == "team1" else 2 if winner == "team2" else 0)
+
+        team1_data = match_data.get("team1", {})
+        team2_data = match_data.get("team2", {})
+        scores.append((team1_data.get("score", 0), team2_data.get("score", 0)))
+        team_colors.append(
+            (
+                intern(colors, team1_data.get("color", "#000000")),
+                intern(colors, team2_data.get("color", "#ffffff")),
+            )
+        )
+
+        slot = 0
+        for side, team_data in enumerate((team1_data, team2_data)):
+            team_players = extract_players_from_team(team_data)
+            is_partnership = game_type == "2v2" and len(team_players) > 1
+            for player in team_players:
+                player_id = player.get("uid", "")
+                if not player_id or player_id not in player_ids:
+                    continue
+
+                player_index = intern(uids, player_id)
+                app_match.append(match_number)
+                app_player.append(player_index)
+                app_side.append(side)
+                app_slot.append(slot)
+                slot += 1
+
+                if not is_partnership:
+                    continue
+                for teammate in team_players:
+                    teammate_id = teammate.get("uid", "")
+                    if not teammate_id or teammate_id == player_id:
+                        continue
+                    teammate_index = intern(uids, teammate_id)
+                    pair_app.append(len(app_match) - 1)
+                    pair_teammate.append(teammate_index)
+                    partner_names.setdefault(
+                        (player_index, teammate_index),
+                        teammate.get("displayName", "Unknown"),
+                    )
+
+    return {
+        "game_types": list(game_types),
+        "days": list(days),
+        "colors": list(colors),
+        "uids": list(uids),
+        "partner_names": partner_names,
+        "watermark": watermark,
+        "positions": positions,
+        "played_ats": played_ats,
+        "winner": np.array(winners, dtype=np.int8),
+        "scores": np.array(scores, dtype=np.int64).reshape(-1, 2).T,
+        "team_colors": np.array(team_colors, dtype=np.int64).reshape(-1, 2).T,
+        "game_type": np.array(game_type_codes, dtype=np.int64),
+        "day": np.array(day_codes, dtype=np.int64),
+        "app_match": np.array(app_match, dtype=np.int64),
+        "app_player": np.array(app_player, dtype=np.int64),
+        "app_side": np.array(app_side, dtype=np.int64),
+        "app_slot": np.array(app_slot, dtype=np.int64),
+        "pair_app": np.array(pair_app, dtype=np.int64),
+        "pair_teammate": np.array(pair_teammate, dtype=np.int64),
+    }
+
+
+def sum_by(index: np.ndarray, size: int, weights: Optional[np.ndarray] = None):
+    """Per-bucket count (or sum of integer weights) as a list of Python ints."""
+    if weights is None:
+        return np.bincount(index, minlength=size).tolist()
+    return np.bincount(index, weights=weights, minlength=size).astype(np.int64).tolist()
+
+
+def side_results(winner: np.ndarray) -> np.ndarray:
+    """Result code of each side of each match, shape (2, matches)."""
+    sides = np.array([[1], [2]], dtype=np.int8)
+    return np.where(winner == 0, DRAW, np.where(winner == sides, WIN, LOSS))
+
+
+def fold_chunk_columnar(
+    player_ids: FrozenSet[str], matches: List[Tuple[str, Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Vectorized equivalent of stats_aggregate.fold_chunk."""
+    columns = load_columns(player_ids, matches)
+    partial = create_partial()
+    partial["totalMatches"] = len(matches)
+    partial["watermark"] = columns["watermark"]
+
+    game_type_counts = sum_by(columns["game_type"], len(columns["game_types"]))
+    partial["matchesByGameType"] = dict(
+        zip(columns["game_types"], game_type_counts, strict=True)
+    )
+
+    day = columns["day"]
+    day_counts = sum_by(day[day >= 0], len(columns["days"]))
+    partial["matches_per_day"] = dict(zip(columns["days"], day_counts, strict=True))
+
+    results = side_results(columns["winner"])
+    scores = columns["scores"]
+    conceded = scores[::-1]
+    color_index = columns["team_colors"].ravel()
+    color_count = len(columns["colors"])
+    color_columns = {
+        "totalMatches": sum_by(color_index, color_count),
+        "goalsScored": sum_by(color_index, color_count, scores.ravel()),
+        "goalsConceded": sum_by(color_index, color_count, conceded.ravel()),
+    }
+    color_results = results.ravel()
+    for code, counter in enumerate(RESULT_COUNTERS):
+        color_columns[counter] = sum_by(color_index[color_results == code], color_count)
+    for position, color in enumerate(columns["colors"]):
+        color_stats = create_team_color_stats_object()
+        for counter, values in color_columns.items():
+            color_stats[counter] = values[position]
+        partial["team_color_stats"][color] = color_stats
+
+    app_player = columns["app_player"]
+    if len(app_player):
+        fold_player_columns(partial, columns, results, scores, conceded)
+
+    return partial
+
+
+def fold_player_columns(
+    partial: Dict[str, Any],
+    columns: Dict[str, Any],
+    results: np.ndarray,
+    scores: np.ndarray,
+    conceded: np.ndarray,
+) -> None:
+    uids = columns["uids"]
+    uid_count = len(uids)
+    app_match = columns["app_match"]
+    app_player = columns["app_player"]
+    app_side = columns["app_side"]
+    app_result = results[app_side, app_match]
+
+    player_columns = {
+        "totalMatches": sum_by(app_player, uid_count),
+        "goalsScored": sum_by(app_player, uid_count, scores[app_side, app_match]),
+        "goalsConceded": sum_by(app_player, uid_count, conceded[app_side, app_match]),
+    }
+    for code, counter in enumerate(RESULT_COUNTERS):
+        player_columns[counter] = sum_by(app_player[app_result == code], uid_count)
+
+    appearance_count = len(app_player)
+    last_appearance = np.full(uid_count, -1, dtype=np.int64)
+    np.maximum.at(last_appearance, app_player, np.arange(appearance_count))
+
+    # Streaks: group each player's results in chronological order and split
+    # them into runs of equal results.
+    order = np.argsort(app_player, kind="stable")
+    sorted_player = app_player[order]
+    sorted_result = app_result[order]
+    run_start = np.flatnonzero(
+        np.concatenate(
+            (
+                [True],
+                (sorted_player[1:] != sorted_player[:-1])
+                | (sorted_result[1:] != sorted_result[:-1]),
+            )
+        )
+    )
+    run_end = np.append(run_start[1:], appearance_count) - 1
+    run_length = run_end - run_start + 1
+    run_player = sorted_player[run_start]
+    run_kind = sorted_result[run_start]
+    run_end_appearance = order[run_end]
+    run_number = np.arange(len(run_start))
+
+    player_first_run = np.full(uid_count, len(run_start), dtype=np.int64)
+    np.minimum.at(player_first_run, run_player, run_number)
+    player_last_run = np.full(uid_count, -1, dtype=np.int64)
+    np.maximum.at(player_last_run, run_player, run_number)
+
+    max_win = np.zeros(uid_count, dtype=np.int64)
+    is_win_run = run_kind == WIN
+    np.maximum.at(max_win, run_player[is_win_run], run_length[is_win_run])
+    # The longest win run that finished first decides tie-breaks.
+    is_best_win_run = is_win_run & (run_length == max_win[run_player])
+    best_win_run = np.full(uid_count, len(run_start), dtype=np.int64)
+    np.minimum.at(
+        best_win_run, run_player[is_best_win_run], run_number[is_best_win_run]
+    )
+
+    max_loss = np.zeros(uid_count, dtype=np.int64)
+    is_loss_run = run_kind == LOSS
+    np.maximum.at(max_loss, run_player[is_loss_run], run_length[is_loss_run])
+
+    positions = columns["positions"]
+    played_ats = columns["played_ats"]
+    app_slot = columns["app_slot"]
+
+    def position_of(appearance: int) -> Tuple:
+        return (positions[app_match[appearance]], int(app_slot[appearance]))
+
+    present = np.flatnonzero(last_appearance >= 0).tolist()
+    for player_index in present:
+        first_run = player_first_run[player_index]
+        last_run = player_last_run[player_index]
+        player = create_player_partial()
+        for counter, values in player_columns.items():
+            player[counter] = values[player_index]
+        player.update(
+            lastPlayed=played_ats[app_match[last_appearance[player_index]]],
+            n=player["totalMatches"],
+            prefix_kind=RESULTS[run_kind[first_run]],
+            prefix_len=int(run_length[first_run]),
+            prefix_end=position_of(run_end_appearance[first_run]),
+            suffix_kind=RESULTS[run_kind[last_run]],
+            suffix_len=int(run_length[last_run]),
+            max_win=int(max_win[player_index]),
+            max_loss=int(max_loss[player_index]),
+        )
+        if player["max_win"]:
+            player["max_win_end"] = position_of(
+                run_end_appearance[best_win_run[player_index]]
+            )
+        partial["players"][uids[player_index]] = player
+
+    pair_app = columns["pair_app"]
+    if not len(pair_app):
+        return
+
+    pair_key = app_player[pair_app] * uid_count + columns["pair_teammate"]
+    pair_wins = (app_result[pair_app] == WIN).astype(np.int64)
+    unique_keys, pair_group = np.unique(pair_key, return_inverse=True)
+    pair_matches = np.bincount(pair_group).tolist()
+    pair_win_counts = np.bincount(pair_group, weights=pair_wins).astype(np.int64)
+    pair_position = dict(
+        zip(unique_keys.tolist(), range(len(unique_keys)), strict=True)
+    )
+
+    for (player_index, teammate_index), name in columns["partner_names"].items():
+        position = pair_position[player_index * uid_count + teammate_index]
+        team_partners = partial["players"][uids[player_index]]["teamPartners"]
+        team_partners[uids[teammate_index]] = {
+            "displayName": name,
+            "matches": pair_matches[position],
+            "wins": int(pair_win_counts[position]),
+        }
+
+
+def fold_runs_columnar(
+    state: Dict[str, Any], runs: Runs, chunk_size: Optional[int] = None
+) -> Iterator[Tuple[Dict[str, Any], Any]]:
+    """Fold playedAt runs into `state` a chunk at a time with NumPy.
+
+    Yields (state, playedAt) after each chunk, which always ends on a playedAt
+    boundary. With STATS_PARALLEL_WORKERS set, chunks are folded in a pool.
+    """
+    chunk_size = chunk_size or STATS_COLUMNAR_CHUNK_SIZE
+    if STATS_PARALLEL_WORKERS > 1:
+        yield from fold_runs_in_parallel(
+            state, runs, chunk_size=chunk_size, fold=fold_chunk_columnar
+        )
+        return
+
+    player_ids = frozenset(state["player_stats"])
+    partial = state_to_partial(state)
+    for played_at, chunk in chunk_runs(runs, chunk_size):
+        partial = merge_partials(partial, fold_chunk_columnar(player_ids, chunk))
+        yield partial_to_state(partial, state), played_at
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import render_field_path
+from instrumentation import count_deletes, count_reads, count_writes, phase
+
+PLAYERS_COLLECTION = "players"
+# Summary field mapping each player to a digest of its players/{playerId} doc,
+# which is what lets a recompute skip players whose stats did not change.
+PLAYER_HASHES_FIELD = "playerHashes"
+# Players that left the group after playing. Their matches count again if they
+# come back, which only a replay can do.
+DEPARTED_PLAYERS_FIELD = "departedPlayers"
+# Always stamped on write, so never a reason to write by itself.
+UNDIFFED_FIELDS = ("lastUpdated",)
+MAX_BATCH_SIZE = 500
+
+# (document, "set" | "update" | "delete", data)
+StatsWrite = Tuple[firestore.DocumentReference, str, Optional[Dict[str, Any]]]
+
+
+def hash_player_stats(player_stats: Dict[str, Any]) -> str:
+    encoded = json.dumps(player_stats, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def get_payload_size(data: Any) -> int:
+    """Rough encoded size of a write payload, for logging."""
+    return len(json.dumps(data, default=str).encode("utf-8"))
+
+
+def count_fields(data: Dict[str, Any]) -> int:
+    return sum(
+        count_fields(value) if isinstance(value, dict) and value else 1
+        for value in data.values()
+    )
+
+
+def diff_fields(
+    previous: Dict[str, Any], current: Dict[str, Any], prefix: Tuple[str, ...] = ()
+) -> Dict[str, Any]:
+    """Field-path updates that turn `previous` into `current`.
+
+    Nested maps are compared key by key so that only changed leaves are
+    written; keys missing from `current` are removed with DELETE_FIELD.
+    """
+    updates = {}
+    for key, value in current.items():
+        path = prefix + (key,)
+        if key not in previous:
+            updates[render_field_path(path)] = value
+        elif isinstance(value, dict) and isinstance(previous[key], dict):
+            updates.update(diff_fields(previous[key], value, path))
+        elif previous[key] != value:
+            updates[render_field_path(path)] = value
+
+    for key in previous:
+        if key not in current:
+            updates[render_field_path(prefix + (key,))] = firestore.DELETE_FIELD
+
+    return updates
+
+
+def plan_summary_write(
+    stats_ref: firestore.DocumentReference,
+    summary: Dict[str, Any],
+    previous_summary: Optional[Dict[str, Any]],
+) -> Optional[StatsWrite]:
+    """Write only the summary fields that changed, or nothing at all."""
+    if previous_summary is None:
+        return stats_ref, "set", summary
+
+    updates = diff_fields(
+        {k: v for k, v in previous_summary.items() if k not in UNDIFFED_FIELDS},
+        {k: v for k, v in summary.items() if k not in UNDIFFED_FIELDS},
+    )
+    if not updates:
+        return None
+
+    for field in UNDIFFED_FIELDS:
+        if field in summary:
+            updates[field] = summary[field]
+    return stats_ref, "update", updates
+
+
+def plan_stats_writes(
+    stats_ref: firestore.DocumentReference,
+    stats_doc: Dict[str, Any],
+    previous_summary: Optional[Dict[str, Any]],
+    partial: bool = False,
+    removed_players: Iterable[str] = (),
+) -> List[StatsWrite]:
+    """Turn a stats doc into the writes that store it.
+
+    Each entry of `playerStats` goes to its own players/{playerId} doc, but only
+    when its digest differs from the stored one; players no longer present are
+    deleted. With `partial`, `playerStats` only holds the players that were
+    touched and everyone else keeps their stored doc, unless listed in
+    `removed_players`. The summary doc is diffed against `previous_summary`
+    and always comes last.
+    """
+    summary = dict(stats_doc)
+    player_stats = summary.pop("playerStats", {})
+    players_ref = stats_ref.collection(PLAYERS_COLLECTION)
+    previous = previous_summary or {}
+    previous_hashes = previous.get(PLAYER_HASHES_FIELD) or {}
+
+    player_hashes = dict(previous_hashes) if partial else {}
+    for player_id in removed_players:
+        player_hashes.pop(player_id, None)
+    writes: List[StatsWrite] = []
+    for player_id, stats in player_stats.items():
+        player_hash = hash_player_stats(stats)
+        player_hashes[player_id] = player_hash
+        if previous_hashes.get(player_id) != player_hash:
+            writes.append((players_ref.document(player_id), "set", stats))
+
+    for player_id in previous_hashes:
+        if player_id not in player_hashes:
+            writes.append((players_ref.document(player_id), "delete", None))
+
+    summary[PLAYER_HASHES_FIELD] = player_hashes
+    departed = previous.get(DEPARTED_PLAYERS_FIELD)
+    if departed and DEPARTED_PLAYERS_FIELD not in summary:
+        # Recomputes do not track departures; keep the ones still away.
+        departed = {
+            player_id: value
+            for player_id, value in departed.items()
+            if player_id not in player_hashes
+        }
+        if departed:
+            summary[DEPARTED_PLAYERS_FIELD] = departed
+    summary_write = plan_summary_write(stats_ref, summary, previous_summary)
+    if summary_write:
+        writes.append(summary_write)
+    return writes
+
+
+def apply_stats_writes(writer: Any, writes: Iterable[StatsWrite]) -> None:
+    """Issue planned writes on a WriteBatch or Transaction."""
+    for doc_ref, method, data in writes:
+        if method == "delete":
+            writer.delete(doc_ref)
+            count_deletes()
+        else:
+            getattr(writer, method)(doc_ref, data)
+            count_writes()
+
+
+def log_stats_writes(
+    group_id: str,
+    stats_ref: firestore.DocumentReference,
+    stats_doc: Dict[str, Any],
+    writes: List[StatsWrite],
+) -> None:
+    full_size = get_payload_size(stats_doc)
+    if not writes:
+        logging.info(
+            f"Stats for group {group_id} unchanged, skipped write "
+            f"(saved {full_size} bytes)"
+        )
+        return
+
+    summary_fields = count_fields(
+        {key: value for key, value in stats_doc.items() if key != "playerStats"}
+    )
+    written_fields = 0
+    player_writes = 0
+    for doc_ref, method, data in writes:
+        if doc_ref is not stats_ref:
+            player_writes += 1
+        elif method == "update":
+            written_fields = len(data)
+        else:
+            written_fields = summary_fields
+
+    written_size = sum(get_payload_size(data) for _ref, _method, data in writes)
+    logging.info(
+        f"Wrote {player_writes} of {len(stats_doc.get('playerStats', {}))} player "
+        f"stats docs and {written_fields} of {summary_fields} summary fields for "
+        f"group {group_id} (saved {max(full_size - written_size, 0)} bytes)"
+    )
+
+
+def write_stats(db: firestore.Client, group_id: str, stats_doc: Dict[str, Any]) -> None:
+    """Store a recomputed stats doc, writing only what changed."""
+    stats_ref = db.collection("groupStats").document(group_id)
+    with phase("fetch"):
+        previous_doc = stats_ref.get()
+        count_reads()
+    previous_summary = previous_doc.to_dict() if previous_doc.exists else None
+
+    with phase("compute"):
+        writes = plan_stats_writes(stats_ref, stats_doc, previous_summary)
+
+    with phase("write"):
+        for start in range(0, len(writes), MAX_BATCH_SIZE):
+            batch = db.batch()
+            apply_stats_writes(batch, writes[start : start + MAX_BATCH_SIZE])
+            batch.commit()
+
+    log_stats_writes(group_id, stats_ref, stats_doc, writes)
+
+
+def load_player_stats(
+    db: firestore.Client,
+    stats_ref: firestore.DocumentReference,
+    player_ids: Iterable[str],
+    transaction: Optional[firestore.Transaction] = None,
+) -> Dict[str, Dict[str, Any]]:
+    players_ref = stats_ref.collection(PLAYERS_COLLECTION)
+    player_refs = [players_ref.document(player_id) for player_id in player_ids]
+    if not player_refs:
+        return {}
+
+    count_reads(len(player_refs))
+    return {
+        player_doc.id: player_doc.to_dict()
+        for player_doc in db.get_all(player_refs, transaction=transaction)
+        if player_doc.exists
+    }
@@ -0,0 +1,176 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from instrumentation import count_query, count_reads, count_writes
+
+STATS_QUEUE_COLLECTION = "statsQueue"
+# How often process_stats_queue runs; Cloud Scheduler's finest is a minute.
+STATS_QUEUE_SCHEDULE_MINUTES = 1
+STATS_QUEUE_SCHEDULE = f"every {STATS_QUEUE_SCHEDULE_MINUTES} minutes"
+
+
+def _get_recompute_window_seconds() -> int:
+    """The configured window, at least one schedule interval: the queue is
+    not processed more often than that, so a shorter window would not be
+    honoured."""
+    window_seconds = int(os.environ.get("STATS_RECOMPUTE_WINDOW_SECONDS", "60"))
+    min_window_seconds = STATS_QUEUE_SCHEDULE_MINUTES * 60
+    if window_seconds < min_window_seconds:
+        logging.warning(
+            f"STATS_RECOMPUTE_WINDOW_SECONDS={window_seconds} is shorter than "
+            f"the stats queue schedule, using {min_window_seconds}"
+        )
+        return min_window_seconds
+    return window_seconds
+
+
+# A dirty group is recomputed at most once per window, however many writes
+# land in it.
+STATS_RECOMPUTE_WINDOW_SECONDS = _get_recompute_window_seconds()
+# How long a worker owns a group before another run may take it over.
+STATS_LEASE_SECONDS = 300
+MAX_GROUPS_PER_RUN = 50
+# replayFrom value that forces a replay from the group's first match.
+FULL_REPLAY = float("-inf")
+
+
+def mark_group_dirty(
+    db: firestore.Client, group_id: str, replay_from: float = FULL_REPLAY
+) -> None:
+    """Queue a coalesced stats recompute for a group.
+
+    A single blind write: bumping `version` is what lets the worker notice
+    writes that arrive while it is already recomputing the group, and
+    `replayFrom` keeps the earliest playedAt any pending write touched.
+    """
+    queue_ref = db.collection(STATS_QUEUE_COLLECTION).document(group_id)
+    queue_ref.set(
+        {
+            "dirty": True,
+            "version": firestore.Increment(1),
+            "replayFrom": firestore.Minimum(replay_from),
+            "markedAt": firestore.SERVER_TIMESTAMP,
+        },
+        merge=True,
+    )
+    count_writes()
+    logging.info(f"Queued stats recompute for group {group_id}")
+
+
+def is_group_dirty(
+    db: firestore.Client,
+    group_id: str,
+    transaction: Optional[firestore.Transaction] = None,
+) -> bool:
+    queue_ref = db.collection(STATS_QUEUE_COLLECTION).document(group_id)
+    queue_doc = queue_ref.get(transaction=transaction)
+    count_reads()
+    return queue_doc.exists and bool(queue_doc.to_dict().get("dirty"))
+
+
+def is_claimable(
+    queue_data: Dict[str, Any],
+    now: datetime,
+    window_seconds: int = STATS_RECOMPUTE_WINDOW_SECONDS,
+) -> bool:
+    """Whether a queue entry is dirty, unleased and outside its window."""
+    if not queue_data.get("dirty"):
+        return False
+
+    lease_until = queue_data.get("leaseUntil")
+    if lease_until and lease_until > now:
+        return False
+
+    last_run_at = queue_data.get("lastRunAt")
+    if last_run_at and last_run_at + timedelta(seconds=window_seconds) > now:
+        return False
+
+    return True
+
+
+def claim_dirty_groups(
+    db: firestore.Client, limit: int = MAX_GROUPS_PER_RUN
+) -> List[Tuple[str, int, float]]:
+    """Lease up to `limit` dirty groups.
+
+    Returns (group_id, version, replay_from) for every group claimed.
+    """
+    now = datetime.now(timezone.utc)
+    query = (
+        db.collection(STATS_QUEUE_COLLECTION)
+        .where(filter=FieldFilter("dirty", "==", True))
+        .limit(limit)
+    )
+
+    claimed = []
+    for queue_doc in count_query(query.stream()):
+        if not is_claimable(queue_doc.to_dict(), now):
+            continue
+
+        claim = _claim_group(db.transaction(), queue_doc.reference, now)
+        if claim is not None:
+            claimed.append((queue_doc.id, *claim))
+
+    return claimed
+
+
+@firestore.transactional
+def _claim_group(
+    transaction: firestore.Transaction,
+    queue_ref: firestore.DocumentReference,
+    now: datetime,
+) -> Optional[Tuple[int, float]]:
+    queue_doc = queue_ref.get(transaction=transaction)
+    count_reads()
+    if not queue_doc.exists:
+        return None
+
+    queue_data = queue_doc.to_dict()
+    if not is_claimable(queue_data, now):
+        return None
+
+    transaction.update(
+        queue_ref, {"leaseUntil": now + timedelta(seconds=STATS_LEASE_SECONDS)}
+    )
+    count_writes()
+    return queue_data.get("version", 0), queue_data.get("replayFrom", FULL_REPLAY)
+
+
+def release_group(
+    db: firestore.Client, group_id: str, version: int, succeeded: bool
+) -> None:
+    """Finish a claimed recompute.
+
+    The entry is only cleared when no write marked the group dirty again after
+    it was claimed and the recompute succeeded, so no update is ever dropped.
+    """
+    queue_ref = db.collection(STATS_QUEUE_COLLECTION).document(group_id)
+    _release_group(db.transaction(), queue_ref, version, succeeded)
+
+
+@firestore.transactional
+def _release_group(
+    transaction: firestore.Transaction,
+    queue_ref: firestore.DocumentReference,
+    version: int,
+    succeeded: bool,
+) -> None:
+    queue_doc = queue_ref.get(transaction=transaction)
+    count_reads()
+    if not queue_doc.exists:
+        return
+
+    updates = {
+        "leaseUntil": None,
+        "lastRunAt": datetime.now(timezone.utc),
+    }
+    if succeeded and queue_doc.to_dict().get("version", 0) == version:
+        updates["dirty"] = False
+        updates["replayFrom"] = firestore.DELETE_FIELD
+
+    transaction.update(queue_ref, updates)
+    count_writes()
@@ -0,0 +1,342 @@
+import copy
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from firebase_admin import firestore
+from instrumentation import count_query, count_reads, count_writes, phase
+from match_participants import PARTICIPANTS_INDEXED_FIELD, query_player_matches
+from match_utils import create_player_stats_object, get_group_roster
+from stats_players import (
+    DEPARTED_PLAYERS_FIELD,
+    PLAYER_HASHES_FIELD,
+    PLAYERS_COLLECTION,
+    apply_stats_writes,
+    plan_stats_writes,
+)
+from stats_queue import is_group_dirty
+
+Roster = Dict[str, Tuple[str, bool]]
+# array-contains-any takes up to 30 values
+MAX_CHECKED_PLAYERS = 30
+
+
+def classify_roster_change(before: Roster, after: Roster) -> Dict[str, Any]:
+    """Split a roster change into added, removed and renamed players.
+
+    Role changes do not show up in the roster and so produce no change.
+    """
+    return {
+        "added": {
+            player_id: player
+            for player_id, player in after.items()
+            if player_id not in before
+        },
+        "removed": [player_id for player_id in before if player_id not in after],
+        "renamed": {
+            player_id: display_name
+            for player_id, (display_name, _is_guest) in after.items()
+            if player_id in before and before[player_id][0] != display_name
+        },
+    }
+
+
+def apply_roster_change(
+    db: firestore.Client,
+    group_id: str,
+    group_data_before: Dict[str, Any],
+    group_data_after: Dict[str, Any],
+) -> bool:
+    """Patch the stored stats for a member/guest change without a replay.
+
+    Returns False when the change affects the numbers (or the stored stats
+    cannot be patched) and the caller has to queue a full recompute.
+    """
+    roster_before = get_group_roster(group_data_before)
+    change = classify_roster_change(roster_before, get_group_roster(group_data_after))
+    if not any(change.values()):
+        logging.info(f"Group {group_id} changed without affecting its stats")
+        return True
+
+    try:
+        with phase("write"):
+            applied = _apply_roster_change_in_transaction(
+                db.transaction(),
+                db,
+                group_id,
+                roster_before,
+                change,
+                bool(group_data_after.get(PARTICIPANTS_INDEXED_FIELD)),
+            )
+        if applied:
+            logging.info(
+                f"Patched stats for group {group_id}: "
+                f"{len(change['added'])} added, {len(change['removed'])} removed, "
+                f"{len(change['renamed'])} renamed"
+            )
+        return applied
+    except Exception as e:
+        logging.error(f"Error patching stats roster for group {group_id}: {str(e)}")
+        return False
+
+
+@firestore.transactional
+def _apply_roster_change_in_transaction(
+    transaction: firestore.Transaction,
+    db: firestore.Client,
+    group_id: str,
+    roster_before: Roster,
+    change: Dict[str, Any],
+    participants_indexed: bool,
+) -> bool:
+    # A queued recompute may already have read the old roster; it has to run
+    # again rather than be patched underneath.
+    with phase("fetch"):
+        if is_group_dirty(db, group_id, transaction=transaction):
+            return False
+
+        stats_ref = db.collection("groupStats").document(group_id)
+        stats_doc = stats_ref.get(transaction=transaction)
+        count_reads()
+        if not stats_doc.exists:
+            return False
+
+        previous_summary = stats_doc.to_dict()
+        player_hashes = previous_summary.get(PLAYER_HASHES_FIELD)
+        if player_hashes is None or set(player_hashes) != set(roster_before):
+            return False
+
+        # departedPlayers only lists players whose removal was patched; anyone
+        # who left through a replay can come back with matches to count.
+        if change["added"]:
+            if not participants_indexed or len(change["added"]) > MAX_CHECKED_PLAYERS:
+                return False
+            query = query_player_matches(db, group_id, sorted(change["added"]))
+            if list(count_query(query.limit(1).stream(transaction=transaction))):
+                return False
+
+        players_ref = stats_ref.collection(PLAYERS_COLLECTION)
+        player_stats = {
+            player_doc.id: player_doc.to_dict()
+            for player_doc in count_query(players_ref.stream(transaction=transaction))
+        }
+
+    with phase("compute"):
+        stats = apply_roster_change_to_stats(previous_summary, player_stats, change)
+        if stats is None:
+            return False
+
+        stats["lastUpdated"] = firestore.SERVER_TIMESTAMP
+        writes = plan_stats_writes(
+            stats_ref,
+            stats,
+            previous_summary,
+            partial=True,
+            removed_players=change["removed"],
+        )
+
+    apply_stats_writes(transaction, writes)
+    return True
+
+
+def apply_roster_change_to_stats(
+    summary: Dict[str, Any],
+    player_stats: Dict[str, Dict[str, Any]],
+    change: Dict[str, Any],
+) -> Optional[Dict[str, Any]]:
+    """Build the patched summary, with `playerStats` holding the players to write.
+
+    Returns None when a replay would produce different numbers: a player
+    joins who already has matches in the group, or the holder of the group's
+    longest win streak leaves.
+    """
+    stats = copy.deepcopy(summary)
+    stats.pop(PLAYER_HASHES_FIELD, None)
+    departed = dict(stats.get(DEPARTED_PLAYERS_FIELD) or {})
+    longest_win_streak = stats.get("longestWinStreak", {})
+
+    for player_id in change["added"]:
+        if player_id in departed:
+            return None
+        for stats_doc in player_stats.values():
+            if player_id in stats_doc.get("teamPartners", {}):
+                return None
+
+    if longest_win_streak.get("player") in change["removed"]:
+        return None
+
+    changed = {}
+    for player_id in change["removed"]:
+        if player_stats.get(player_id, {}).get("totalMatches", 0) > 0:
+            departed[player_id] = True
+
+    for player_id, (display_name, is_guest) in change["added"].items():
+        changed[player_id] = create_player_stats_object(
+            display_name=display_name, is_guest=is_guest
+        )
+
+    renamed = change["renamed"]
+    for player_id, stats_doc in player_stats.items():
+        if player_id in change["removed"]:
+            continue
+
+        renamed_partners = [
+            partner_id
+            for partner_id in stats_doc.get("teamPartners", {})
+            if partner_id in renamed
+        ]
+        if player_id not in renamed and not renamed_partners:
+            continue
+
+        stats_doc = changed[player_id] = copy.deepcopy(stats_doc)
+        if player_id in renamed:
+            stats_doc["displayName"] = renamed[player_id]
+        for partner_id in renamed_partners:
+            stats_doc["teamPartners"][partner_id]["displayName"] = renamed[partner_id]
+
+    if longest_win_streak.get("player") in renamed:
+        longest_win_streak["playerName"] = renamed[longest_win_streak["player"]]
+
+    if departed:
+        stats[DEPARTED_PLAYERS_FIELD] = departed
+    stats["playerStats"] = changed
+    return stats
+
+
+def relabel_players(
+    db: firestore.Client,
+    group_id: str,
+    group_ref: firestore.DocumentReference,
+    group_updates: Dict[str, Any],
+    relabels: Dict[str, Tuple[str, str]],
+) -> bool:
+    """Hand guests' stats over to the members that replaced them in their matches.
+
+    `relabels` maps a guest's player ID to the member's ID and displayName.
+    The stats move in the same transaction as `group_updates`, which takes
+    the guests off the roster. Returns False, without writing anything,
+    when a replay would produce different numbers; the caller then has to
+    update the group and queue a recompute itself.
+    """
+    try:
+        with phase("write"):
+            relabelled = _relabel_players_in_transaction(
+                db.transaction(), db, group_id, group_ref, group_updates, relabels
+            )
+        if relabelled:
+            logging.info(f"Relabelled {len(relabels)} players in group {group_id}")
+        return relabelled
+    except Exception as e:
+        logging.error(f"Error relabelling players for group {group_id}: {str(e)}")
+        return False
+
+
+@firestore.transactional
+def _relabel_players_in_transaction(
+    transaction: firestore.Transaction,
+    db: firestore.Client,
+    group_id: str,
+    group_ref: firestore.DocumentReference,
+    group_updates: Dict[str, Any],
+    relabels: Dict[str, Tuple[str, str]],
+) -> bool:
+    with phase("fetch"):
+        if is_group_dirty(db, group_id, transaction=transaction):
+            return False
+
+        stats_ref = db.collection("groupStats").document(group_id)
+        stats_doc = stats_ref.get(transaction=transaction)
+        count_reads()
+        if not stats_doc.exists:
+            return False
+
+        previous_summary = stats_doc.to_dict()
+        player_hashes = previous_summary.get(PLAYER_HASHES_FIELD)
+        if player_hashes is None or not set(relabels) <= set(player_hashes):
+            return False
+
+        players_ref = stats_ref.collection(PLAYERS_COLLECTION)
+        player_stats = {
+            player_doc.id: player_doc.to_dict()
+            for player_doc in count_query(players_ref.stream(transaction=transaction))
+        }
+
+    with phase("compute"):
+        stats = relabel_players_in_stats(previous_summary, player_stats, relabels)
+        if stats is None:
+            return False
+
+        stats["lastUpdated"] = firestore.SERVER_TIMESTAMP
+        writes = plan_stats_writes(
+            stats_ref,
+            stats,
+            previous_summary,
+            partial=True,
+            removed_players=list(relabels),
+        )
+
+    apply_stats_writes(transaction, writes)
+    transaction.update(group_ref, group_updates)
+    count_writes()
+    return True
+
+
+def relabel_players_in_stats(
+    summary: Dict[str, Any],
+    player_stats: Dict[str, Dict[str, Any]],
+    relabels: Dict[str, Tuple[str, str]],
+) -> Optional[Dict[str, Any]]:
+    """Build the relabelled summary, with `playerStats` holding the players to
+    write.
+
+    Returns None unless every member is still without matches, so that a
+    replay would give them exactly the guest's numbers, and no guest has
+    departed.
+    """
+    stats = copy.deepcopy(summary)
+    stats.pop(PLAYER_HASHES_FIELD, None)
+    departed = stats.get(DEPARTED_PLAYERS_FIELD) or {}
+    new_ids = {new_id for new_id, _display_name in relabels.values()}
+
+    for player_id, (new_id, _display_name) in relabels.items():
+        if player_id not in player_stats or player_id in departed:
+            return None
+        if new_id in departed or new_id in relabels:
+            return None
+        if player_stats.get(new_id, {}).get("totalMatches", 0) > 0:
+            return None
+    for stats_doc in player_stats.values():
+        if new_ids & set(stats_doc.get("teamPartners", {})):
+            return None
+
+    changed = {}
+    for player_id, stats_doc in player_stats.items():
+        if player_id in new_ids:
+            continue
+
+        relabelled_partners = [
+            partner_id
+            for partner_id in stats_doc.get("teamPartners", {})
+            if partner_id in relabels
+        ]
+        if player_id not in relabels and not relabelled_partners:
+            continue
+
+        stats_doc = copy.deepcopy(stats_doc)
+        if player_id in relabels:
+            player_id, stats_doc["displayName"] = relabels[player_id]
+            stats_doc["isGuest"] = False
+        for partner_id in relabelled_partners:
+            new_id, display_name = relabels[partner_id]
+            partner = stats_doc["teamPartners"].pop(partner_id)
+            partner["displayName"] = display_name
+            stats_doc["teamPartners"][new_id] = partner
+        changed[player_id] = stats_doc
+
+    longest_win_streak = stats.get("longestWinStreak", {})
+    if longest_win_streak.get("player") in relabels:
+        new_id, display_name = relabels[longest_win_streak["player"]]
+        longest_win_streak["player"] = new_id
+        longest_win_streak["playerName"] = display_name
+
+    stats["playerStats"] = changed
+    return stats
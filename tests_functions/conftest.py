@@ -1,6 +1,31 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
+from data_access import set_db
+from group_cache import reset_group_cache
+from join_throttle import reset_join_throttle
+from rate_limiter import reset_local_buckets
+
+
+@pytest.fixture(autouse=True)
+def cold_instance():
+    """Start every test without the client, groups, rate limits and failed
+    joins a warm instance keeps"""
+    set_db(None)
+    reset_group_cache()
+    reset_local_buckets()
+    reset_join_throttle()
+
+
+@pytest.fixture
+def no_rate_limits():
+    """Let every callable request through, for clients mocked without rate
+    limit docs"""
+    with (
+        patch("functions.join_group.acquire"),
+        patch("functions.guest_migration.acquire"),
+    ):
+        yield
 
 
 @pytest.fixture
@@ -0,0 +1,90 @@
+from firebase_admin import firestore
+
+from benchmarks_functions.bench_firestore import BenchFirestore
+from benchmarks_functions.bench_stats import compare_with_baseline, run_benchmark
+from benchmarks_functions.synthetic import SyntheticGroup
+from functions.match_utils import extract_players_from_team
+
+
+def test_synthetic_group_is_deterministic_and_ordered():
+    """Test that matches regenerate identically and come in playedAt order"""
+    group = SyntheticGroup(500, seed=3)
+    matches = list(group)
+
+    assert matches == list(SyntheticGroup(500, seed=3))
+    played_at = [match_data["playedAt"] for _match_id, match_data in matches]
+    assert played_at == sorted(played_at)
+    for index, (_match_id, match_data) in enumerate(matches):
+        assert group.index_after(match_data["playedAt"]) > index
+    assert {match_data["gameType"] for _id, match_data in matches} == {"1v1", "2v2"}
+    assert any(
+        isinstance(match_data["team1"]["players"], dict) for _id, match_data in matches
+    )
+
+
+def test_synthetic_group_participation_is_skewed():
+    """Test that the most active player plays far more than the least active"""
+    group = SyntheticGroup(2000, seed=1)
+    counts = {}
+    for _match_id, match_data in group:
+        for team in ("team1", "team2"):
+            for player in extract_players_from_team(match_data[team]):
+                counts[player["uid"]] = counts.get(player["uid"], 0) + 1
+
+    assert max(counts.values()) > 5 * min(counts.values())
+
+
+def test_benchmark_recompute_covers_every_match():
+    """Test that a small benchmark run recomputes every match and writes stats"""
+    result = run_benchmark(300, players=10, memory=True)
+
+    assert result["matches"] == 300
+    assert result["matches_per_second"] > 0
+    assert result["player_docs"] == 10
+    assert result["peak_memory_bytes"] > 0
+    assert 0 < result["summary_bytes"] < result["single_doc_bytes"]
+
+
+def test_benchmark_firestore_pages_with_cursors():
+    """Test that the replay query pages through snapshot and playedAt cursors"""
+    group = SyntheticGroup(50, seed=2)
+    db = BenchFirestore(group)
+
+    query = (
+        db.collection("matches")
+        .where(filter=firestore.FieldFilter("groupId", "==", group.group_id))
+        .order_by("playedAt")
+        .select(["playedAt"])
+        .limit(20)
+    )
+    first = list(query.stream())
+    second = list(query.start_after(first[-1]).stream())
+
+    assert [doc.id for doc in first + second] == [
+        group.match_id(index) for index in range(40)
+    ]
+    assert set(first[0].to_dict()) == {"playedAt"}
+    resumed = list(
+        query.start_after({"playedAt": first[-1].to_dict()["playedAt"]}).stream()
+    )
+    assert resumed[0].to_dict()["playedAt"] > first[-1].to_dict()["playedAt"]
+
+
+def test_compare_with_baseline_flags_slowdowns():
+    """Test that only throughput drops beyond the tolerance are reported"""
+    baseline = [{"matches": 100, "matches_per_second": 1000.0}]
+
+    assert (
+        compare_with_baseline(
+            [{"matches": 100, "matches_per_second": 950.0}], baseline, 0.1
+        )
+        == []
+    )
+    assert (
+        len(
+            compare_with_baseline(
+                [{"matches": 100, "matches_per_second": 800.0}], baseline, 0.1
+            )
+        )
+        == 1
+    )
@@ -0,0 +1,167 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firebase_functions import https_fn
+
+from functions.group_cache import GROUP_CACHE_TTL_SECONDS, GroupCache
+from functions.guest_migration import migrate_guest_to_member
+from functions.join_group import join_group_with_code
+from functions.memory_firestore import MemoryFirestore
+from tests_functions.test_guest_migration import get_job, run_job
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def db():
+    db = MemoryFirestore()
+    db.collection("groups").document("g1").set(
+        {
+            "name": "One",
+            "adminUid": "adminuid",
+            "inviteCode": "AAAA2222",
+            "members": {"adminuid": {"name": "Admin", "role": "admin"}},
+            "guests": [{"id": "123", "name": "Guest"}],
+        }
+    )
+    db.collection("inviteCodes").document("AAAA2222").set({"groupId": "g1"})
+    return db
+
+
+def make_auth(uid):
+    auth = MagicMock()
+    auth.uid = uid
+    auth.token = {"name": uid}
+    return auth
+
+
+def test_entries_expire_and_least_recently_used_go_first():
+    """Test the TTL and the size bound of the cache"""
+    clock = FakeClock()
+    cache = GroupCache(ttl_seconds=10, max_entries=2, clock=clock)
+    cache.put("g1", {"name": "One", "unrelated": 1})
+    cache.put("g2", {"name": "Two"})
+
+    assert cache.get("g1") == {"name": "One"}
+    cache.put("g3", {"name": "Three"})
+    assert cache.get("g2") is None
+    assert cache.get("g3") == {"name": "Three"}
+
+    clock.now = 10
+    assert cache.get("g1") is None
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.hit_rate() == 0.5
+
+
+def test_cached_metadata_cannot_be_changed_by_callers():
+    """Test that callers get copies of the cached group"""
+    cache = GroupCache()
+    cache.put("g1", {"members": {"a": {"role": "admin"}}})
+    cache.get("g1")["members"]["b"] = {}
+    assert cache.get("g1") == {"members": {"a": {"role": "admin"}}}
+
+
+@patch("firebase_admin.firestore.client")
+def test_instance_reuses_its_firestore_client(mock_client):
+    """Test that the Admin client is created once per instance"""
+    from data_access import get_db as instance_get_db
+
+    assert instance_get_db() is instance_get_db()
+    mock_client.assert_called_once()
+
+
+@patch("firebase_admin.firestore.client")
+def test_warm_instance_joins_without_reading_the_group(mock_client, db):
+    """Test that joins after the first one only read the invite code index"""
+    mock_client.return_value = db
+    join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("first"))
+
+    db.reset_stats()
+    result = join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("second"))
+
+    assert result["alreadyMember"] is False
+    # The index entry and the user's rate limit, then the rate limit and member
+    assert db.stats == {"reads": 2, "writes": 2, "deletes": 0}
+    members = db.collection("groups").document("g1").get().to_dict()["members"]
+    assert set(members) == {"adminuid", "first", "second"}
+
+
+@patch("firebase_admin.firestore.client")
+def test_cached_membership_is_checked_before_turning_a_user_away(mock_client, db):
+    """Test that a user removed on another instance can join again"""
+    mock_client.return_value = db
+    join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("joiner"))
+    db.collection("groups").document("g1").update(
+        {"members": {"adminuid": {"name": "Admin", "role": "admin"}}}
+    )
+
+    result = join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("joiner"))
+
+    assert result["alreadyMember"] is False
+
+
+@patch("firebase_admin.firestore.client")
+def test_changes_made_elsewhere_show_once_the_entry_expires(mock_client, db, mock_auth):
+    """Test that a guest removed by another instance is no longer valid"""
+    mock_client.return_value = db
+    mock_auth.uid = "adminuid"
+    data = {"groupId": "g1", "guestId": "123", "memberId": "adminuid"}
+    clock = FakeClock()
+    with patch("group_cache._cache.clock", clock):
+        migrate_guest_to_member(data, mock_auth)
+        db.collection("groups").document("g1").update({"guests": []})
+
+        clock.now = GROUP_CACHE_TTL_SECONDS
+        with pytest.raises(https_fn.HttpsError) as excinfo:
+            migrate_guest_to_member(data, mock_auth)
+    assert "Guest with ID 123 does not exist" in excinfo.value.message
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_job_rechecks_admin_rights(mock_client, db, mock_auth):
+    """Test that a job queued on stale cached rights does not run"""
+    mock_client.return_value = db
+    group_ref = db.collection("groups").document("g1")
+    group_ref.update({"members.helper": {"name": "Helper", "role": "admin"}})
+    mock_auth.uid = "helper"
+    data = {"groupId": "g1", "guestId": "123", "memberId": "helper"}
+    migrate_guest_to_member(data, mock_auth)
+
+    group_ref.update({"members.helper": {"name": "Helper", "role": "viewer"}})
+    result = migrate_guest_to_member(data, mock_auth)
+    run_job(result["jobId"])
+
+    job = get_job(db, result["jobId"])
+    assert job["status"] == "failed"
+    assert "Only group admins" in job["error"]
+    assert group_ref.get().to_dict()["guests"] == [{"id": "123", "name": "Guest"}]
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_rereads_the_group_before_turning_it_away(mock_client, db, mock_auth):
+    """Test that a member and a guest added on another instance can be migrated"""
+    mock_client.return_value = db
+    mock_auth.uid = "adminuid"
+    migrate_guest_to_member(
+        {"groupId": "g1", "guestId": "123", "memberId": "adminuid"}, mock_auth
+    )
+
+    db.collection("groups").document("g1").update(
+        {
+            "members.newcomer": {"name": "Newcomer", "role": "viewer"},
+            "guests": [{"id": "123", "name": "Guest"}, {"id": "456", "name": "New"}],
+        }
+    )
+    result = migrate_guest_to_member(
+        {"groupId": "g1", "guestId": "456", "memberId": "newcomer"}, mock_auth
+    )
+
+    assert get_job(db, result["jobId"])["migrations"] == {
+        "456": {"guestName": "New", "memberId": "newcomer", "memberName": "Newcomer"}
+    }
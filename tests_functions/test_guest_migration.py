@@ -3,9 +3,27 @@ from unittest.mock import MagicMock, patch
 import firebase_admin
 from firebase_admin import firestore
 from firebase_functions import https_fn
+from google.api_core import exceptions
 from google.cloud.firestore_v1.base_query import FieldFilter
 
-from functions.guest_migration import migrate_guest_to_member
+from functions.guest_migration import (
+    migrate_guest_to_member,
+    migrate_guests_to_members,
+    process_migration_job,
+    run_migration_job,
+)
+from functions.match_participants import (
+    PARTICIPANTS_INDEXED_FIELD,
+    backfill_participant_uids,
+)
+from functions.match_stats import (
+    on_group_update,
+    on_match_update,
+    recalculate_group_stats,
+)
+from functions.migration_jobs import MIGRATION_JOB_FIELD, MIGRATION_JOBS_COLLECTION
+from functions.memory_firestore import MemoryFirestore
+from tests_functions.test_memory_firestore import make_match
 
 
 @pytest.fixture
@@ -35,6 +53,14 @@ def mock_auth():
     return mock_auth
 
 
+def run_queued_job(db, mock_jobs_collection):
+    """Run the job a callable queued, as process_migration_job would"""
+    job_ref = mock_jobs_collection.document.return_value
+    job_data = job_ref.set.call_args[0][0]
+    assert job_data["status"] == "queued"
+    return run_migration_job(db, job_ref.id, job_data)
+
+
 @pytest.fixture
 def mock_matches_collection():
     """Mock matches collection with query capabilities"""
@@ -44,6 +70,7 @@ def mock_matches_collection():
     return mock_collection, mock_query
 
 
+@pytest.mark.usefixtures("no_rate_limits")
 @patch("firebase_admin.firestore.client")
 def test_migrate_guest_to_member_success(
     mock_client, mock_auth, valid_migrate_data, mock_group_data
@@ -68,11 +95,13 @@ def test_migrate_guest_to_member_success(
 
     mock_groups_collection = MagicMock()
     mock_matches_collection = MagicMock()
+    mock_jobs_collection = MagicMock()
+    mock_jobs_collection.document.return_value.id = "job1"
 
-    mock_batch = MagicMock()
+    mock_bulk_writer = MagicMock()
 
     mock_client_instance = MagicMock()
-    mock_client_instance.batch.return_value = mock_batch
+    mock_client_instance.bulk_writer.return_value = mock_bulk_writer
 
     def mock_collection(name):
         if name == "groups":
@@ -81,17 +110,24 @@ def test_migrate_guest_to_member_success(
         elif name == "matches":
             mock_matches_collection.where.return_value = mock_query
             return mock_matches_collection
+        elif name == "migrationJobs":
+            return mock_jobs_collection
 
     mock_client_instance.collection.side_effect = mock_collection
     mock_client.return_value = mock_client_instance
 
     result = migrate_guest_to_member(valid_migrate_data, mock_auth)
+    mock_bulk_writer.flush.assert_not_called()
+    updated_matches_count = run_queued_job(mock_client_instance, mock_jobs_collection)
 
     assert result["success"] is True
-    assert "Successfully migrated guest" in result["message"]
-    mock_batch.commit.assert_called_once()
+    assert result["jobId"] == mock_jobs_collection.document.return_value.id
+    assert updated_matches_count == 1
+    mock_bulk_writer.flush.assert_called_once()
+    mock_doc_ref.update.assert_called_once()
 
 
+@pytest.mark.usefixtures("no_rate_limits")
 @patch("firebase_admin.firestore.client")
 def test_migrate_guest_with_different_match_formats(
     mock_client, mock_auth, valid_migrate_data, mock_group_data
@@ -130,11 +166,13 @@ def test_migrate_guest_with_different_match_formats(
 
     mock_groups_collection = MagicMock()
     mock_matches_collection = MagicMock()
+    mock_jobs_collection = MagicMock()
+    mock_jobs_collection.document.return_value.id = "job1"
 
-    mock_batch = MagicMock()
+    mock_bulk_writer = MagicMock()
 
     mock_client_instance = MagicMock()
-    mock_client_instance.batch.return_value = mock_batch
+    mock_client_instance.bulk_writer.return_value = mock_bulk_writer
 
     def mock_collection(name):
         if name == "groups":
@@ -143,19 +181,25 @@ def test_migrate_guest_with_different_match_formats(
         elif name == "matches":
             mock_matches_collection.where.return_value = mock_query
             return mock_matches_collection
+        elif name == "migrationJobs":
+            return mock_jobs_collection
 
     mock_client_instance.collection.side_effect = mock_collection
     mock_client.return_value = mock_client_instance
 
     result = migrate_guest_to_member(valid_migrate_data, mock_auth)
+    mock_bulk_writer.flush.assert_not_called()
+    updated_matches_count = run_queued_job(mock_client_instance, mock_jobs_collection)
 
     assert result["success"] is True
-    assert "Successfully migrated guest" in result["message"]
-    assert "Updated 2 matches" in result["message"]
-    mock_batch.commit.assert_called_once()
-    assert mock_batch.update.call_count == 3  # 2 matches + 1 group update
+    assert result["jobId"] == mock_jobs_collection.document.return_value.id
+    assert updated_matches_count == 2
+    mock_bulk_writer.flush.assert_called_once()
+    assert mock_bulk_writer.update.call_count == 2
+    mock_doc_ref.update.assert_called_once()
 
 
+@pytest.mark.usefixtures("no_rate_limits")
 @patch("firebase_admin.firestore.client")
 def test_migrate_guest_with_no_matches(
     mock_client, mock_auth, valid_migrate_data, mock_group_data
@@ -180,11 +224,13 @@ def test_migrate_guest_with_no_matches(
 
     mock_groups_collection = MagicMock()
     mock_matches_collection = MagicMock()
+    mock_jobs_collection = MagicMock()
+    mock_jobs_collection.document.return_value.id = "job1"
 
-    mock_batch = MagicMock()
+    mock_bulk_writer = MagicMock()
 
     mock_client_instance = MagicMock()
-    mock_client_instance.batch.return_value = mock_batch
+    mock_client_instance.bulk_writer.return_value = mock_bulk_writer
 
     def mock_collection(name):
         if name == "groups":
@@ -193,19 +239,25 @@ def test_migrate_guest_with_no_matches(
         elif name == "matches":
             mock_matches_collection.where.return_value = mock_query
             return mock_matches_collection
+        elif name == "migrationJobs":
+            return mock_jobs_collection
 
     mock_client_instance.collection.side_effect = mock_collection
     mock_client.return_value = mock_client_instance
 
     result = migrate_guest_to_member(valid_migrate_data, mock_auth)
+    mock_bulk_writer.flush.assert_not_called()
+    updated_matches_count = run_queued_job(mock_client_instance, mock_jobs_collection)
 
     assert result["success"] is True
-    assert "Successfully migrated guest" in result["message"]
-    assert "Updated 0 matches" in result["message"]
-    mock_batch.commit.assert_called_once()
-    assert mock_batch.update.call_count == 1
+    assert result["jobId"] == mock_jobs_collection.document.return_value.id
+    assert updated_matches_count == 0
+    mock_bulk_writer.flush.assert_called_once()
+    assert mock_bulk_writer.update.call_count == 1  # participantUids backfill
+    mock_doc_ref.update.assert_called_once()
 
 
+@pytest.mark.usefixtures("no_rate_limits")
 @patch("firebase_admin.firestore.client")
 def test_migrate_guest_with_multiple_matches(
     mock_client, mock_auth, valid_migrate_data, mock_group_data
@@ -252,11 +304,13 @@ def test_migrate_guest_with_multiple_matches(
 
     mock_groups_collection = MagicMock()
     mock_matches_collection = MagicMock()
+    mock_jobs_collection = MagicMock()
+    mock_jobs_collection.document.return_value.id = "job1"
 
-    mock_batch = MagicMock()
+    mock_bulk_writer = MagicMock()
 
     mock_client_instance = MagicMock()
-    mock_client_instance.batch.return_value = mock_batch
+    mock_client_instance.bulk_writer.return_value = mock_bulk_writer
 
     def mock_collection(name):
         if name == "groups":
@@ -265,19 +319,25 @@ def test_migrate_guest_with_multiple_matches(
         elif name == "matches":
             mock_matches_collection.where.return_value = mock_query
             return mock_matches_collection
+        elif name == "migrationJobs":
+            return mock_jobs_collection
 
     mock_client_instance.collection.side_effect = mock_collection
     mock_client.return_value = mock_client_instance
 
     result = migrate_guest_to_member(valid_migrate_data, mock_auth)
+    mock_bulk_writer.flush.assert_not_called()
+    updated_matches_count = run_queued_job(mock_client_instance, mock_jobs_collection)
 
     assert result["success"] is True
-    assert "Successfully migrated guest" in result["message"]
-    assert "Updated 5 matches" in result["message"]
-    mock_batch.commit.assert_called_once()
-    assert mock_batch.update.call_count == 6  # 5 matches + 1 group update
+    assert result["jobId"] == mock_jobs_collection.document.return_value.id
+    assert updated_matches_count == 5
+    mock_bulk_writer.flush.assert_called_once()
+    assert mock_bulk_writer.update.call_count == 5
+    mock_doc_ref.update.assert_called_once()
 
 
+@pytest.mark.usefixtures("no_rate_limits")
 @patch("firebase_admin.firestore.client")
 def test_migrate_guest_complex_match_structure(
     mock_client, mock_auth, valid_migrate_data, mock_group_data
@@ -333,11 +393,13 @@ def test_migrate_guest_complex_match_structure(
 
     mock_groups_collection = MagicMock()
     mock_matches_collection = MagicMock()
+    mock_jobs_collection = MagicMock()
+    mock_jobs_collection.document.return_value.id = "job1"
 
-    mock_batch = MagicMock()
+    mock_bulk_writer = MagicMock()
 
     mock_client_instance = MagicMock()
-    mock_client_instance.batch.return_value = mock_batch
+    mock_client_instance.bulk_writer.return_value = mock_bulk_writer
 
     def mock_collection(name):
         if name == "groups":
@@ -346,12 +408,385 @@ def test_migrate_guest_complex_match_structure(
         elif name == "matches":
             mock_matches_collection.where.return_value = mock_query
             return mock_matches_collection
+        elif name == "migrationJobs":
+            return mock_jobs_collection
 
     mock_client_instance.collection.side_effect = mock_collection
     mock_client.return_value = mock_client_instance
 
     result = migrate_guest_to_member(valid_migrate_data, mock_auth)
+    mock_bulk_writer.flush.assert_not_called()
+    updated_matches_count = run_queued_job(mock_client_instance, mock_jobs_collection)
 
     assert result["success"] is True
-    assert "Successfully migrated guest" in result["message"]
-    mock_batch.commit.assert_called_once()
+    assert result["jobId"] == mock_jobs_collection.document.return_value.id
+    # Players are only looked up under team1 and team2
+    assert updated_matches_count == 0
+    mock_bulk_writer.flush.assert_called_once()
+    mock_doc_ref.update.assert_called_once()
+
+
+@pytest.fixture
+def memory_db(mock_group_data):
+    """A memory Firestore with a group and matches without participantUids"""
+    db = MemoryFirestore()
+    mock_group_data["guests"].append({"id": "456", "name": "Second Guest"})
+    db.collection("groups").document("test-group-id").set(mock_group_data)
+    players = [("guest_123", "other-user"), ("other-user", "member-123")]
+    players += [("guest_456", "guest_123"), ("other-user", "guest_456")]
+    for index, (player1, player2) in enumerate(players):
+        match_data = make_match(index + 1, player1, player2, 10, 5)
+        match_data["groupId"] = "test-group-id"
+        db.collection("matches").document(f"m{index}").set(match_data)
+    return db
+
+
+def run_job(job_id):
+    """Deliver the created event of a migration job to its trigger"""
+    event = MagicMock()
+    event.params = {"jobId": job_id}
+    process_migration_job.__wrapped__(event)
+
+
+def get_job(db, job_id):
+    return db.collection(MIGRATION_JOBS_COLLECTION).document(job_id).get().to_dict()
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_backfills_participants_then_reads_only_guest_matches(
+    mock_client, memory_db, mock_auth
+):
+    """Test that the first migration indexes the group for the next ones"""
+    mock_client.return_value = memory_db
+
+    result = migrate_guest_to_member(
+        {"groupId": "test-group-id", "guestId": "123", "memberId": "member-123"},
+        mock_auth,
+    )
+    memory_db.reset_stats()
+    run_job(result["jobId"])
+
+    # The job, group and all four matches, then the queue entry and stats the
+    # relabel checks; the job when claimed and finished, every match once,
+    # the group and its stats queue entry
+    assert memory_db.stats == {"reads": 8, "writes": 8, "deletes": 0}
+    assert get_job(memory_db, result["jobId"])["matchesUpdated"] == 2
+    matches = {
+        doc.id: doc.to_dict() for doc in memory_db.collection("matches").stream()
+    }
+    assert {
+        match_id: data["participantUids"] for match_id, data in matches.items()
+    } == {
+        "m0": ["member-123", "other-user"],
+        "m1": ["member-123", "other-user"],
+        "m2": ["guest_456", "member-123"],
+        "m3": ["guest_456", "other-user"],
+    }
+
+    result = migrate_guest_to_member(
+        {"groupId": "test-group-id", "guestId": "456", "memberId": "member-123"},
+        mock_auth,
+    )
+    memory_db.reset_stats()
+    run_job(result["jobId"])
+
+    # The job, group and only the two matches the guest played in, then the
+    # stats queue entry, still dirty from the first migration
+    assert memory_db.stats == {"reads": 5, "writes": 6, "deletes": 0}
+    assert get_job(memory_db, result["jobId"])["matchesUpdated"] == 2
+    group = memory_db.collection("groups").document("test-group-id").get().to_dict()
+    assert group["guests"] == []
+    assert group[PARTICIPANTS_INDEXED_FIELD] is True
+
+
+@patch("firebase_admin.firestore.client")
+def test_match_trigger_keeps_participants_in_sync(mock_client, memory_db):
+    """Test that on_match_update repairs participantUids after a write"""
+    mock_client.return_value = memory_db
+    match_ref = memory_db.collection("matches").document("m1")
+    event = MagicMock()
+    event.data.before = None
+    event.data.after = match_ref.get()
+    event.params = {"matchId": "m1"}
+
+    on_match_update.__wrapped__(event)
+    assert match_ref.get().to_dict()["participantUids"] == [
+        "member-123",
+        "other-user",
+    ]
+
+    event.data.before = event.data.after
+    event.data.after = match_ref.get()
+    memory_db.reset_stats()
+    on_match_update.__wrapped__(event)
+    assert memory_db.stats == {"reads": 0, "writes": 0, "deletes": 0}
+
+
+def test_backfill_indexes_every_group_not_yet_indexed(memory_db):
+    """Test the one-off participantUids backfill, paged over groups and matches"""
+    memory_db.collection("groups").document("empty-group").set({"members": {}})
+    memory_db.collection("groups").document("indexed-group").set(
+        {"members": {}, PARTICIPANTS_INDEXED_FIELD: True}
+    )
+    match_data = make_match(1, "guest_123", "other-user", 10, 5)
+    match_data["groupId"] = "indexed-group"
+    memory_db.collection("matches").document("m9").set(match_data)
+
+    assert backfill_participant_uids(memory_db, page_size=2) == 2
+
+    matches = {
+        doc.id: doc.to_dict() for doc in memory_db.collection("matches").stream()
+    }
+    assert matches["m2"]["participantUids"] == ["guest_123", "guest_456"]
+    assert all("participantUids" in matches[f"m{index}"] for index in range(4))
+    assert "participantUids" not in matches["m9"]
+    groups = memory_db.collection("groups")
+    for group_id in ("test-group-id", "empty-group"):
+        assert groups.document(group_id).get().to_dict()[PARTICIPANTS_INDEXED_FIELD]
+
+    memory_db.reset_stats()
+    assert backfill_participant_uids(memory_db, page_size=2) == 0
+    assert memory_db.stats["writes"] == 0
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_rewrites_more_matches_than_a_batch_holds(
+    mock_client, memory_db, mock_auth
+):
+    """Test that a guest with over 500 matches is migrated"""
+    mock_client.return_value = memory_db
+    for index in range(600):
+        match_data = make_match(1, "guest_123", "other-user", 10, 5)
+        match_data["groupId"] = "test-group-id"
+        memory_db.collection("matches").document(f"extra{index:03d}").set(match_data)
+
+    result = migrate_guest_to_member(
+        {"groupId": "test-group-id", "guestId": "123", "memberId": "member-123"},
+        mock_auth,
+    )
+    with patch("functions.guest_migration.save_migration_progress") as save_progress:
+        run_job(result["jobId"])
+
+    assert get_job(memory_db, result["jobId"])["status"] == "done"
+    assert get_job(memory_db, result["jobId"])["matchesUpdated"] == 602
+    save_progress.assert_called_once_with(memory_db, result["jobId"], 500)
+    group = memory_db.collection("groups").document("test-group-id").get().to_dict()
+    assert group["guests"] == [{"id": "456", "name": "Second Guest"}]
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_keeps_the_guest_when_match_writes_fail(
+    mock_client, memory_db, mock_auth
+):
+    """Test that the guests update is only applied after every match write"""
+    mock_client.return_value = memory_db
+    commit = memory_db._commit
+
+    def failing_commit(writes, *args):
+        if writes[0][1].path == "matches/m0":
+            raise exceptions.Aborted("Too much contention")
+        return commit(writes, *args)
+
+    data = {"groupId": "test-group-id", "guestId": "123", "memberId": "member-123"}
+    failed = migrate_guest_to_member(data, mock_auth)
+    with patch.object(memory_db, "_commit", side_effect=failing_commit):
+        run_job(failed["jobId"])
+
+    assert get_job(memory_db, failed["jobId"])["status"] == "failed"
+    assert (
+        "Failed to write 1 match updates"
+        in get_job(memory_db, failed["jobId"])["error"]
+    )
+    group = memory_db.collection("groups").document("test-group-id").get().to_dict()
+    assert len(group["guests"]) == 2
+    assert PARTICIPANTS_INDEXED_FIELD not in group
+
+    result = migrate_guest_to_member(data, mock_auth)
+    run_job(result["jobId"])
+    assert get_job(memory_db, result["jobId"])["status"] == "done"
+    assert get_job(memory_db, result["jobId"])["matchesUpdated"] == 1
+    assert get_job(memory_db, failed["jobId"])["status"] == "failed"
+
+
+@patch("firebase_admin.firestore.client")
+def test_bulk_migration_rewrites_each_match_once(mock_client, memory_db, mock_auth):
+    """Test that several guests are migrated in a single pass over the matches"""
+    mock_client.return_value = memory_db
+
+    result = migrate_guests_to_members(
+        {
+            "groupId": "test-group-id",
+            "migrations": [
+                {"guestId": "123", "memberId": "member-123"},
+                {"guestId": "456", "memberId": "test-admin-uid"},
+            ],
+        },
+        mock_auth,
+    )
+    memory_db.reset_stats()
+    run_job(result["jobId"])
+
+    # The job, group and four matches read once, then the queue entry and
+    # stats the relabel checks; the job twice, four match writes (one of them
+    # a participantUids backfill), the group and one stats queue entry
+    assert memory_db.stats == {"reads": 8, "writes": 8, "deletes": 0}
+    assert result["message"] == "Started migrating 2 guests."
+    assert get_job(memory_db, result["jobId"])["matchesUpdated"] == 3
+    m2 = memory_db.collection("matches").document("m2").get().to_dict()
+    assert m2["team1"]["players"][0] == {
+        "uid": "test-admin-uid",
+        "displayName": "Admin User",
+    }
+    assert m2["participantUids"] == ["member-123", "test-admin-uid"]
+    assert m2[MIGRATION_JOB_FIELD] == result["jobId"]
+    group = memory_db.collection("groups").document("test-group-id").get().to_dict()
+    assert group["guests"] == []
+    queue = memory_db.collection("statsQueue").document("test-group-id").get()
+    assert queue.to_dict()["version"] == 1
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_job_runs_once(mock_client, memory_db, mock_auth):
+    """Test that a redelivered job event does not run the migration again"""
+    mock_client.return_value = memory_db
+    result = migrate_guest_to_member(
+        {"groupId": "test-group-id", "guestId": "123", "memberId": "member-123"},
+        mock_auth,
+    )
+    assert (
+        memory_db.collection("matches")
+        .document("m0")
+        .get()
+        .to_dict()["team1"]["players"][0]["uid"]
+        == "guest_123"
+    )
+
+    run_job(result["jobId"])
+    before = memory_db.dump()
+    run_job(result["jobId"])
+
+    assert get_job(memory_db, result["jobId"])["status"] == "done"
+    assert memory_db.dump() == before
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_relabels_guest_stats_without_a_recompute(
+    mock_client, memory_db, mock_auth
+):
+    """Test that a member without matches takes over the guest's stats as is"""
+    mock_client.return_value = memory_db
+    doubles = make_match(5, "guest_456", "other-user", 3, 10)
+    doubles["groupId"] = "test-group-id"
+    doubles["gameType"] = "2v2"
+    doubles["team1"]["players"].append({"uid": "member-123", "displayName": "x"})
+    memory_db.collection("matches").document("m4").set(doubles)
+    assert recalculate_group_stats(memory_db, "test-group-id")
+
+    result = migrate_guest_to_member(
+        {"groupId": "test-group-id", "guestId": "456", "memberId": "test-admin-uid"},
+        mock_auth,
+    )
+    run_job(result["jobId"])
+
+    assert get_job(memory_db, result["jobId"])["statsRelabelled"] is True
+    assert not memory_db.collection("statsQueue").document("test-group-id").get().exists
+    players = memory_db.collection("groupStats/test-group-id/players")
+    assert not players.document("guest_456").get().exists
+    admin = players.document("test-admin-uid").get().to_dict()
+    assert (admin["displayName"], admin["isGuest"]) == ("Admin User", False)
+    assert (admin["totalMatches"], admin["wins"]) == (3, 1)
+    partner = players.document("member-123").get().to_dict()["teamPartners"]
+    assert partner["test-admin-uid"]["displayName"] == "Admin User"
+
+    # A full recompute over the rewritten matches comes to the same stats
+    relabelled = {
+        path: data
+        for path, data in memory_db.dump().items()
+        if path.startswith("groupStats/") and "/checkpoints/" not in path
+    }
+    assert recalculate_group_stats(memory_db, "test-group-id")
+    recomputed = {
+        path: data
+        for path, data in memory_db.dump().items()
+        if path.startswith("groupStats/") and "/checkpoints/" not in path
+    }
+    for data in [*relabelled.values(), *recomputed.values()]:
+        data.pop("lastUpdated", None)
+    assert recomputed == relabelled
+
+
+@patch("firebase_admin.firestore.client")
+def test_migration_recomputes_stats_when_the_member_has_matches(
+    mock_client, memory_db, mock_auth
+):
+    """Test that merging into a member who played falls back to one recompute"""
+    mock_client.return_value = memory_db
+    assert recalculate_group_stats(memory_db, "test-group-id")
+
+    result = migrate_guest_to_member(
+        {"groupId": "test-group-id", "guestId": "123", "memberId": "member-123"},
+        mock_auth,
+    )
+    run_job(result["jobId"])
+
+    assert get_job(memory_db, result["jobId"])["statsRelabelled"] is False
+    queue = memory_db.collection("statsQueue").document("test-group-id").get()
+    assert queue.to_dict()["version"] == 1
+    assert (
+        memory_db.collection("groupStats/test-group-id/players")
+        .document("guest_123")
+        .get()
+        .exists
+    )
+
+
+@patch("firebase_admin.firestore.client")
+def test_triggers_skip_writes_of_a_migration_job(mock_client, memory_db):
+    """Test that rewritten matches and the group update touch no stats"""
+    mock_client.return_value = memory_db
+    # The match trigger still fills in the missing participantUids
+    for collection, doc_id, trigger, param, writes in [
+        ("matches", "m0", on_match_update, "matchId", 1),
+        ("groups", "test-group-id", on_group_update, "groupId", 0),
+    ]:
+        doc_ref = memory_db.collection(collection).document(doc_id)
+        event = MagicMock()
+        event.data.before = doc_ref.get()
+        doc_ref.update({"guests": [], MIGRATION_JOB_FIELD: "job1"})
+        event.data.after = doc_ref.get()
+        event.params = {param: doc_id}
+
+        memory_db.reset_stats()
+        trigger.__wrapped__(event)
+        assert memory_db.stats == {"reads": 0, "writes": writes, "deletes": 0}
+
+
+@pytest.mark.parametrize(
+    "migrations",
+    [
+        [],
+        [{"guestId": "123"}],
+        [{"guestId": "123", "memberId": "member-123"}] * 2,
+        [
+            {"guestId": "123", "memberId": "member-123"},
+            {"guestId": "456", "memberId": "member-123"},
+        ],
+        [{"guestId": "789", "memberId": "member-123"}],
+    ],
+)
+@pytest.mark.usefixtures("no_rate_limits")
+@patch("firebase_admin.firestore.client")
+def test_bulk_migration_rejects_invalid_mappings(
+    mock_client, memory_db, mock_auth, migrations
+):
+    """Test that invalid guest to member mappings change nothing"""
+    mock_client.return_value = memory_db
+    before = memory_db.dump()
+
+    with pytest.raises(https_fn.HttpsError) as error:
+        migrate_guests_to_members(
+            {"groupId": "test-group-id", "migrations": migrations}, mock_auth
+        )
+
+    assert error.value.code == https_fn.FunctionsErrorCode.INVALID_ARGUMENT
+    assert memory_db.dump() == before
@@ -0,0 +1,146 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from functions.instrumentation import (
+    count_query,
+    count_reads,
+    count_writes,
+    instrumented,
+    phase,
+)
+from functions.match_stats import on_match_update, process_stats_queue
+from functions.memory_firestore import MemoryFirestore
+from functions.stats_queue import mark_group_dirty
+from tests_functions.test_memory_firestore import make_match
+
+
+@pytest.fixture
+def group_data():
+    """Create group data with two members and a guest"""
+    return {
+        "name": "Test Group",
+        "adminUid": "alice",
+        "members": {
+            "alice": {"role": "admin", "name": "Alice"},
+            "bob": {"role": "editor", "name": "Bob"},
+        },
+        "guests": [{"id": "1", "name": "Dan"}],
+        "teamColors": {"teamOne": "#ff0000", "teamTwo": "#0000ff"},
+    }
+
+
+@pytest.fixture
+def db(group_data):
+    """Create an in-memory database with a group and three matches"""
+    db = MemoryFirestore()
+    db.collection("groups").document("group1").set(group_data)
+    for day, (player1, player2) in enumerate(
+        [("alice", "bob"), ("bob", "guest_1"), ("guest_1", "alice")], start=1
+    ):
+        db.collection("matches").document(f"m{day}").set(
+            make_match(day, player1, player2, 10, day)
+        )
+    return db
+
+
+def logged_records(mock_info):
+    return [call.kwargs for call in mock_info.call_args_list]
+
+
+@patch("firebase_functions.logger.info")
+def test_invocation_logs_one_record_with_exclusive_phases(mock_info):
+    """Test that nested phases pause the outer one and counts add up"""
+
+    @instrumented("example")
+    def example():
+        with phase("compute"):
+            with phase("fetch"):
+                list(count_query([]))
+                count_reads(2)
+            count_writes()
+
+    example()
+
+    (record,) = logged_records(mock_info)
+    assert record["invocation"] == "example"
+    assert record["status"] == "ok"
+    assert (record["reads"], record["writes"], record["deletes"]) == (3, 1, 0)
+    assert set(record["phasesMs"]) <= {"compute", "fetch", "other"}
+    assert sum(record["phasesMs"].values()) <= record["durationMs"] + 0.01
+
+
+@patch("firebase_functions.logger.info")
+def test_failed_invocation_is_logged_as_error(mock_info):
+    """Test that an exception still produces the invocation record"""
+
+    @instrumented("failing")
+    def failing():
+        count_reads()
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        failing()
+
+    (record,) = logged_records(mock_info)
+    assert record["status"] == "error"
+    assert record["reads"] == 1
+
+
+def test_helpers_are_no_ops_outside_invocations():
+    """Test that uninstrumented callers can use the helpers freely"""
+    with phase("fetch"):
+        count_reads()
+    assert list(count_query([1, 2])) == [1, 2]
+
+
+@patch("firebase_functions.logger.info")
+@patch("firebase_admin.firestore.client")
+def test_recompute_accounting_matches_firestore_operations(mock_client, mock_info, db):
+    """Test that the logged counts equal the operations Firestore saw"""
+    mock_client.return_value = db
+    mark_group_dirty(db, "group1")
+    db.reset_stats()
+
+    process_stats_queue.__wrapped__(MagicMock())
+
+    (record,) = logged_records(mock_info)
+    assert record["groupCount"] == 1
+    assert {"fetch", "compute", "write"} <= set(record["phasesMs"])
+    assert (record["reads"], record["writes"], record["deletes"]) == (
+        db.reads,
+        db.writes,
+        db.deletes,
+    )
+
+
+@patch("firebase_functions.logger.info")
+@patch("firebase_admin.firestore.client")
+def test_match_trigger_accounting_matches_firestore_operations(
+    mock_client, mock_info, db
+):
+    """Test that an incremental match update logs its reads and writes"""
+    mock_client.return_value = db
+    mark_group_dirty(db, "group1")
+    process_stats_queue.__wrapped__(MagicMock())
+    mock_info.reset_mock()
+
+    match_ref = db.collection("matches").document("m4")
+    match_ref.set(make_match(4, "alice", "guest_1", 10, 4))
+    event = MagicMock()
+    event.data.before = None
+    event.data.after = match_ref.get()
+    event.params = {"matchId": "m4"}
+    db.reset_stats()
+
+    on_match_update.__wrapped__(event)
+
+    (record,) = logged_records(mock_info)
+    assert record["groupId"] == "group1"
+    assert record["matchId"] == "m4"
+    assert (record["reads"], record["writes"], record["deletes"]) == (
+        db.reads,
+        db.writes,
+        db.deletes,
+    )
+    assert record["writes"] > 0
@@ -0,0 +1,147 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firebase_functions import https_fn
+
+from functions.invite_codes import (
+    INVITE_CODES_COLLECTION,
+    backfill_invite_codes,
+    on_group_invite_code_written,
+)
+from functions.join_group import join_group_with_code
+from functions.memory_firestore import MemoryFirestore
+
+
+@pytest.fixture
+def db():
+    return MemoryFirestore()
+
+
+@pytest.fixture
+def mock_auth():
+    mock_auth = MagicMock()
+    mock_auth.uid = "joininguid"
+    mock_auth.token = {"name": "Joining User"}
+    return mock_auth
+
+
+def write_group(db, group_id, group_data, trigger=True):
+    """Write a group as the client does, then deliver the trigger event"""
+    group_ref = db.collection("groups").document(group_id)
+    event = MagicMock()
+    event.params = {"groupId": group_id}
+    event.data.before = group_ref.get()
+    if group_data is None:
+        group_ref.delete()
+    else:
+        group_ref.set(group_data)
+    event.data.after = group_ref.get()
+    if trigger:
+        on_group_invite_code_written.__wrapped__(event)
+    return event
+
+
+def index(db):
+    return {
+        doc.id: doc.to_dict()["groupId"]
+        for doc in db.collection(INVITE_CODES_COLLECTION).stream()
+    }
+
+
+def group_code(db, group_id):
+    return db.collection("groups").document(group_id).get().to_dict()["inviteCode"]
+
+
+@patch("firebase_admin.firestore.client")
+def test_index_follows_group_create_rotation_and_delete(mock_client, db):
+    """Test that the index holds exactly the codes groups use"""
+    mock_client.return_value = db
+
+    write_group(db, "g1", {"name": "One", "inviteCode": "AAAA2222"})
+    write_group(db, "g2", {"name": "Two", "inviteCode": "BBBB2222"})
+    assert index(db) == {"AAAA2222": "g1", "BBBB2222": "g2"}
+
+    write_group(db, "g1", {"name": "One", "inviteCode": "CCCC2222"})
+    assert index(db) == {"BBBB2222": "g2", "CCCC2222": "g1"}
+
+    write_group(db, "g1", {"name": "Renamed", "inviteCode": "CCCC2222"})
+    write_group(db, "g2", None)
+    assert index(db) == {"CCCC2222": "g1"}
+
+
+@patch("firebase_admin.firestore.client")
+def test_group_with_a_taken_code_gets_a_fresh_one(mock_client, db):
+    """Test that no two groups share an invite code"""
+    mock_client.return_value = db
+    write_group(db, "g1", {"inviteCode": "AAAA2222"})
+
+    write_group(db, "g2", {"inviteCode": "AAAA2222"})
+
+    new_code = group_code(db, "g2")
+    assert new_code != "AAAA2222"
+    assert len(new_code) == 8
+    assert index(db) == {"AAAA2222": "g1", new_code: "g2"}
+
+
+@patch("firebase_admin.firestore.client")
+def test_late_trigger_leaves_a_reused_code_alone(mock_client, db):
+    """Test that triggers arriving out of order still leave a consistent index"""
+    mock_client.return_value = db
+    write_group(db, "g1", {"inviteCode": "AAAA2222"})
+    rotation = write_group(db, "g1", {"inviteCode": "BBBB2222"}, trigger=False)
+
+    # g1 no longer uses the code its entry still points at
+    write_group(db, "g2", {"inviteCode": "AAAA2222"})
+    assert group_code(db, "g2") == "AAAA2222"
+
+    on_group_invite_code_written.__wrapped__(rotation)
+    assert index(db) == {"AAAA2222": "g2", "BBBB2222": "g1"}
+
+
+@patch("firebase_admin.firestore.client")
+def test_join_reads_one_index_entry(mock_client, db, mock_auth):
+    """Test that a join is a document get rather than a query over the groups"""
+    mock_client.return_value = db
+    write_group(db, "g1", {"name": "One", "inviteCode": "AAAA2222", "members": {}})
+    db.reset_stats()
+
+    result = join_group_with_code({"inviteCode": "aaaa2222 "}, mock_auth)
+
+    assert result["groupId"] == "g1"
+    # The user's rate limit, the index entry and the group, then the rate
+    # limit and the new member
+    assert db.stats == {"reads": 3, "writes": 2, "deletes": 0}
+
+
+@patch("firebase_admin.firestore.client")
+def test_join_rejects_a_code_the_group_rotated(mock_client, db, mock_auth):
+    """Test that an entry the trigger has not removed yet does not let anyone in"""
+    mock_client.return_value = db
+    write_group(db, "g1", {"inviteCode": "AAAA2222", "members": {}})
+    write_group(db, "g1", {"inviteCode": "BBBB2222", "members": {}}, trigger=False)
+
+    with pytest.raises(https_fn.HttpsError) as excinfo:
+        join_group_with_code({"inviteCode": "AAAA2222"}, mock_auth)
+
+    assert excinfo.value.code == https_fn.FunctionsErrorCode.INVALID_ARGUMENT
+    assert db.collection("groups").document("g1").get().to_dict()["members"] == {}
+
+
+@patch("firebase_admin.firestore.client")
+def test_backfill_and_join_fallback_index_existing_groups(mock_client, db, mock_auth):
+    """Test that groups created before the index get their entries"""
+    mock_client.return_value = db
+    for group_id, code in [("g1", "AAAA2222"), ("g2", None), ("g3", "CCCC2222")]:
+        write_group(db, group_id, {"inviteCode": code, "members": {}}, trigger=False)
+    write_group(db, "g4", {"inviteCode": "DDDD2222", "members": {}}, trigger=False)
+
+    result = join_group_with_code({"inviteCode": "DDDD2222"}, mock_auth)
+    assert result["groupId"] == "g4"
+    assert index(db) == {"DDDD2222": "g4"}
+
+    assert backfill_invite_codes(db, page_size=2) == 3
+    assert index(db) == {
+        "AAAA2222": "g1",
+        "CCCC2222": "g3",
+        "DDDD2222": "g4",
+    }
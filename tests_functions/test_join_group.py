@@ -8,6 +8,8 @@ from google.cloud.firestore_v1.base_query import FieldFilter
 
 from functions.join_group import join_group_with_code
 
+pytestmark = pytest.mark.usefixtures("no_rate_limits")
+
 
 @pytest.fixture
 def valid_join_data():
@@ -38,24 +40,34 @@ def mock_group_data():
     }
 
 
+def mock_index_entry(group_id):
+    """Mock inviteCodes collection whose entry points at group_id"""
+    mock_entry = MagicMock()
+    mock_entry.exists = group_id is not None
+    mock_entry.to_dict.return_value = {"groupId": group_id}
+    mock_codes_ref = MagicMock()
+    mock_codes_ref.document.return_value.get.return_value = mock_entry
+    return mock_codes_ref
+
+
 @patch("firebase_admin.firestore.client")
 def test_join_group_success(mock_client, mock_auth, valid_join_data, mock_group_data):
     """Test successful join group"""
     mock_group_doc = MagicMock()
+    mock_group_doc.exists = True
     mock_group_doc.id = "test-group-id"
     mock_group_doc.to_dict.return_value = mock_group_data
 
-    mock_query = MagicMock()
-    mock_query.stream.return_value = [mock_group_doc]
-
     mock_groups_ref = MagicMock()
-    mock_groups_ref.where.return_value = mock_query
+    mock_codes_ref = mock_index_entry("test-group-id")
 
     mock_group_ref = MagicMock()
+    mock_group_ref.get.return_value = mock_group_doc
 
     mock_client_instance = MagicMock()
     mock_client_instance.collection.side_effect = lambda name: {
-        "groups": mock_groups_ref
+        "groups": mock_groups_ref,
+        "inviteCodes": mock_codes_ref,
     }.get(name, MagicMock())
     mock_groups_ref.document.return_value = mock_group_ref
 
@@ -63,10 +75,9 @@ def test_join_group_success(mock_client, mock_auth, valid_join_data, mock_group_
 
     result = join_group_with_code(valid_join_data, mock_auth)
 
-    mock_groups_ref.where.assert_called_once()
-    filter_args = mock_groups_ref.where.call_args[1]
-    assert filter_args["filter"].field_path == "inviteCode"
-    assert filter_args["filter"].value == "ABC12345"
+    mock_codes_ref.document.assert_called_once_with("ABC12345")
+    mock_groups_ref.where.assert_not_called()
+    mock_groups_ref.document.assert_called_with("test-group-id")
 
     mock_group_ref.update.assert_called_once()
     update_args = mock_group_ref.update.call_args[0][0]
@@ -93,25 +104,24 @@ def test_join_group_already_member(
     }
 
     mock_group_doc = MagicMock()
+    mock_group_doc.exists = True
     mock_group_doc.id = "test-group-id"
     mock_group_doc.to_dict.return_value = updated_group_data
 
-    mock_query = MagicMock()
-    mock_query.stream.return_value = [mock_group_doc]
-
     mock_groups_ref = MagicMock()
-    mock_groups_ref.where.return_value = mock_query
+    mock_groups_ref.document.return_value.get.return_value = mock_group_doc
+    mock_codes_ref = mock_index_entry("test-group-id")
 
     mock_client_instance = MagicMock()
-    mock_client_instance.collection.return_value = mock_groups_ref
+    mock_client_instance.collection.side_effect = lambda name: {
+        "groups": mock_groups_ref,
+        "inviteCodes": mock_codes_ref,
+    }[name]
     mock_client.return_value = mock_client_instance
 
     result = join_group_with_code(valid_join_data, mock_auth)
 
-    assert (
-        not hasattr(mock_groups_ref, "document")
-        or mock_groups_ref.document.call_count == 0
-    )
+    mock_groups_ref.document.return_value.update.assert_not_called()
 
     assert result["success"] is True
     assert "already a member" in result["message"]
@@ -129,10 +139,14 @@ def test_join_group_invalid_code(mock_client, mock_auth):
     mock_query.stream.return_value = []
 
     mock_groups_ref = MagicMock()
-    mock_groups_ref.where.return_value = mock_query
+    mock_groups_ref.where.return_value.limit.return_value = mock_query
+    mock_codes_ref = mock_index_entry(None)
 
     mock_client_instance = MagicMock()
-    mock_client_instance.collection.return_value = mock_groups_ref
+    mock_client_instance.collection.side_effect = lambda name: {
+        "groups": mock_groups_ref,
+        "inviteCodes": mock_codes_ref,
+    }[name]
     mock_client.return_value = mock_client_instance
 
     with pytest.raises(https_fn.HttpsError) as excinfo:
@@ -0,0 +1,142 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firebase_functions import https_fn
+
+from functions.join_group import join_group_with_code
+from functions.join_throttle import (
+    GLOBAL_FREE_FAILURES,
+    INVALID_CODE_TTL_SECONDS,
+    USER_FREE_FAILURES,
+    FailureBackoff,
+    InvalidCodeCache,
+)
+from functions.memory_firestore import MemoryFirestore
+from tests_functions.test_invite_codes import write_group
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def db():
+    db = MemoryFirestore()
+    db.collection("groups").document("g1").set(
+        {"name": "One", "adminUid": "adminuid", "inviteCode": "AAAA2222", "members": {}}
+    )
+    db.collection("inviteCodes").document("AAAA2222").set({"groupId": "g1"})
+    return db
+
+
+def make_auth(uid):
+    auth = MagicMock()
+    auth.uid = uid
+    auth.token = {"name": uid}
+    return auth
+
+
+def join(invite_code, uid="guesser"):
+    """The error code of the join, or None if it succeeded"""
+    try:
+        join_group_with_code({"inviteCode": invite_code}, make_auth(uid))
+    except https_fn.HttpsError as e:
+        return e.code
+    return None
+
+
+INVALID = https_fn.FunctionsErrorCode.INVALID_ARGUMENT
+THROTTLED = https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED
+
+
+def test_backoff_doubles_after_the_free_failures():
+    """Test the waits of a key and that quiet keys are forgiven"""
+    clock = FakeClock()
+    backoff = FailureBackoff(2, 1.0, 5.0, reset_seconds=60, clock=clock)
+    waits = []
+    for _ in range(6):
+        backoff.record_failure("u1")
+        waits.append(backoff.retry_after("u1"))
+
+    assert waits == [None, None, 1.0, 2.0, 4.0, 5.0]
+    assert backoff.retry_after("u2") is None
+
+    clock.now = 60
+    assert backoff.retry_after("u1") is None
+    backoff.record_failure("u1")
+    assert backoff.retry_after("u1") is None
+
+
+def test_invalid_codes_expire():
+    """Test the TTL of the negative lookup cache"""
+    clock = FakeClock()
+    codes = InvalidCodeCache(ttl_seconds=10, clock=clock)
+    codes.add("AAAA2222")
+    assert "AAAA2222" in codes
+
+    clock.now = 10
+    assert "AAAA2222" not in codes
+
+
+@patch("firebase_admin.firestore.client")
+def test_repeated_invalid_code_is_rejected_in_memory(mock_client, db):
+    """Test that a code that just failed is not looked up again"""
+    mock_client.return_value = db
+    assert join("BBBB2222") == INVALID
+
+    db.reset_stats()
+    assert join("BBBB2222", uid="someoneelse") == INVALID
+    assert db.stats == {"reads": 0, "writes": 0, "deletes": 0}
+
+
+@patch("firebase_admin.firestore.client")
+def test_guessing_user_backs_off(mock_client, db):
+    """Test that a user who keeps guessing is turned away before any read"""
+    mock_client.return_value = db
+    for i in range(USER_FREE_FAILURES + 1):
+        assert join(f"BBBB222{i + 2}") == INVALID
+
+    db.reset_stats()
+    assert join("AAAA2222") == THROTTLED
+    assert db.stats == {"reads": 0, "writes": 0, "deletes": 0}
+    assert join("AAAA2222", uid="someoneelse") is None
+
+
+@patch("firebase_admin.firestore.client")
+def test_successful_join_forgives_failures(mock_client, db):
+    """Test that a user who mistyped the code a few times is not held back"""
+    mock_client.return_value = db
+    for i in range(USER_FREE_FAILURES):
+        assert join(f"BBBB222{i + 2}") == INVALID
+    assert join("AAAA2222") is None
+
+    assert join("CCCC2222") == INVALID
+
+
+@patch("firebase_admin.firestore.client")
+def test_instance_backs_off_when_many_users_guess(mock_client, db):
+    """Test the global failure counter"""
+    mock_client.return_value = db
+    for i in range(GLOBAL_FREE_FAILURES + 1):
+        assert join(f"BBBB{i:04d}", uid=f"guesser{i}") == INVALID
+
+    assert join("AAAA2222", uid="someoneelse") == THROTTLED
+
+
+@patch("firebase_admin.firestore.client")
+def test_code_a_group_starts_using_is_accepted_again(mock_client, db):
+    """Test that a code that failed while the index lagged expires"""
+    mock_client.return_value = db
+    clock = FakeClock()
+    with patch("join_throttle._invalid_codes.clock", clock):
+        assert join("BBBB2222") == INVALID
+
+        write_group(db, "g1", {"name": "One", "inviteCode": "BBBB2222", "members": {}})
+        assert join("BBBB2222", uid="joiner") == INVALID
+
+        clock.now = INVALID_CODE_TTL_SECONDS
+        assert join("BBBB2222", uid="joiner") is None
@@ -1,11 +1,22 @@
 import logging
+from datetime import datetime, timezone
 from unittest.mock import MagicMock, patch
 
 import firebase_admin
 import pytest
 from firebase_admin import firestore
+from google.api_core import exceptions
 
-from functions.match_cleanup import on_group_deleted_cleanup_matches
+from functions.cleanup_jobs import claim_cleanup_job
+from functions.group_tombstones import is_group_deleted
+from functions.match_cleanup import (
+    delete_group_matches,
+    on_group_deleted_cleanup_matches,
+    process_cleanup_jobs,
+)
+from functions.match_stats import on_match_update, recalculate_group_stats
+from functions.memory_firestore import MemoryFirestore
+from tests_functions.test_memory_firestore import make_match
 
 
 @patch("firebase_admin.firestore.client")
@@ -402,3 +413,164 @@ def test_match_cleanup_with_exception_during_stats_deletion(
 
     mock_log_error.assert_called_once()
     assert "Test stats deletion exception" in str(mock_log_error.call_args[0][0])
+
+
+@patch("firebase_admin.firestore.client")
+def test_cleanup_skips_stats_work_for_deleted_matches(mock_client):
+    """Test that match deletions from a group cleanup skip the stats entirely"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    group_data = {
+        "name": "Test Group",
+        "adminUid": "alice",
+        "members": {"alice": {"role": "admin", "name": "Alice"}},
+        "guests": [{"id": "1", "name": "Dan"}],
+    }
+    db.collection("groups").document("group1").set(group_data)
+    for day in range(1, 4):
+        db.collection("matches").document(f"m{day}").set(
+            make_match(day, "alice", "guest_1", 10, day)
+        )
+    assert recalculate_group_stats(db, "group1")
+
+    deleted_group = db.collection("groups").document("group1").get()
+    db.collection("groups").document("group1").delete()
+    match_snapshots = [doc for doc in db.collection("matches").stream()]
+    event = MagicMock()
+    event.params = {"groupId": "group1"}
+    event.data = deleted_group
+    on_group_deleted_cleanup_matches.__wrapped__(event)
+
+    db.reset_stats()
+    for match_doc in match_snapshots:
+        match_event = MagicMock()
+        match_event.data.before = match_doc
+        match_event.data.after = None
+        match_event.params = {"matchId": match_doc.id}
+        on_match_update.__wrapped__(match_event)
+
+    assert db.stats == {"reads": 3, "writes": 0, "deletes": 0}
+    assert is_group_deleted(db, "group1")
+    assert not [
+        path for path in db.dump() if path.startswith(("matches/", "statsQueue/"))
+    ]
+    assert recalculate_group_stats(db, "group1")
+    assert not db.collection("groupStats").document("group1").get().exists
+
+
+def add_matches(db, group_id, count):
+    for index in range(count):
+        match_data = make_match(index + 1, "alice", "bob", 10, index)
+        match_data["groupId"] = group_id
+        db.collection("matches").document(f"{group_id}-m{index}").set(match_data)
+
+
+def test_delete_group_matches_pages_through_keys():
+    """Test that matches are deleted page by page and other groups are kept"""
+    db = MemoryFirestore()
+    add_matches(db, "group1", 5)
+    add_matches(db, "group2", 2)
+    db.reset_stats()
+
+    pages = list(delete_group_matches(db, "group1", page_size=2))
+    assert pages == [(2, "group1-m1"), (2, "group1-m3"), (1, "group1-m4")]
+    # Three pages of keys; the last, short page ends the loop
+    assert db.stats == {"reads": 5, "writes": 0, "deletes": 5}
+    assert sorted(doc.id for doc in db.collection("matches").stream()) == [
+        "group2-m0",
+        "group2-m1",
+    ]
+
+
+def test_delete_group_matches_retries_contended_deletes():
+    """Test that deletes failing with contention are retried"""
+    db = MemoryFirestore()
+    add_matches(db, "group1", 3)
+    commit = db._commit
+    failed = []
+
+    def flaky_commit(writes, *args):
+        path = writes[0][1].path
+        if path not in failed:
+            failed.append(path)
+            raise exceptions.Aborted("Too much contention")
+        return commit(writes, *args)
+
+    with patch.object(db, "_commit", side_effect=flaky_commit):
+        assert list(delete_group_matches(db, "group1")) == [(3, "group1-m2")]
+
+    assert len(failed) == 3
+    assert not list(db.collection("matches").stream())
+
+
+def test_delete_group_matches_raises_when_deletes_keep_failing():
+    """Test that deletes still failing after every retry fail the cleanup"""
+    db = MemoryFirestore()
+    add_matches(db, "group1", 2)
+
+    with patch.object(db, "_commit", side_effect=exceptions.Aborted("Contention")):
+        with pytest.raises(RuntimeError, match="Failed to write 2 match deletes"):
+            list(delete_group_matches(db, "group1"))
+
+
+def seed_deleted_group(db):
+    """Store stats, checkpoints and a queue entry for a group, then delete it"""
+    add_matches(db, "group1", 5)
+    add_matches(db, "group2", 1)
+    stats_ref = db.collection("groupStats").document("group1")
+    stats_ref.set({"totalMatches": 5})
+    stats_ref.collection("players").document("alice").set({"wins": 5})
+    stats_ref.collection("checkpoints").document("c1").set({"matchCount": 5})
+    db.collection("statsQueue").document("group1").set({"dirty": True})
+    event = MagicMock()
+    event.params = {"groupId": "group1"}
+    return event
+
+
+@patch("firebase_admin.firestore.client")
+def test_cleanup_job_resumes_where_it_paused(mock_client):
+    """Test that a cleanup out of time saves its cursor and is continued"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    event = seed_deleted_group(db)
+
+    with (
+        patch("functions.match_cleanup.CLEANUP_PAGE_SIZE", 2),
+        patch("functions.match_cleanup.CLEANUP_TIME_BUDGET_SECONDS", 0),
+    ):
+        on_group_deleted_cleanup_matches.__wrapped__(event)
+        job = db.collection("cleanupJobs").document("group1").get().to_dict()
+        assert job["matchesDeleted"] == 2
+        assert job["lastMatchId"] == "group1-m1"
+        assert job["leaseUntil"] <= datetime.now(timezone.utc)
+
+        # A redelivered trigger takes the job over instead of restarting it
+        on_group_deleted_cleanup_matches.__wrapped__(event)
+        job = db.collection("cleanupJobs").document("group1").get().to_dict()
+        assert job["matchesDeleted"] == 4
+        assert job["runs"] == 2
+
+    db.reset_stats()
+    process_cleanup_jobs.__wrapped__(MagicMock())
+
+    # The last match, the stats with a player and a checkpoint, the queue
+    # entry and the job
+    assert db.stats["deletes"] == 1 + 3 + 1 + 1
+    assert sorted(db.dump()) == [
+        "deletedGroups/group1",
+        "matches/group2-m0",
+    ]
+
+
+@patch("firebase_admin.firestore.client")
+def test_cleanup_skips_a_job_another_invocation_holds(mock_client):
+    """Test that a trigger does not run a cleanup that is already leased"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    event = seed_deleted_group(db)
+    assert claim_cleanup_job(db, "group1") is not None
+
+    on_group_deleted_cleanup_matches.__wrapped__(event)
+    process_cleanup_jobs.__wrapped__(MagicMock())
+
+    assert len(list(db.collection("matches").stream())) == 6
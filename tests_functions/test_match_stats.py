@@ -0,0 +1,523 @@
+import copy
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firebase_admin import firestore
+from google.cloud.firestore_v1 import field_path
+
+from functions.group_tombstones import DELETED_GROUPS_COLLECTION
+from functions.match_participants import PARTICIPANT_UIDS_FIELD, get_participant_uids
+from functions.match_stats import (
+    apply_match_delta_to_stats,
+    on_group_update,
+    on_match_update,
+    recalculate_group_stats,
+)
+from functions.memory_firestore import MemoryFirestore
+from functions.stats_checkpoints import save_checkpoint, state_to_checkpoint
+from functions.stats_players import (
+    PLAYER_HASHES_FIELD,
+    PLAYERS_COLLECTION,
+    hash_player_stats,
+)
+from functions.stats_queue import FULL_REPLAY, STATS_QUEUE_COLLECTION
+
+DAY = 86400
+
+
+@pytest.fixture
+def group_data():
+    """Create mock group data with two members and two guests"""
+    return {
+        "adminUid": "alice",
+        "members": {
+            "alice": {"role": "admin", "name": "Alice"},
+            "bob": {"role": "editor", "name": "Bob"},
+        },
+        "guests": [{"id": "1", "name": "Carol"}, {"id": "2", "name": "Dave"}],
+        "teamColors": {"teamOne": "#ff0000", "teamTwo": "#0000ff"},
+    }
+
+
+def make_match(day, team1, team2, score1, score2, created=0):
+    winner = "draw"
+    if score1 > score2:
+        winner = "team1"
+    elif score2 > score1:
+        winner = "team2"
+    return {
+        "groupId": "test-group-id",
+        "gameType": "2v2" if len(team1) > 1 else "1v1",
+        "playedAt": {"seconds": 1_700_000_000 + day * DAY, "nanoseconds": 0},
+        "createdAt": {"seconds": 1_700_000_000 + day * DAY + created},
+        "team1": {
+            "color": "#ff0000",
+            "score": score1,
+            "players": [{"uid": uid, "displayName": uid} for uid in team1],
+        },
+        "team2": {
+            "color": "#0000ff",
+            "score": score2,
+            "players": [{"uid": uid, "displayName": uid} for uid in team2],
+        },
+        "winner": winner,
+    }
+
+
+class FakeMatchesQuery:
+    """Ordered, paginated stand-in for the matches query"""
+
+    def __init__(self, docs, page_size=None, start=0, streamed=None):
+        self.docs = sorted(docs, key=lambda doc: doc.played_at)
+        self.page_size = page_size
+        self.start = start
+        self.streamed = streamed if streamed is not None else []
+
+    def where(self, filter):
+        return self
+
+    def order_by(self, field_path):
+        assert field_path == "playedAt"
+        return self
+
+    def select(self, field_paths):
+        return self
+
+    def limit(self, count):
+        return FakeMatchesQuery(self.docs, count, self.start, self.streamed)
+
+    def start_after(self, cursor):
+        if isinstance(cursor, dict):
+            played_at = cursor["playedAt"]["seconds"]
+            start = len([doc for doc in self.docs if doc.played_at <= played_at])
+        else:
+            start = self.docs.index(cursor) + 1
+        return FakeMatchesQuery(self.docs, self.page_size, start, self.streamed)
+
+    def stream(self):
+        page = self.docs[self.start : self.start + self.page_size]
+        self.streamed.extend(page)
+        return page
+
+
+def apply_field_updates(doc, updates):
+    """Apply a Firestore field-path update to a copy of `doc`"""
+    doc = copy.deepcopy(doc)
+    for path, value in updates.items():
+        *parents, leaf = [name.strip("`") for name in field_path.split_field_path(path)]
+        target = doc
+        for name in parents:
+            target = target.setdefault(name, {})
+        if value is firestore.DELETE_FIELD:
+            target.pop(leaf, None)
+        else:
+            target[leaf] = value
+    return doc
+
+
+def run_full_recalculation(
+    group_data,
+    matches,
+    page_size=None,
+    replay_from=FULL_REPLAY,
+    streamed=None,
+    previous_summary=None,
+    written_players=None,
+):
+    """Run recalculate_group_stats against mocks and return the written doc
+
+    The summary and players/{playerId} docs are reassembled into one doc with
+    `playerStats`, the shape apply_match_delta_to_stats works on.
+    """
+    match_docs = []
+    for match_id, match_data in matches.items():
+        match_doc = MagicMock()
+        match_doc.id = match_id
+        match_doc.played_at = match_data["playedAt"]["seconds"]
+        match_doc.to_dict.return_value = copy.deepcopy(match_data)
+        match_docs.append(match_doc)
+
+    group_doc = MagicMock()
+    group_doc.exists = True
+    group_doc.to_dict.return_value = copy.deepcopy(group_data)
+
+    stats_ref = MagicMock()
+    stats_ref.get.return_value.exists = previous_summary is not None
+    stats_ref.get.return_value.to_dict.return_value = previous_summary
+    players_collection = MagicMock()
+    players_collection.document.side_effect = lambda player_id: MagicMock(id=player_id)
+    stats_ref.collection.side_effect = lambda name: {
+        PLAYERS_COLLECTION: players_collection
+    }.get(name, MagicMock())
+
+    groups_collection = MagicMock()
+    groups_collection.document.return_value.get.return_value = group_doc
+    deleted_groups_collection = MagicMock()
+    deleted_groups_collection.document.return_value.get.return_value.exists = False
+    matches_collection = FakeMatchesQuery(match_docs, streamed=streamed)
+
+    db = MagicMock()
+    db.collection.side_effect = lambda name: {
+        "groups": groups_collection,
+        "matches": matches_collection,
+        "groupStats": MagicMock(document=lambda doc_id: stats_ref),
+        DELETED_GROUPS_COLLECTION: deleted_groups_collection,
+    }[name]
+
+    with patch("functions.match_stats.STATS_PAGE_SIZE", page_size or 500):
+        assert recalculate_group_stats(db, "test-group-id", replay_from)
+
+    batch = db.batch.return_value
+    summaries = []
+    player_stats = {}
+    for (doc_ref, data), _kwargs in batch.set.call_args_list:
+        if doc_ref is stats_ref:
+            summaries.append(data)
+        else:
+            player_stats[doc_ref.id] = data
+    for (doc_ref, updates), _kwargs in batch.update.call_args_list:
+        assert doc_ref is stats_ref
+        summaries.append(apply_field_updates(previous_summary, updates))
+    if written_players is not None:
+        written_players.extend(player_stats)
+
+    assert len(summaries) == 1
+    stats_doc = dict(summaries[0])
+    stats_doc.pop("lastUpdated")
+    stats_doc.pop(PLAYER_HASHES_FIELD)
+    stats_doc["playerStats"] = player_stats
+    return stats_doc
+
+
+@pytest.fixture
+def history():
+    return {
+        "m1": make_match(0, ["alice", "bob"], ["guest_1", "guest_2"], 10, 5),
+        "m2": make_match(1, ["alice"], ["guest_1"], 3, 10),
+        "m3": make_match(1, ["alice", "guest_1"], ["bob", "guest_2"], 10, 8, 60),
+    }
+
+
+def test_delta_appends_new_match(group_data, history):
+    """Test that appending the newest match matches a full replay"""
+    stats = run_full_recalculation(group_data, history)
+    new_match = make_match(2, ["alice", "guest_2"], ["bob", "guest_1"], 10, 9)
+
+    assert apply_match_delta_to_stats(stats, "m4", None, copy.deepcopy(new_match))
+
+    expected = run_full_recalculation(group_data, {**history, "m4": new_match})
+    assert stats == expected
+
+
+def test_delta_updates_scores(group_data, history):
+    """Test that a score-only edit matches a full replay"""
+    stats = run_full_recalculation(group_data, history)
+    edited = copy.deepcopy(history["m1"])
+    edited["team1"]["score"] = 10
+    edited["team2"]["score"] = 9
+
+    assert apply_match_delta_to_stats(stats, "m1", history["m1"], edited)
+
+    expected = run_full_recalculation(group_data, {**history, "m1": edited})
+    assert stats == expected
+
+
+@pytest.mark.parametrize(
+    "change",
+    ["backdated_insert", "winner_flip", "date_change", "delete"],
+)
+def test_delta_falls_back_when_order_matters(group_data, history, change):
+    """Test that order-dependent changes are left to a full replay"""
+    stats = run_full_recalculation(group_data, history)
+    before, after = copy.deepcopy(history["m2"]), copy.deepcopy(history["m2"])
+
+    if change == "backdated_insert":
+        before, after = None, make_match(0, ["bob"], ["guest_2"], 10, 2)
+    elif change == "winner_flip":
+        after["team1"]["score"], after["winner"] = 10, "team1"
+    elif change == "date_change":
+        after["playedAt"] = {"seconds": 1_600_000_000, "nanoseconds": 0}
+    else:
+        after = None
+
+    untouched = copy.deepcopy(stats)
+    assert not apply_match_delta_to_stats(stats, "m2", before, after)
+    assert stats == untouched
+
+
+def test_delta_requires_replay_bookkeeping(group_data, history):
+    """Test that stats written before delta support force a replay"""
+    stats = run_full_recalculation(group_data, history)
+    del stats["replayWatermark"]
+    new_match = make_match(2, ["alice"], ["bob"], 10, 9)
+
+    assert not apply_match_delta_to_stats(stats, "m4", None, new_match)
+
+
+def test_replay_is_chronological_across_pages(group_data, history):
+    """Test that streaks follow playedAt/createdAt, not storage order or paging"""
+    shuffled = {key: history[key] for key in ("m3", "m1", "m2")}
+    expected = run_full_recalculation(group_data, history)
+
+    for page_size in (1, 2, 500):
+        assert run_full_recalculation(group_data, shuffled, page_size) == expected
+
+    assert expected["playerStats"]["alice"]["currentStreak"] == 1
+    assert expected["playerStats"]["guest_1"]["longestWinStreak"] == 2
+
+
+def test_replay_resumes_from_checkpoint(group_data, history):
+    """Test that a replay after a change only re-reads matches past a checkpoint"""
+    matches = dict(history)
+    for day in range(2, 8):
+        matches[f"d{day}"] = make_match(day, ["bob"], ["guest_2"], day % 3, 1)
+
+    checkpoints = []
+
+    def save(checkpoints_ref, state, roster, played_at):
+        checkpoint = state_to_checkpoint(state, roster, played_at)
+        checkpoints.append(copy.deepcopy(checkpoint))
+
+    def load(db, checkpoints_ref, roster, replay_from):
+        usable = [c for c in checkpoints if c["playedAtSeconds"] < replay_from]
+        return usable[-1] if usable else None
+
+    with (
+        patch("functions.match_stats.STATS_CHECKPOINT_INTERVAL", 3),
+        patch("functions.match_stats.save_checkpoint", side_effect=save),
+        patch("functions.match_stats.load_checkpoint", side_effect=load),
+    ):
+        run_full_recalculation(group_data, matches)
+        assert [c["matchCount"] for c in checkpoints] == [3, 6, 9]
+
+        matches["d6"] = make_match(6, ["bob"], ["guest_2"], 10, 0)
+        replay_from = matches["d6"]["playedAt"]["seconds"]
+        streamed = []
+        resumed = run_full_recalculation(
+            group_data, matches, replay_from=replay_from, streamed=streamed
+        )
+
+    assert [doc.id for doc in streamed] == ["d5", "d6", "d7"]
+    assert resumed == run_full_recalculation(group_data, matches)
+
+
+def test_recalculation_only_writes_changed_players(group_data, history):
+    """Test that player docs are skipped when their stats did not change"""
+    summaries = []
+
+    def capture_summary(group_data, matches, previous_summary=None):
+        written_players = []
+        stats = run_full_recalculation(
+            group_data,
+            matches,
+            previous_summary=previous_summary,
+            written_players=written_players,
+        )
+        summaries.append(
+            {
+                **{key: value for key, value in stats.items() if key != "playerStats"},
+                PLAYER_HASHES_FIELD: {
+                    player_id: hash_player_stats(player_stats)
+                    for player_id, player_stats in stats["playerStats"].items()
+                },
+            }
+        )
+        return written_players
+
+    assert capture_summary(group_data, history) == [
+        "alice",
+        "bob",
+        "guest_1",
+        "guest_2",
+    ]
+
+    new_match = make_match(2, ["alice"], ["guest_1"], 10, 2)
+    written = capture_summary(
+        group_data, {**history, "m4": new_match}, previous_summary=summaries[-1]
+    )
+
+    assert written == ["alice", "guest_1"]
+
+
+def memory_match(day, team1, team2, score1, score2):
+    """make_match with the timestamps Firestore stores"""
+    match_data = make_match(day, team1, team2, score1, score2)
+    for field in ("playedAt", "createdAt"):
+        seconds = match_data[field]["seconds"]
+        match_data[field] = datetime.fromtimestamp(seconds, timezone.utc)
+    match_data[PARTICIPANT_UIDS_FIELD] = get_participant_uids(match_data)
+    return match_data
+
+
+def write_and_trigger(db, trigger, path, data, params):
+    """Write (or with None, delete) a document and deliver the written event"""
+    doc_ref = db.document(path)
+    event = MagicMock()
+    event.params = params
+    event.data.before = doc_ref.get()
+    if data is None:
+        doc_ref.delete()
+    else:
+        doc_ref.set(data)
+    event.data.after = doc_ref.get()
+    trigger.__wrapped__(event)
+
+
+def write_match(db, match_id, match_data):
+    write_and_trigger(
+        db, on_match_update, f"matches/{match_id}", match_data, {"matchId": match_id}
+    )
+
+
+def write_group(db, group_data):
+    write_and_trigger(
+        db,
+        on_group_update,
+        "groups/test-group-id",
+        group_data,
+        {"groupId": "test-group-id"},
+    )
+
+
+def run_stats_queue(db):
+    """Run the recompute the triggers queued, if any"""
+    queue_ref = db.collection(STATS_QUEUE_COLLECTION).document("test-group-id")
+    queue_doc = queue_ref.get()
+    if not queue_doc.exists or not queue_doc.to_dict().get("dirty"):
+        return
+    replay_from = queue_doc.to_dict().get("replayFrom", FULL_REPLAY)
+    assert recalculate_group_stats(db, "test-group-id", replay_from)
+    queue_ref.update({"dirty": False, "replayFrom": firestore.DELETE_FIELD})
+
+
+def get_player_docs(db):
+    prefix = f"groupStats/test-group-id/{PLAYERS_COLLECTION}/"
+    return {
+        path[len(prefix) :]: data
+        for path, data in db.dump().items()
+        if path.startswith(prefix)
+    }
+
+
+def replay_player_docs(db):
+    """The player docs a full replay of the group and its matches writes"""
+    replayed = MemoryFirestore()
+    for path, data in db.dump().items():
+        if path.startswith(("groups/", "matches/")):
+            replayed.document(path).set(data)
+    assert recalculate_group_stats(replayed, "test-group-id")
+    return get_player_docs(replayed)
+
+
+def get_summary_doc(db):
+    summary = db.document("groupStats/test-group-id").get().to_dict()
+    summary.pop("lastUpdated")
+    return summary
+
+
+@patch("firebase_admin.firestore.client")
+def test_consecutive_appends_match_a_replay(mock_client, group_data):
+    """Test that appended matches update the quoted map keys of the summary"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    db.document("groups/test-group-id").set(group_data)
+    db.document("matches/m1").set(memory_match(1, ["alice"], ["bob"], 10, 1))
+    assert recalculate_group_stats(db, "test-group-id")
+
+    write_match(db, "m2", memory_match(2, ["alice"], ["bob"], 10, 2))
+    write_match(db, "m3", memory_match(3, ["bob"], ["alice"], 10, 3))
+    assert not db.document(f"{STATS_QUEUE_COLLECTION}/test-group-id").get().exists
+
+    summary = get_summary_doc(db)
+    assert get_player_docs(db) == replay_player_docs(db)
+    assert recalculate_group_stats(db, "test-group-id")
+    assert summary == get_summary_doc(db)
+
+
+@patch("firebase_admin.firestore.client")
+def test_score_edit_invalidates_later_checkpoints(mock_client, group_data):
+    """Test that a replay after an applied edit does not resume from a
+    checkpoint that still holds the old score"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    db.document("groups/test-group-id").set(group_data)
+    for day in (1, 2, 3, 4, 6, 7):
+        db.document(f"matches/m{day}").set(
+            memory_match(day, ["alice"], ["bob"], 10, day)
+        )
+    with patch("functions.match_stats.STATS_CHECKPOINT_INTERVAL", 2):
+        assert recalculate_group_stats(db, "test-group-id")
+        checkpoints = db.collection("groupStats/test-group-id/checkpoints")
+        assert len(list(checkpoints.stream())) == 3
+
+        write_match(db, "m3", memory_match(3, ["alice"], ["bob"], 10, 8))
+        assert not db.document(f"{STATS_QUEUE_COLLECTION}/test-group-id").get().exists
+        # Only the checkpoint taken before day 3 is left
+        assert len(list(checkpoints.stream())) == 1
+        write_match(db, "m5", memory_match(5, ["alice"], ["bob"], 10, 0))
+        run_stats_queue(db)
+
+    assert get_player_docs(db) == replay_player_docs(db)
+
+
+@patch("firebase_admin.firestore.client")
+def test_match_appended_at_a_checkpoint_time_is_replayed(mock_client, group_data):
+    """Test that a replay does not resume from a checkpoint taken at the time
+    of a match appended since, which it would skip"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    db.document("groups/test-group-id").set(group_data)
+    for day in range(1, 5):
+        db.document(f"matches/m{day}").set(
+            memory_match(day, ["alice"], ["bob"], 10, day)
+        )
+    with patch("functions.match_stats.STATS_CHECKPOINT_INTERVAL", 2):
+        assert recalculate_group_stats(db, "test-group-id")
+        checkpoints = db.collection("groupStats/test-group-id/checkpoints")
+        assert len(list(checkpoints.stream())) == 2
+
+        write_match(db, "m4b", memory_match(4, ["alice"], ["bob"], 10, 0))
+        assert len(list(checkpoints.stream())) == 1
+        write_match(db, "m6", memory_match(6, ["alice"], ["bob"], 10, 0))
+        write_match(db, "m6", memory_match(6, ["alice"], ["bob"], 0, 10))
+        run_stats_queue(db)
+
+    assert get_player_docs(db)["alice"]["totalMatches"] == 6
+    assert get_player_docs(db) == replay_player_docs(db)
+
+
+@patch("firebase_admin.firestore.client")
+def test_oversized_checkpoints_are_skipped(mock_client, group_data):
+    """Test that a checkpoint over the document limit does not fail the replay"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    db.document("groups/test-group-id").set(group_data)
+    for day in range(1, 5):
+        db.document(f"matches/m{day}").set(
+            memory_match(day, ["alice"], ["bob"], 10, day)
+        )
+
+    with (
+        patch("functions.match_stats.STATS_CHECKPOINT_INTERVAL", 2),
+        patch("stats_checkpoints.MAX_CHECKPOINT_BYTES", 100),
+    ):
+        assert recalculate_group_stats(db, "test-group-id")
+
+    assert not list(db.collection("groupStats/test-group-id/checkpoints").stream())
+    assert get_player_docs(db)["alice"]["wins"] == 4
+
+
+def test_failed_checkpoint_write_is_skipped():
+    """Test that save_checkpoint reports rather than raises a failed write"""
+    checkpoints_ref = MagicMock()
+    checkpoints_ref.document.return_value.set.side_effect = ValueError("too big")
+    state = {
+        "player_stats": MagicMock(to_dicts=lambda: {}),
+        "team_color_stats": {},
+        "general_stats": {"totalMatches": 2},
+        "matches_per_day": {},
+        "watermark": None,
+    }
+
+    assert save_checkpoint(checkpoints_ref, state, "roster", None) is False
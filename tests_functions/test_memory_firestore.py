@@ -0,0 +1,242 @@
+import threading
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firebase_admin import firestore
+from google.api_core import exceptions
+
+from functions.data_access import get_db, set_db
+from functions.join_group import join_group_with_code
+from functions.match_stats import on_match_update, recalculate_group_stats
+from functions.memory_firestore import MemoryFirestore
+
+
+def make_match(day, player1, player2, score1, score2):
+    return {
+        "groupId": "group1",
+        "gameType": "1v1",
+        "playedAt": datetime(2024, 1, day, 12, tzinfo=timezone.utc),
+        "createdAt": datetime(2024, 1, day, 13, tzinfo=timezone.utc),
+        "team1": {
+            "color": "#ff0000",
+            "score": score1,
+            "players": [{"uid": player1, "displayName": player1}],
+        },
+        "team2": {
+            "color": "#0000ff",
+            "score": score2,
+            "players": [{"uid": player2, "displayName": player2}],
+        },
+        "winner": "team1" if score1 > score2 else "team2",
+    }
+
+
+@pytest.fixture
+def db():
+    return MemoryFirestore(clock=lambda: datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+
+@pytest.fixture
+def group_data():
+    """Create group data with two members and a guest"""
+    return {
+        "name": "Test Group",
+        "adminUid": "alice",
+        "inviteCode": "ABCD1234",
+        "members": {
+            "alice": {"role": "admin", "name": "Alice"},
+            "bob": {"role": "editor", "name": "Bob"},
+        },
+        "guests": [{"id": "1", "name": "Dan"}],
+        "teamColors": {"teamOne": "#ff0000", "teamTwo": "#0000ff"},
+    }
+
+
+def test_queries_filter_order_and_page_with_cursors(db):
+    """Test where, order_by, select, limit and cursors like Firestore"""
+    scores = db.collection("scores")
+    for index, (group_id, points) in enumerate(
+        [("a", 3), ("b", 1), ("a", 1), ("a", 2), ("a", None)]
+    ):
+        scores.document(f"s{index}").set({"groupId": group_id, "points": points})
+    scores.document("s5").set({"groupId": "a"})
+
+    query = (
+        scores.where(filter=firestore.FieldFilter("groupId", "==", "a"))
+        .order_by("points")
+        .select(["points"])
+        .limit(2)
+    )
+    first = query.get()
+    second = query.start_after(first[-1]).get()
+
+    assert [doc.id for doc in first] == ["s4", "s2"]
+    assert [doc.id for doc in second] == ["s3", "s0"]
+    assert first[1].to_dict() == {"points": 1}
+    assert [doc.id for doc in query.start_after({"points": 1}).get()] == ["s3", "s0"]
+    descending = scores.order_by("points", direction=firestore.Query.DESCENDING)
+    assert [doc.id for doc in descending.limit(2).stream()] == ["s0", "s3"]
+    assert [
+        doc.id
+        for doc in scores.where(filter=firestore.FieldFilter("points", ">=", 2)).get()
+    ] == ["s3", "s0"]
+
+
+def test_updates_apply_field_paths_transforms_and_sentinels(db):
+    """Test that update resolves dotted paths, transforms and sentinels"""
+    doc_ref = db.collection("groups").document("g1")
+    doc_ref.set({"count": 1, "members": {"alice": {"role": "admin"}}, "low": 5})
+    doc_ref.update(
+        {
+            "count": firestore.Increment(2),
+            "members.bob": {"role": "viewer"},
+            "members.alice": firestore.DELETE_FIELD,
+            "low": firestore.Minimum(3),
+            "updated": firestore.SERVER_TIMESTAMP,
+        }
+    )
+
+    assert doc_ref.get().to_dict() == {
+        "count": 3,
+        "members": {"bob": {"role": "viewer"}},
+        "low": 3,
+        "updated": datetime(2024, 1, 1, tzinfo=timezone.utc),
+    }
+    with pytest.raises(exceptions.NotFound):
+        db.collection("groups").document("missing").update({"count": 1})
+
+
+def test_updates_unquote_backtick_field_paths(db):
+    """Test that quoted segments of a field path name the unquoted key"""
+    doc_ref = db.collection("groupStats").document("g1")
+    doc_ref.set({"teamColorStats": {"#ff0000": {"wins": 1}}})
+    doc_ref.update(
+        {
+            "teamColorStats.`#ff0000`.wins": firestore.Increment(1),
+            "matchesByGameType.`1v1`": 1,
+        }
+    )
+
+    data = doc_ref.get().to_dict()
+    assert data["teamColorStats"] == {"#ff0000": {"wins": 2}}
+    assert data["matchesByGameType"] == {"1v1": 1}
+    assert doc_ref.get(["teamColorStats.`#ff0000`"]).to_dict() == {
+        "teamColorStats": {"#ff0000": {"wins": 2}}
+    }
+
+
+def test_batch_is_atomic_and_counts_operations(db):
+    """Test that a failing batch writes nothing and that operations are counted"""
+    db.collection("groups").document("g1").set({"name": "One"})
+    db.reset_stats()
+
+    batch = db.batch()
+    batch.set(db.collection("groups").document("g2"), {"name": "Two"})
+    batch.update(db.collection("groups").document("missing"), {"name": "None"})
+    with pytest.raises(exceptions.NotFound):
+        batch.commit()
+
+    assert not db.collection("groups").document("g2").get().exists
+    batch = db.batch()
+    batch.delete(db.collection("groups").document("g1"))
+    batch.set(db.collection("groups").document("g2"), {"name": "Two"})
+    batch.commit()
+    list(db.collection("empty").stream())
+
+    assert db.stats == {"reads": 2, "writes": 1, "deletes": 1}
+
+
+def test_transactions_retry_when_a_read_document_changes(db):
+    """Test that the real transactional decorator retries on contention"""
+    counter_ref = db.collection("counters").document("c")
+    counter_ref.set({"value": 0})
+    attempts = []
+
+    @firestore.transactional
+    def increment(transaction):
+        value = counter_ref.get(transaction=transaction).to_dict()["value"]
+        if not attempts:
+            counter_ref.set({"value": 10})
+        attempts.append(value)
+        transaction.update(counter_ref, {"value": value + 1})
+
+    increment(db.transaction())
+
+    assert attempts == [0, 10]
+    assert counter_ref.get().to_dict() == {"value": 11}
+
+
+def test_concurrent_transactions_do_not_lose_updates(db):
+    """Test that threads incrementing through transactions all land"""
+    counter_ref = db.collection("counters").document("c")
+    counter_ref.set({"value": 0})
+
+    @firestore.transactional
+    def increment(transaction):
+        value = counter_ref.get(transaction=transaction).to_dict()["value"]
+        transaction.update(counter_ref, {"value": value + 1})
+
+    def worker():
+        for _ in range(20):
+            increment(db.transaction(max_attempts=100))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter_ref.get().to_dict() == {"value": 80}
+
+
+def test_get_db_uses_the_configured_client(db):
+    """Test that get_db returns the client set with set_db"""
+    set_db(db)
+    try:
+        assert get_db() is db
+    finally:
+        set_db(None)
+
+    with patch("firebase_admin.firestore.client") as mock_client:
+        assert get_db() is mock_client.return_value
+
+
+@patch("firebase_admin.firestore.client")
+def test_functions_run_against_memory_firestore(mock_client, db, group_data):
+    """Test that match triggers and callables work end to end in memory"""
+    mock_client.return_value = db
+    db.collection("groups").document("group1").set(group_data)
+    db.collection("matches").document("m1").set(make_match(1, "alice", "bob", 10, 5))
+    db.collection("matches").document("m2").set(make_match(2, "bob", "guest_1", 8, 10))
+    assert recalculate_group_stats(db, "group1")
+
+    match_id = "m3"
+    match_ref = db.collection("matches").document(match_id)
+    match_ref.set(make_match(3, "guest_1", "alice", 10, 2))
+    event = MagicMock()
+    event.data.before = None
+    event.data.after = match_ref.get()
+    event.params = {"matchId": match_id}
+    on_match_update.__wrapped__(event)
+
+    replayed = MemoryFirestore()
+    for path, data in db.dump().items():
+        if path.startswith(("groups/", "matches/")):
+            replayed.document(path).set(data)
+    assert recalculate_group_stats(replayed, "group1")
+    players = "groupStats/group1/players/"
+    assert {
+        path: data for path, data in db.dump().items() if path.startswith(players)
+    } == {
+        path: data for path, data in replayed.dump().items() if path.startswith(players)
+    }
+
+    auth = MagicMock()
+    auth.uid = "carol"
+    auth.token = {"name": "Carol"}
+    result = join_group_with_code({"inviteCode": "abcd1234"}, auth)
+
+    assert result["groupId"] == "group1"
+    members = db.collection("groups").document("group1").get().to_dict()["members"]
+    assert members["carol"] == {"name": "Carol", "role": "viewer"}
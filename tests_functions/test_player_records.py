@@ -0,0 +1,32 @@
+from functions.match_utils import create_player_stats_object
+from functions.player_records import PlayerTable
+
+
+def test_round_trip_preserves_player_stats():
+    """Test that records serialize back to the stored playerStats schema"""
+    alice = create_player_stats_object(display_name="Alice", is_guest=False)
+    alice.update(totalMatches=3, wins=2, losses=1, currentStreak=-1, winRate=66.67)
+    alice["teamPartners"] = {
+        "left-member": {"displayName": "Zed", "matches": 2, "wins": 1, "winRate": 50.0},
+        "guest_1": {"displayName": "Carol", "matches": 1, "wins": 1, "winRate": 100.0},
+    }
+    player_stats = {
+        "alice": alice,
+        "guest_1": create_player_stats_object(display_name="Carol", is_guest=True),
+    }
+
+    table = PlayerTable.from_dicts(player_stats)
+
+    assert table.to_dicts() == player_stats
+    assert list(table) == ["alice", "guest_1"]
+
+
+def test_partners_outside_the_group_have_no_record():
+    """Test that interned teammates without stats are not treated as players"""
+    table = PlayerTable()
+    table.intern("left-member")
+
+    assert "left-member" not in table
+    assert table.get("left-member") is None
+    assert table.get("unknown") is None
+    assert table.to_dicts() == {}
@@ -0,0 +1,191 @@
+import marshal
+from unittest.mock import MagicMock, patch
+
+import pytest
+from cloudevents.http import CloudEvent
+from firebase_functions import firestore_fn
+from flask import Request
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore_v1
+from google.events.cloud.firestore import (
+    Document,
+    DocumentEventData,
+    MapValue,
+    Value,
+)
+
+from functions import profiling
+from functions.match_stats import on_group_update
+from functions.memory_firestore import MemoryFirestore
+
+
+@pytest.fixture(autouse=True)
+def reset_profiles():
+    profiling.reset_profiles_taken()
+    yield
+    profiling.reset_profiles_taken()
+
+
+def to_value(value):
+    if isinstance(value, dict):
+        fields = {key: to_value(item) for key, item in value.items()}
+        return Value(map_value=MapValue(fields=fields))
+    return Value(string_value=value)
+
+
+def make_cloud_event(document, before, after):
+    """Create the raw Firestore written event a deployed trigger receives"""
+    name = f"projects/test/databases/(default)/documents/{document}"
+    data = DocumentEventData(
+        value=Document(name=name, fields=to_value(after).map_value.fields),
+        old_value=Document(name=name, fields=to_value(before).map_value.fields),
+    )
+    attributes = {
+        "type": "google.cloud.firestore.document.v1.written",
+        "source": "//firestore.googleapis.com/projects/test/databases/(default)",
+        "subject": f"documents/{document}",
+        "datacontenttype": "application/protobuf",
+        "location": "nam5",
+        "project": "test",
+        "namespace": "(default)",
+        "database": "(default)",
+        "document": document,
+        "time": "2026-01-01T00:00:00Z",
+    }
+    return CloudEvent(attributes, DocumentEventData.serialize(data))
+
+
+def make_event(group_id):
+    """Create a group update event that only changes a member's role"""
+    return make_cloud_event(
+        f"groups/{group_id}",
+        {"members": {"alice": {"name": "Alice", "role": "viewer"}}},
+        {"members": {"alice": {"name": "Alice", "role": "editor"}}},
+    )
+
+
+@pytest.fixture
+def event_client():
+    """The client firebase_functions decodes events with, without credentials"""
+    client = firestore_v1.Client(project="test", credentials=AnonymousCredentials())
+    with patch.object(firestore_fn._firestore_v1, "Client", return_value=client):
+        yield client
+
+
+def test_profiling_disabled_returns_function_unchanged():
+    """Test that functions not selected for profiling are not wrapped"""
+    with patch.object(profiling, "PROFILE_FUNCTIONS", frozenset()):
+        assert profiling.profiled(on_group_update) is on_group_update
+
+
+@patch("firebase_admin.firestore.client")
+def test_profiles_next_invocations_for_allowed_groups(
+    mock_client, event_client, tmp_path
+):
+    """Test that only allowlisted groups of the deployed trigger are profiled,
+    up to the budget"""
+    mock_client.return_value = MemoryFirestore()
+    with (
+        patch.object(profiling, "PROFILE_FUNCTIONS", frozenset(["on_group_update"])),
+        patch.object(profiling, "PROFILE_GROUPS", frozenset(["hot-group"])),
+        patch.object(profiling, "PROFILE_INVOCATIONS", 2),
+        patch.object(profiling, "PROFILE_SINK", str(tmp_path)),
+    ):
+        trigger = profiling.profiled(on_group_update)
+        for group_id in ["other-group", "hot-group", "hot-group", "hot-group"]:
+            trigger(make_event(group_id))
+
+    profiles = sorted((tmp_path / "on_group_update").iterdir())
+    assert sorted(path.suffix for path in profiles) == [
+        ".prof",
+        ".prof",
+        ".txt",
+        ".txt",
+    ]
+    assert all("hot-group" in path.name for path in profiles)
+    stats = marshal.loads(profiles[0].with_suffix(".prof").read_bytes())
+    assert any(name == "on_group_update" for _file, _line, name in stats)
+    report = profiles[0].with_suffix(".txt").read_text()
+    assert '"groupId": "hot-group"' in report
+    assert "allocation sites" in report
+
+
+def test_profiled_function_errors_still_propagate(tmp_path):
+    """Test that profiling does not swallow exceptions"""
+
+    def failing():
+        raise RuntimeError("boom")
+
+    with (
+        patch.object(profiling, "PROFILE_FUNCTIONS", frozenset(["*"])),
+        patch.object(profiling, "PROFILE_SINK", str(tmp_path)),
+    ):
+        with pytest.raises(RuntimeError):
+            profiling.profiled(failing)()
+
+    assert len(list((tmp_path / "failing").iterdir())) == 2
+
+
+def test_invocation_runs_unprofiled_when_the_profiler_cannot_start(tmp_path):
+    """Test that a profiler already active elsewhere does not fail the call"""
+    profiler = MagicMock()
+    profiler.enable.side_effect = ValueError("Another profiling tool is active")
+    with (
+        patch.object(profiling, "PROFILE_FUNCTIONS", frozenset(["*"])),
+        patch.object(profiling, "PROFILE_SINK", str(tmp_path)),
+        patch.object(profiling.cProfile, "Profile", return_value=profiler),
+    ):
+        assert profiling.profiled(lambda: 42)() == 42
+
+    assert not profiling.tracemalloc.is_tracing()
+    assert list(tmp_path.iterdir()) == []
+    assert profiling._take_budget("<lambda>") == 1
+
+
+def test_only_one_invocation_is_profiled_at_a_time(tmp_path):
+    """Test that an invocation overlapping a profiled one is not profiled"""
+    with (
+        patch.object(profiling, "PROFILE_FUNCTIONS", frozenset(["*"])),
+        patch.object(profiling, "PROFILE_SINK", str(tmp_path)),
+    ):
+        inner = profiling.profiled(lambda: profiling.tracemalloc.is_tracing())
+
+        def outer():
+            return inner()
+
+        assert profiling.profiled(outer)() is True
+
+    assert not profiling.tracemalloc.is_tracing()
+    assert [path.name for path in tmp_path.iterdir()] == ["outer"]
+
+
+def test_other_groups_are_not_profiled(event_client):
+    """Test that the group is checked before the profiler is created"""
+    with (
+        patch.object(profiling, "PROFILE_FUNCTIONS", frozenset(["on_group_update"])),
+        patch.object(profiling, "PROFILE_GROUPS", frozenset(["hot-group"])),
+        patch.object(profiling.cProfile, "Profile") as profile,
+    ):
+        trigger = profiling.profiled(MagicMock(__name__="on_group_update"))
+        trigger(make_event("other-group"))
+        trigger(Request.from_values(json={"data": {"inviteCode": "AAAA2222"}}))
+
+    profile.assert_not_called()
+
+
+def test_group_is_found_in_deployed_requests():
+    """Test the group of raw match events and callable requests"""
+    match = {"groupId": "hot-group", "team1": {"color": "#ff0000"}}
+    assert (
+        profiling.get_request_group_id((make_cloud_event("matches/m1", match, match),))
+        == "hot-group"
+    )
+    deleted = make_cloud_event("matches/m1", match, {})
+    assert profiling.get_request_group_id((deleted,)) == "hot-group"
+
+    request = Request.from_values(
+        method="POST", json={"data": {"groupId": "hot-group", "guestId": "123"}}
+    )
+    assert profiling.get_request_group_id((request,)) == "hot-group"
+    request = Request.from_values(method="POST", data="not json")
+    assert profiling.get_request_group_id((request,)) is None
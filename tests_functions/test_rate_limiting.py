@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firebase_functions import https_fn
+
+from functions.guest_migration import migrate_guest_to_member
+from functions.join_group import join_group_with_code
+from functions.memory_firestore import MemoryFirestore
+from functions.rate_limiter import RateLimit, RateLimitExceeded, acquire
+from functions.rate_limiting import (
+    GROUP_LIMIT,
+    JOIN_BURST,
+    MIGRATION_BURST,
+    on_group_created,
+    on_group_deleted,
+    on_match_created,
+)
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = START
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def db(clock):
+    db = MemoryFirestore(clock=clock)
+    db.collection("groups").document("g1").set(
+        {
+            "name": "One",
+            "adminUid": "adminuid",
+            "inviteCode": "AAAA2222",
+            "members": {"adminuid": {"name": "Admin", "role": "admin"}},
+            "guests": [{"id": "123", "name": "Guest"}],
+        }
+    )
+    db.collection("inviteCodes").document("AAAA2222").set({"groupId": "g1"})
+    return db
+
+
+def make_auth(uid):
+    auth = MagicMock()
+    auth.uid = uid
+    auth.token = {"name": uid}
+    return auth
+
+
+def create(db, collection, doc_id, data, trigger, param):
+    """Create a document as the client does, then deliver the trigger event.
+
+    Returns the created snapshot if the trigger kept the document, else None.
+    """
+    doc_ref = db.collection(collection).document(doc_id)
+    doc_ref.set(data)
+    event = MagicMock()
+    event.params = {param: doc_id}
+    event.data = doc_ref.get()
+    trigger.__wrapped__(event)
+    return event.data if doc_ref.get().exists else None
+
+
+def create_match(db, match_id):
+    return create(
+        db, "matches", match_id, {"createdBy": "u1"}, on_match_created, "matchId"
+    )
+
+
+def create_group(db, group_id):
+    """Create a group; a group the trigger deleted also gets its delete event"""
+    snapshot = create(
+        db, "groups", group_id, {"adminUid": "u1"}, on_group_created, "groupId"
+    )
+    if snapshot is None:
+        event = MagicMock()
+        event.data = MagicMock()
+        event.data.to_dict.return_value = {"adminUid": "u1"}
+        on_group_deleted.__wrapped__(event)
+    return snapshot is not None
+
+
+def group_count(db):
+    return db.collection("ratelimits").document("u1").get().to_dict()["groupCount"]
+
+
+def test_bucket_allows_a_burst_then_one_request_per_period(db, clock):
+    """Test the token bucket on its own"""
+    limit = RateLimit("test", "ratelimits", capacity=2, period_seconds=10)
+    acquire(db, limit, "u1", now=clock.now)
+    acquire(db, limit, "u1", now=clock.now)
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        acquire(db, limit, "u1", now=clock.now)
+    assert excinfo.value.retry_after_seconds == 10
+
+    acquire(db, limit, "u1", now=clock.now + timedelta(seconds=10))
+    with pytest.raises(RateLimitExceeded):
+        acquire(db, limit, "u1", now=clock.now + timedelta(seconds=15))
+    # Other users have their own buckets
+    acquire(db, limit, "u2", now=clock.now)
+
+
+@patch("firebase_admin.firestore.client")
+def test_matches_over_the_limit_are_deleted(mock_client, db, clock):
+    """Test that a third match within 10 seconds is deleted again"""
+    mock_client.return_value = db
+
+    assert create_match(db, "m1")
+    assert create_match(db, "m2")
+    assert create_match(db, "m3") is None
+
+    clock.now += timedelta(seconds=10)
+    assert create_match(db, "m4")
+    limit_doc = db.collection("matchRatelimits").document("u1").get().to_dict()
+    assert limit_doc["lastMatchCreation"] == clock.now
+
+
+@patch("firebase_admin.firestore.client")
+def test_group_cooldown_keeps_the_group_count(mock_client, db, clock):
+    """Test that a group created within a minute of another is deleted and
+    not counted"""
+    mock_client.return_value = db
+
+    assert create_group(db, "n1")
+    assert not create_group(db, "n2")
+    assert group_count(db) == 1
+
+    clock.now += timedelta(seconds=60)
+    assert create_group(db, "n3")
+    assert group_count(db) == 2
+
+
+@patch("firebase_admin.firestore.client")
+def test_groups_over_the_group_limit_are_deleted(mock_client, db):
+    """Test that GROUP_LIMIT is enforced by the created trigger"""
+    mock_client.return_value = db
+    db.collection("ratelimits").document("u1").set({"groupCount": GROUP_LIMIT})
+
+    assert not create_group(db, "n1")
+
+    assert group_count(db) == GROUP_LIMIT
+
+
+@patch("firebase_admin.firestore.client")
+def test_join_flood_is_rejected_without_reads(mock_client, db):
+    """Test that a warm instance turns a flood away in memory"""
+    mock_client.return_value = db
+    for _ in range(JOIN_BURST):
+        join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("flooder"))
+
+    with pytest.raises(https_fn.HttpsError) as excinfo:
+        join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("flooder"))
+    assert excinfo.value.code == https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED
+
+    db.reset_stats()
+    with pytest.raises(https_fn.HttpsError):
+        join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("flooder"))
+    assert db.stats == {"reads": 0, "writes": 0, "deletes": 0}
+
+    # The limit is per user
+    join_group_with_code({"inviteCode": "AAAA2222"}, make_auth("other"))
+
+
+@patch("firebase_admin.firestore.client")
+def test_migrations_are_rate_limited(mock_client, db):
+    """Test that an admin cannot queue migration jobs without limit"""
+    mock_client.return_value = db
+    db.collection("groups").document("g1").update(
+        {"members.memberuid": {"name": "Member", "role": "viewer"}}
+    )
+    data = {"groupId": "g1", "guestId": "123", "memberId": "memberuid"}
+    for _ in range(MIGRATION_BURST):
+        migrate_guest_to_member(data, make_auth("adminuid"))
+
+    with pytest.raises(https_fn.HttpsError) as excinfo:
+        migrate_guest_to_member(data, make_auth("adminuid"))
+
+    assert excinfo.value.code == https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED
+    assert len(list(db.collection("migrationJobs").stream())) == MIGRATION_BURST
@@ -0,0 +1,164 @@
+import copy
+import itertools
+import random
+
+import pytest
+
+from functions.match_stats import (
+    build_stats_doc,
+    create_stats_state,
+    fold_runs_sequentially,
+)
+from functions.stats_aggregate import (
+    chunk_runs,
+    fold_chunk,
+    fold_runs_in_parallel,
+    merge_partials,
+    partial_to_state,
+    state_to_partial,
+)
+
+PLAYERS = ["alice", "bob", "carol", "guest_1", "guest_2", "guest_3"]
+
+
+@pytest.fixture
+def group_data():
+    """Create mock group data with three members and three guests"""
+    return {
+        "members": {
+            "alice": {"role": "admin", "name": "Alice"},
+            "bob": {"role": "editor", "name": "Bob"},
+            "carol": {"role": "viewer", "name": "Carol"},
+        },
+        "guests": [
+            {"id": "1", "name": "Dan"},
+            {"id": "2", "name": "Eve"},
+            {"id": "3", "name": "Fay"},
+        ],
+        "teamColors": {"teamOne": "#ff0000", "teamTwo": "#0000ff"},
+    }
+
+
+def random_runs(seed, count):
+    """Build playedAt runs of random matches, several per day"""
+    rng = random.Random(seed)
+    matches = []
+    for index in range(count):
+        size = rng.choice([1, 2])
+        picked = rng.sample(PLAYERS + ["left-member"], size * 2)
+        players = [{"uid": uid, "displayName": uid} for uid in picked]
+        team1, team2 = players[:size], players[size:]
+        if rng.random() < 0.3:
+            team1 = {str(i): player for i, player in enumerate(team1)}
+        score1, score2 = rng.randint(0, 10), rng.randint(0, 10)
+        winner = "draw"
+        if score1 != score2:
+            winner = "team1" if score1 > score2 else "team2"
+        day = index // 3
+        matches.append(
+            (
+                f"m{index:04d}",
+                {
+                    "gameType": f"{size}v{size}",
+                    "playedAt": {"seconds": 1_700_000_000 + day * 86400},
+                    "createdAt": {"seconds": 1_700_000_000 + index},
+                    "team1": {
+                        "color": rng.choice(["#ff0000", "#00ff00"]),
+                        "score": score1,
+                        "players": team1,
+                    },
+                    "team2": {"color": "#0000ff", "score": score2, "players": team2},
+                    "winner": winner,
+                },
+            )
+        )
+
+    return [
+        (key, list(run))
+        for key, run in itertools.groupby(
+            matches, key=lambda match: match[1]["playedAt"]["seconds"]
+        )
+    ]
+
+
+def sequential_doc(group_data, runs):
+    state = create_stats_state(group_data)
+    for _state, _played_at in fold_runs_sequentially(state, copy.deepcopy(runs)):
+        pass
+    return build_stats_doc("test-group-id", state)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size", [1, 4, 17, 1000])
+def test_merged_chunks_match_sequential_fold(group_data, seed, chunk_size):
+    """Test that merging chunk partials reproduces the sequential output"""
+    runs = random_runs(seed, 120)
+    initial = create_stats_state(group_data)
+
+    partial = state_to_partial(initial)
+    for _played_at, chunk in chunk_runs(copy.deepcopy(runs), chunk_size):
+        partial = merge_partials(partial, fold_chunk(frozenset(PLAYERS), chunk))
+
+    merged = build_stats_doc("test-group-id", partial_to_state(partial, initial))
+    assert merged == sequential_doc(group_data, runs)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_is_associative(group_data, seed):
+    """Test that chunk partials can be reduced in any grouping"""
+    runs = random_runs(seed, 60)
+    chunks = [
+        fold_chunk(frozenset(PLAYERS), chunk)
+        for _played_at, chunk in chunk_runs(runs, 6)
+    ]
+    initial = create_stats_state(group_data)
+
+    left_fold = state_to_partial(initial)
+    for chunk in copy.deepcopy(chunks):
+        left_fold = merge_partials(left_fold, chunk)
+
+    pairs = copy.deepcopy(chunks)
+    while len(pairs) > 1:
+        pairs = [
+            merge_partials(*pairs[i : i + 2]) if i + 1 < len(pairs) else pairs[i]
+            for i in range(0, len(pairs), 2)
+        ]
+    tree_fold = merge_partials(state_to_partial(initial), pairs[0])
+
+    assert build_stats_doc(
+        "test-group-id", partial_to_state(tree_fold, initial)
+    ) == build_stats_doc("test-group-id", partial_to_state(left_fold, initial))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_resuming_from_a_checkpointed_state(group_data, seed):
+    """Test that a sequential state can seed the merge, as checkpoints do"""
+    runs = random_runs(seed, 90)
+    split = len(runs) // 2
+
+    state = create_stats_state(group_data)
+    first_half = copy.deepcopy(runs[:split])
+    for _state, _played_at in fold_runs_sequentially(state, first_half):
+        pass
+
+    partial = state_to_partial(state)
+    for _played_at, chunk in chunk_runs(copy.deepcopy(runs[split:]), 5):
+        partial = merge_partials(partial, fold_chunk(frozenset(PLAYERS), chunk))
+
+    resumed = build_stats_doc("test-group-id", partial_to_state(partial, state))
+    assert resumed == sequential_doc(group_data, runs)
+
+
+def test_fold_runs_in_parallel_uses_worker_processes(group_data):
+    """Test the process pool path end to end"""
+    runs = random_runs(7, 200)
+    state = create_stats_state(group_data)
+
+    yielded = list(fold_runs_in_parallel(state, copy.deepcopy(runs), 2, 25))
+
+    assert len(yielded) == 8
+    final_state, played_at = yielded[-1]
+    assert played_at == runs[-1][0]
+    assert build_stats_doc("test-group-id", final_state) == sequential_doc(
+        group_data, runs
+    )
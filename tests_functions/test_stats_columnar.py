@@ -0,0 +1,75 @@
+import copy
+from unittest.mock import patch
+
+import pytest
+
+from functions.match_stats import build_stats_doc, create_stats_state
+from functions.stats_aggregate import chunk_runs, fold_chunk
+from functions.stats_columnar import fold_chunk_columnar, fold_runs_columnar
+from tests_functions.test_match_stats import make_match, run_full_recalculation
+from tests_functions.test_stats_aggregate import PLAYERS, random_runs, sequential_doc
+
+
+@pytest.fixture
+def group_data():
+    """Create mock group data with three members and three guests"""
+    return {
+        "members": {
+            "alice": {"role": "admin", "name": "Alice"},
+            "bob": {"role": "editor", "name": "Bob"},
+            "carol": {"role": "viewer", "name": "Carol"},
+        },
+        "guests": [
+            {"id": "1", "name": "Dan"},
+            {"id": "2", "name": "Eve"},
+            {"id": "3", "name": "Fay"},
+        ],
+        "teamColors": {"teamOne": "#ff0000", "teamTwo": "#0000ff"},
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_columnar_chunk_matches_python_chunk(seed, chunk_size):
+    """Test that the NumPy kernel builds the same partials as fold_chunk"""
+    runs = random_runs(seed, 150)
+    for _played_at, chunk in chunk_runs(runs, chunk_size):
+        assert fold_chunk_columnar(frozenset(PLAYERS), copy.deepcopy(chunk)) == (
+            fold_chunk(frozenset(PLAYERS), copy.deepcopy(chunk))
+        )
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size", [1, 13, 1000])
+def test_columnar_fold_matches_sequential_fold(group_data, seed, chunk_size):
+    """Test that the columnar engine writes the same groupStats"""
+    runs = random_runs(seed, 200)
+    state = create_stats_state(group_data)
+
+    folded_runs = list(fold_runs_columnar(state, copy.deepcopy(runs), chunk_size))
+    final_state, played_at = folded_runs[-1]
+
+    assert played_at == runs[-1][0]
+    assert build_stats_doc("test-group-id", final_state) == sequential_doc(
+        group_data, runs
+    )
+
+
+def test_columnar_engine_is_selectable(group_data):
+    """Test that STATS_ENGINE switches recalculate_group_stats to NumPy"""
+    matches = {
+        "m1": make_match(0, ["alice", "bob"], ["guest_1", "guest_2"], 10, 5),
+        "m2": make_match(1, ["alice"], ["guest_1"], 3, 10),
+        "m3": make_match(1, ["alice", "guest_1"], ["bob", "carol"], 10, 8, 60),
+    }
+    expected = run_full_recalculation(group_data, matches)
+
+    with (
+        patch("functions.match_stats.STATS_ENGINE", "columnar"),
+        patch(
+            "functions.match_stats.fold_runs_columnar", wraps=fold_runs_columnar
+        ) as columnar,
+    ):
+        assert run_full_recalculation(group_data, matches) == expected
+
+    columnar.assert_called_once()
@@ -0,0 +1,96 @@
+from unittest.mock import MagicMock
+
+from firebase_admin import firestore
+
+from functions.stats_players import (
+    PLAYER_HASHES_FIELD,
+    hash_player_stats,
+    plan_stats_writes,
+)
+
+
+def make_stats_ref():
+    stats_ref = MagicMock()
+    players = stats_ref.collection.return_value
+    players.document.side_effect = lambda player_id: MagicMock(id=player_id)
+    return stats_ref
+
+
+def make_summary(player_stats, **fields):
+    return {
+        "totalMatches": 3,
+        "teamColorStats": {"#ff0000": {"wins": 2, "losses": 1}},
+        **fields,
+        PLAYER_HASHES_FIELD: {
+            player_id: hash_player_stats(stats)
+            for player_id, stats in player_stats.items()
+        },
+    }
+
+
+def test_full_write_skips_unchanged_and_deletes_removed_players():
+    """Test that only changed players are written and departed ones deleted"""
+    stats_ref = make_stats_ref()
+    alice = {"displayName": "Alice", "wins": 2}
+    previous = make_summary({"alice": alice, "bob": {}, "left-member": {}})
+    stats_doc = {
+        "totalMatches": 3,
+        "teamColorStats": {"#ff0000": {"wins": 2, "losses": 1}},
+        "playerStats": {"alice": alice, "bob": {"displayName": "Bob", "wins": 1}},
+    }
+
+    writes = plan_stats_writes(stats_ref, stats_doc, previous)
+
+    assert [(ref.id, method) for ref, method, _data in writes[:-1]] == [
+        ("bob", "set"),
+        ("left-member", "delete"),
+    ]
+    summary_ref, method, updates = writes[-1]
+    assert summary_ref is stats_ref and method == "update"
+    assert set(updates) == {
+        f"{PLAYER_HASHES_FIELD}.bob",
+        f"{PLAYER_HASHES_FIELD}.`left-member`",
+    }
+    assert updates[f"{PLAYER_HASHES_FIELD}.`left-member`"] is firestore.DELETE_FIELD
+
+
+def test_summary_update_only_carries_changed_fields():
+    """Test that the summary is patched leaf by leaf and skipped when unchanged"""
+    stats_ref = make_stats_ref()
+    previous = make_summary({}, lastUpdated="earlier", playerStats={"x": {}})
+    stats_doc = {
+        "totalMatches": 3,
+        "teamColorStats": {"#ff0000": {"wins": 3, "losses": 1}},
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+    }
+
+    [(summary_ref, method, updates)] = plan_stats_writes(stats_ref, stats_doc, previous)
+
+    assert method == "update"
+    assert updates == {
+        "teamColorStats.`#ff0000`.wins": 3,
+        "playerStats": firestore.DELETE_FIELD,
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+    }
+
+    unchanged = make_summary({}, lastUpdated="earlier")
+    assert (
+        plan_stats_writes(
+            stats_ref,
+            {**stats_doc, "teamColorStats": unchanged["teamColorStats"]},
+            unchanged,
+        )
+        == []
+    )
+
+
+def test_partial_write_keeps_untouched_players():
+    """Test that a delta write leaves players outside the match alone"""
+    stats_ref = make_stats_ref()
+    previous = {PLAYER_HASHES_FIELD: {"alice": "a", "bob": "b"}}
+    stats_doc = {"playerStats": {"alice": {"displayName": "Alice", "wins": 3}}}
+
+    writes = plan_stats_writes(stats_ref, stats_doc, previous, partial=True)
+
+    assert [ref.id for ref, _method, _data in writes[:-1]] == ["alice"]
+    assert list(writes[-1][2]) == [f"{PLAYER_HASHES_FIELD}.alice"]
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from firebase_admin import firestore
+
+from functions.stats_queue import (
+    _get_recompute_window_seconds,
+    is_claimable,
+    mark_group_dirty,
+    release_group,
+)
+
+NOW = datetime(2025, 1, 1, 20, 0, tzinfo=timezone.utc)
+
+
+def test_mark_group_dirty_is_a_single_blind_write(mock_firestore_client):
+    """Test that marking a group dirty bumps the version without reading"""
+    queue_ref = mock_firestore_client.collection.return_value.document.return_value
+
+    mark_group_dirty(mock_firestore_client, "test-group-id")
+
+    mock_firestore_client.collection.assert_called_with("statsQueue")
+    queue_ref.get.assert_not_called()
+    queue_ref.set.assert_called_once()
+    data, kwargs = queue_ref.set.call_args[0][0], queue_ref.set.call_args[1]
+    assert data["dirty"] is True
+    assert isinstance(data["version"], firestore.Increment)
+    assert isinstance(data["replayFrom"], firestore.Minimum)
+    assert kwargs == {"merge": True}
+
+
+@pytest.mark.parametrize(
+    "queue_data, claimable",
+    [
+        ({"dirty": True, "version": 3}, True),
+        ({"dirty": False, "version": 3}, False),
+        ({"dirty": True, "leaseUntil": NOW + timedelta(seconds=30)}, False),
+        ({"dirty": True, "leaseUntil": NOW - timedelta(seconds=30)}, True),
+        ({"dirty": True, "lastRunAt": NOW - timedelta(seconds=10)}, False),
+        ({"dirty": True, "lastRunAt": NOW - timedelta(seconds=90)}, True),
+    ],
+)
+def test_is_claimable(queue_data, claimable):
+    """Test dirty, lease and window checks for queue entries"""
+    assert is_claimable(queue_data, NOW, window_seconds=60) is claimable
+
+
+@pytest.mark.parametrize(
+    "stored_version, succeeded, cleared",
+    [(4, True, True), (5, True, False), (4, False, False)],
+)
+def test_release_group_keeps_updates_that_arrived_mid_recompute(
+    stored_version, succeeded, cleared
+):
+    """Test that a group marked again during its recompute stays dirty"""
+    queue_doc = MagicMock()
+    queue_doc.exists = True
+    queue_doc.to_dict.return_value = {"dirty": True, "version": stored_version}
+
+    queue_ref = MagicMock()
+    queue_ref.get.return_value = queue_doc
+
+    transaction = MagicMock()
+    db = MagicMock()
+    db.transaction.return_value = transaction
+    db.collection.return_value.document.return_value = queue_ref
+
+    release_group(db, "test-group-id", 4, succeeded)
+
+    transaction.update.assert_called_once()
+    updates = transaction.update.call_args[0][1]
+    assert updates["leaseUntil"] is None
+    assert ("dirty" in updates and updates["dirty"] is False) is cleared
+
+
+@pytest.mark.parametrize("configured, window", [("10", 60), ("60", 60), ("300", 300)])
+def test_recompute_window_is_at_least_the_schedule(monkeypatch, configured, window):
+    """Test that a window shorter than the queue's schedule is raised to it"""
+    monkeypatch.setenv("STATS_RECOMPUTE_WINDOW_SECONDS", configured)
+    assert _get_recompute_window_seconds() == window
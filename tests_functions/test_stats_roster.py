@@ -0,0 +1,156 @@
+import copy
+from unittest.mock import patch
+
+import pytest
+
+from functions.match_participants import PARTICIPANTS_INDEXED_FIELD
+from functions.match_stats import on_group_update, recalculate_group_stats
+from functions.match_utils import get_group_roster
+from functions.memory_firestore import MemoryFirestore
+from functions.stats_roster import apply_roster_change_to_stats, classify_roster_change
+from tests_functions.test_match_stats import (
+    get_player_docs,
+    group_data,  # noqa: F401
+    history,  # noqa: F401
+    make_match,
+    memory_match,
+    replay_player_docs,
+    run_full_recalculation,
+    run_stats_queue,
+    write_group,
+)
+
+
+def patch_roster(stats, group_before, group_after):
+    """Apply the cheap roster path and reassemble the full stats doc"""
+    change = classify_roster_change(
+        get_group_roster(group_before), get_group_roster(group_after)
+    )
+    summary = {k: v for k, v in stats.items() if k != "playerStats"}
+    patched = apply_roster_change_to_stats(summary, stats["playerStats"], change)
+    if patched is None:
+        return None
+
+    player_stats = {
+        player_id: player
+        for player_id, player in stats["playerStats"].items()
+        if player_id not in change["removed"]
+    }
+    player_stats.update(patched.pop("playerStats"))
+    patched.pop("departedPlayers", None)
+    return {**patched, "playerStats": player_stats}
+
+
+def test_role_change_is_not_a_roster_change(group_data):  # noqa: F811
+    """Test that promoting a member leaves the roster untouched"""
+    promoted = copy.deepcopy(group_data)
+    promoted["members"]["bob"]["role"] = "admin"
+
+    change = classify_roster_change(
+        get_group_roster(group_data), get_group_roster(promoted)
+    )
+
+    assert change == {"added": {}, "removed": [], "renamed": {}}
+
+
+@pytest.mark.parametrize("edit", ["rename_member", "rename_guest", "add", "remove"])
+def test_roster_patch_matches_full_recompute(group_data, history, edit):  # noqa: F811
+    """Test that patched stats equal a replay with the new roster"""
+    group_data["guests"].append({"id": "3", "name": "Erin"})
+    history["m5"] = make_match(3, ["guest_1", "bob"], ["guest_2", "alice"], 3, 10)
+    history["m6"] = make_match(4, ["guest_3"], ["bob"], 4, 10)
+    edited = copy.deepcopy(group_data)
+    if edit == "rename_member":
+        edited["members"]["bob"]["name"] = "Robert"
+    elif edit == "rename_guest":
+        edited["guests"][0]["name"] = "Caroline"
+    elif edit == "add":
+        edited["guests"].append({"id": "4", "name": "Fred"})
+    else:
+        edited["guests"].pop(2)
+
+    stats = run_full_recalculation(group_data, history)
+    patched = patch_roster(stats, group_data, edited)
+
+    assert patched == run_full_recalculation(edited, history)
+
+
+@pytest.mark.parametrize("edit", ["remove_streak_holder", "add_former_teammate"])
+def test_roster_patch_defers_to_replay(group_data, history, edit):  # noqa: F811
+    """Test that changes which move numbers are left to a full recompute"""
+    stats = run_full_recalculation(group_data, history)
+    edited = copy.deepcopy(group_data)
+    if edit == "remove_streak_holder":
+        assert stats["longestWinStreak"]["player"] == "guest_1"
+        edited["guests"].pop(0)
+    else:
+        history["m4"] = make_match(2, ["alice", "dana"], ["bob", "guest_1"], 10, 2)
+        stats = run_full_recalculation(group_data, history)
+        edited["members"]["dana"] = {"role": "viewer", "name": "Dana"}
+
+    assert patch_roster(stats, group_data, edited) is None
+
+
+def test_rejoining_player_with_matches_needs_replay(group_data, history):  # noqa: F811
+    """Test that a departed player's matches are counted again on return"""
+    stats = run_full_recalculation(group_data, history)
+    change = {"added": {}, "removed": ["guest_2"], "renamed": {}}
+    summary = {k: v for k, v in stats.items() if k != "playerStats"}
+
+    left = apply_roster_change_to_stats(summary, stats["playerStats"], change)
+
+    assert left["departedPlayers"] == {"guest_2": True}
+    rejoin = {"added": {"guest_2": ("Dave", True)}, "removed": [], "renamed": {}}
+    assert apply_roster_change_to_stats(left, {}, rejoin) is None
+
+
+@patch("firebase_admin.firestore.client")
+def test_role_only_update_skips_recompute(
+    mock_client,
+    mock_firestore_event,
+    group_data,  # noqa: F811
+):
+    """Test that on_group_update neither patches nor queues on a role change"""
+    promoted = copy.deepcopy(group_data)
+    promoted["members"]["bob"]["role"] = "admin"
+    mock_firestore_event.data.before.to_dict.return_value = group_data
+    mock_firestore_event.data.after.to_dict.return_value = promoted
+
+    with patch("functions.match_stats.mark_group_dirty") as mark_group_dirty:
+        on_group_update.__wrapped__(mock_firestore_event)
+
+    mark_group_dirty.assert_not_called()
+    mock_client.return_value.transaction.assert_not_called()
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+@patch("firebase_admin.firestore.client")
+def test_player_who_left_through_a_replay_rejoins(
+    mock_client,
+    group_data,  # noqa: F811
+    indexed,
+):
+    """Test that a player removed by a full recompute gets their matches back"""
+    db = MemoryFirestore()
+    mock_client.return_value = db
+    group_data[PARTICIPANTS_INDEXED_FIELD] = indexed
+    db.document("groups/test-group-id").set(group_data)
+    for day in (1, 2, 3):
+        db.document(f"matches/m{day}").set(
+            memory_match(day, ["bob"], ["guest_1"], 10, day)
+        )
+    db.document("matches/m4").set(memory_match(4, ["alice"], ["guest_2"], 10, 4))
+    assert recalculate_group_stats(db, "test-group-id")
+
+    # The longest win streak is bob's, so his removal is replayed
+    without_bob = copy.deepcopy(group_data)
+    del without_bob["members"]["bob"]
+    write_group(db, without_bob)
+    run_stats_queue(db)
+    assert "bob" not in get_player_docs(db)
+
+    write_group(db, group_data)
+    run_stats_queue(db)
+
+    assert get_player_docs(db)["bob"]["wins"] == 3
+    assert get_player_docs(db) == replay_player_docs(db)